@@ -0,0 +1,38 @@
+import hashlib
+import time
+from typing import Dict, Optional
+from fastapi import Request, Response
+
+# Distingue las versiones de un proceso de las del anterior: los contadores de snapshot empiezan de nuevo al reiniciar
+_BOOT = repr(time.time())
+
+class Conditional:
+    """Validadores HTTP de una petición: ETag a partir de la versión de los datos y 304 si el cliente ya la tiene.
+
+    El ETag se calcula sin serializar la respuesta: combina path, query string (incluye ?server=),
+    la versión que pasa el endpoint (versión del snapshot, timestamp de la carga cacheada...) y el error
+    de lo que se sirve, así un fallo nuevo o la recuperación siempre cambian el ETag.
+    """
+
+    def __init__(self, request: Request, response: Response):
+        self.request = request
+        self.response = response
+        self.etag = None
+
+    def check(self, *version, error: Optional[str] = None) -> bool:
+        """Fija el ETag de la respuesta; True si coincide con If-None-Match y basta con un 304"""
+        key = repr((_BOOT, self.request.url.path, self.request.url.query, version, error)).encode("utf-8")
+        self.etag = f'W/"{hashlib.blake2b(key, digest_size=12).hexdigest()}"'
+        self.response.headers["ETag"] = self.etag
+        self.response.headers["Cache-Control"] = "no-cache"
+        if_none_match = self.request.headers.get("if-none-match")
+        if not if_none_match:
+            return False
+        return if_none_match.strip() == "*" or self.etag in (tag.strip() for tag in if_none_match.split(","))
+
+    def headers(self) -> Dict[str, str]:
+        """Cabeceras de validación para endpoints que devuelven su propio Response"""
+        return {"ETag": self.etag, "Cache-Control": "no-cache"} if self.etag else {}
+
+    def not_modified(self) -> Response:
+        return Response(status_code=304, headers=self.headers())
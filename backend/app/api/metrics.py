@@ -0,0 +1,24 @@
+import time
+from typing import Any, Dict
+from fastapi import APIRouter
+from fastapi.responses import Response
+from ..services.exporter import CONTENT_TYPE, PrometheusExporter
+from ..services.fleet import fleet
+
+router = APIRouter()
+
+exporter = PrometheusExporter(fleet)
+
+@router.get("/metrics", response_class=Response)
+async def get_metrics() -> Response:
+    """Métricas en formato de exposición de Prometheus, desde los snapshots del collector (nunca consulta SQL Server)"""
+    return Response(content=exporter.render(), media_type=CONTENT_TYPE)
+
+@router.get("/metrics/stats")
+async def get_metrics_stats() -> Dict[str, Any]:
+    """Cuántas veces se renderizó el texto y cuántas se reutilizó entre scrapes"""
+    return {
+        "timestamp": time.time(),
+        "renders": exporter.renders,
+        "reused": exporter.reused
+    }
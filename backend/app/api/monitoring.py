@@ -1,684 +1,381 @@
-from fastapi import APIRouter
-from typing import Dict, Any, List
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from typing import Dict, Any, Callable, Optional
+import asyncio
 import time
-import pymssql
+import datetime
+import math
 from ..core.config import settings
+from ..services import dmv
+from ..services.cache import response_cache
+from ..services.collector import TREND_SERIES
+from ..services.fleet import MonitoredServer, fleet
+from ..services.plan_cache import SORT_KEYS, page_groups
+from ..services.sql_executor import SqlTimeoutError
+from ..services.sql_pool import CostMeter
+from ..services.timeseries import (RESOLUTIONS, RESOLUTION_SECONDS, align_columns, columns_payload, pack_columns,
+                                   pick_resolution, prepend_older)
+from ..services.wait_stats import parse_window
+from .conditional import Conditional
+from .timing import TimedRoute, api_stats
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
-def get_sql_connection():
+def get_server(server: Optional[str] = Query(None, description="Nombre del servidor en el registro (por defecto el primero)")) -> MonitoredServer:
     try:
-        conn = pymssql.connect(
-            server=settings.sql_server_host,
-            user=settings.sql_server_user,
-            password=settings.sql_server_password,
-            port=settings.sql_server_port,
-            timeout=10
-        )
-        return conn
-    except Exception as e:
-        print(f"SQL Server connection error: {e}")
-        return None
+        return fleet.get(server)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown server {server!r}, available: {', '.join(fleet.names)}")
 
-@router.get("/system-stats")
-async def get_system_stats() -> Dict[str, Any]:
-    conn = get_sql_connection()
-    if not conn:
-        return {"timestamp": time.time(), "cpu_percent": 0, "memory_percent": 0, "disk_usage": 0, "error": "Cannot connect to SQL Server"}
-    
+async def run_dmv(srv: MonitoredServer, fetch: Callable[[], Dict[str, Any]], fallback: Dict[str, Any],
+                  timeout: Optional[float] = None, work: Optional[str] = None) -> Dict[str, Any]:
+    """Ejecuta una consulta DMV en el executor del servidor; si excede el timeout devuelve el payload de error del endpoint.
+    Con work, la consulta pasa por el throttle del servidor: se mide su coste y se rechaza si el servidor está saturado"""
+    throttle = srv.throttle if work is not None else None
+    meter = None
+    if throttle is not None:
+        allowed, reason = throttle.allow(work)
+        if not allowed:
+            return {**fallback, "timestamp": time.time(), "error": f"Throttled: {reason}", "throttled": True}
+        meter = CostMeter()
+    started = time.monotonic()
     try:
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT COUNT(*) as total_schedulers,
-                   SUM(current_tasks_count) as total_tasks,
-                   SUM(runnable_tasks_count) as total_runnable
-            FROM sys.dm_os_schedulers 
-            WHERE status = 'VISIBLE ONLINE'
-        """)
-        cpu_result = cursor.fetchone()
-        
-        if cpu_result and cpu_result[0] > 0:
-            total_schedulers = cpu_result[0]
-            total_tasks = cpu_result[1] or 0
-            total_runnable = cpu_result[2] or 0
-            avg_activity = (total_tasks + total_runnable) / total_schedulers
-            cpu_percent = min(avg_activity * 20, 100)
-            if cpu_percent < 5:
-                cpu_percent = min(15 + (total_tasks * 2), 80)
-        else:
-            cpu_percent = 10
-        
-        cursor.execute("""
-            SELECT ROUND(((total_physical_memory_kb - available_physical_memory_kb) * 100.0 / total_physical_memory_kb), 1) AS memory_usage_percent
-            FROM sys.dm_os_sys_memory
-        """)
-        memory_result = cursor.fetchone()
-        memory_percent = float(memory_result[0]) if memory_result and memory_result[0] is not None else 0
-        
-        cursor.execute("""
-            SELECT TOP 1 CAST(ROUND(((vs.total_bytes - vs.available_bytes) * 100.0 / vs.total_bytes), 1) AS DECIMAL(5,1)) AS Used_Percentage
-            FROM sys.master_files AS f
-            CROSS APPLY sys.dm_os_volume_stats(f.database_id, f.file_id) AS vs
-            WHERE f.database_id = 2
-            ORDER BY vs.total_bytes DESC
-        """)
-        disk_result = cursor.fetchone()
-        disk_usage = float(disk_result[0]) if disk_result and disk_result[0] is not None else 0
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            "timestamp": time.time(),
-            "cpu_percent": round(cpu_percent, 1),
-            "memory_percent": round(memory_percent, 1),
-            "disk_usage": round(disk_usage, 1),
-            "status": "connected_remote_server"
-        }
-        
-    except Exception as e:
-        if conn:
-            conn.close()
-        return {"timestamp": time.time(), "cpu_percent": 0, "memory_percent": 0, "disk_usage": 0, "error": f"Query failed: {str(e)}"}
+        return await srv.executor.run(fetch, timeout=timeout, meter=meter)
+    except SqlTimeoutError as e:
+        return {**fallback, "timestamp": time.time(), "error": str(e)}
+    finally:
+        if meter is not None:
+            throttle.record(work, (time.monotonic() - started) * 1000, meter.cpu_ms if meter.measured else None)
+
+async def cached_dmv(srv: MonitoredServer, key: str, ttl: float, fetch: Callable[[], Dict[str, Any]], fallback: Dict[str, Any],
+                     timeout: Optional[float] = None, work: Optional[str] = None) -> Dict[str, Any]:
+    """run_dmv detrás de la caché de respuestas; las peticiones concurrentes con la misma key comparten una sola consulta"""
+    return await response_cache.get_or_load(f"{srv.name}:{key}", ttl, lambda: run_dmv(srv, fetch, fallback, timeout, work))
+
+async def from_snapshot(srv: MonitoredServer, name: str, fetch: Callable[[], Dict[str, Any]], fallback: Dict[str, Any],
+                        part: Optional[str] = None, cond: Optional[Conditional] = None, version: tuple = ()) -> Any:
+    """Devuelve el último snapshot del collector (o una de sus partes); sólo consulta en vivo (cacheado) si aún no existe ninguno.
+    Con cond, un cliente que ya tiene esta versión del snapshot (y de lo que indique version) recibe un 304.
+    Si la última recogida falló se sirve el último snapshot bueno con stale=true y el error"""
+    snapshot = srv.collector.get(name)
+    if snapshot is not None and cond is not None and cond.check(snapshot.version, *version, error=snapshot.data.get("error")):
+        return cond.not_modified()
+    extra: Dict[str, Any] = {}
+    if snapshot is None:
+        data = await cached_dmv(srv, name, settings.cache_ttl_seconds.get(name, settings.cache_default_ttl), fetch, fallback)
+        age = 0.0
+    else:
+        if snapshot.data.get("error") and srv.collector.last_good(name) is not None:
+            extra = {"stale": True, "error": snapshot.data["error"], "circuit": srv.breaker.state}
+            snapshot = srv.collector.last_good(name)
+        data, age = snapshot.data, snapshot.age
+    if part is not None:
+        data = data.get(part) or {**fallback, "timestamp": data.get("timestamp"), "error": data.get("error")}
+    return {**data, "snapshot_age": round(age, 2), **extra}
+
+@router.get("/dashboard-snapshot")
+async def get_dashboard_snapshot(srv: MonitoredServer = Depends(get_server), cond: Conditional = Depends()) -> Any:
+    """System stats y overview del dashboard, recogidos en un único batch; overview.alerts son las alertas activas"""
+    data = await from_snapshot(srv, "dashboard_snapshot", dmv.fetch_dashboard_snapshot, {}, cond=cond,
+                               version=(srv.alerts.version,))
+    if isinstance(data, dict) and data.get("overview"):
+        data["overview"] = {**data["overview"], "alerts": srv.alerts.alerts()}
+    return data
+
+@router.get("/system-stats")
+async def get_system_stats(srv: MonitoredServer = Depends(get_server), cond: Conditional = Depends()) -> Any:
+    return await from_snapshot(srv, "dashboard_snapshot", dmv.fetch_dashboard_snapshot,
+                               {"cpu_percent": 0, "memory_percent": 0, "disk_usage": 0}, part="system_stats", cond=cond)
 
 @router.get("/dashboard-overview")
-async def get_dashboard_overview() -> Dict[str, Any]:
-    conn = get_sql_connection()
-    if not conn:
-        return {"error": "Cannot connect to SQL Server"}
-    
-    try:
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT @@SERVERNAME as server_name, SERVERPROPERTY('ProductVersion') as version, SERVERPROPERTY('Edition') as edition,
-                   DATEDIFF(day, sqlserver_start_time, GETDATE()) as uptime_days,
-                   DATEPART(hour, GETDATE() - sqlserver_start_time) as uptime_hours
-            FROM sys.dm_os_sys_info
-        """)
-        server_info = cursor.fetchone()
-        
-        cursor.execute("""
-            SELECT COUNT(*) as total_sessions, SUM(CASE WHEN status IN ('running', 'runnable') THEN 1 ELSE 0 END) as active_sessions
-            FROM sys.dm_exec_sessions WHERE is_user_process = 1
-        """)
-        session_info = cursor.fetchone()
-        
-        cursor.execute("""
-            SELECT COUNT(*) as total_databases, SUM(CASE WHEN state = 0 THEN 1 ELSE 0 END) as online_databases,
-                   SUM(CASE WHEN name NOT IN ('master', 'tempdb', 'model', 'msdb') THEN 1 ELSE 0 END) as user_databases
-            FROM sys.databases
-        """)
-        db_info = cursor.fetchone()
-        
-        cursor.execute("""
-            SELECT SUM(num_of_bytes_read + num_of_bytes_written) / 1024.0 / 1024.0 as total_io_mb
-            FROM sys.dm_io_virtual_file_stats(NULL, NULL)
-        """)
-        io_result = cursor.fetchone()
-        io_mb_total = float(io_result[0]) if io_result and io_result[0] else 0
-        
-        cursor.execute("SELECT COUNT(*) FROM sys.dm_exec_requests WHERE DATEDIFF(minute, start_time, GETDATE()) > 2")
-        long_queries = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM sys.dm_exec_requests WHERE blocking_session_id > 0")
-        blocked_sessions = cursor.fetchone()[0]
-        
-        cursor.close()
-        conn.close()
-        
-        alerts = []
-        if long_queries > 0:
-            alerts.append({"level": "warning", "message": f"{long_queries} long running queries (>2 min)", "action": "Check Performance tab"})
-        if blocked_sessions > 0:
-            alerts.append({"level": "critical", "message": f"{blocked_sessions} blocked sessions detected", "action": "Check Sessions tab"})
-        
-        return {
-            "timestamp": time.time(),
-            "server_info": {
-                "name": server_info[0],
-                "version": server_info[1][:20] + "..." if len(server_info[1]) > 20 else server_info[1],
-                "edition": server_info[2],
-                "uptime_days": server_info[3],
-                "uptime_hours": server_info[4]
-            },
-            "session_stats": {"total_sessions": session_info[0], "active_sessions": session_info[1], "blocked_sessions": blocked_sessions},
-            "database_stats": {"total_databases": db_info[0], "online_databases": db_info[1], "user_databases": db_info[2]},
-            "performance_stats": {"long_running_queries": long_queries, "total_io_mb": round(io_mb_total, 1), "deadlocks": 0},
-            "alerts": alerts
-        }
-        
-    except Exception as e:
-        if conn:
-            conn.close()
-        return {"error": f"Dashboard query failed: {str(e)}"}
+async def get_dashboard_overview(srv: MonitoredServer = Depends(get_server), cond: Conditional = Depends()) -> Any:
+    data = await from_snapshot(srv, "dashboard_snapshot", dmv.fetch_dashboard_snapshot, {}, part="overview", cond=cond,
+                               version=(srv.alerts.version,))
+    if isinstance(data, dict):
+        data["alerts"] = srv.alerts.alerts()
+    return data
+
+@router.get("/alerts")
+async def get_alerts(srv: MonitoredServer = Depends(get_server), cond: Conditional = Depends()) -> Any:
+    """Alertas activas, pendientes y resueltas recientemente; el motor las evalúa al llegar cada snapshot, aquí sólo se leen"""
+    if cond.check(srv.alerts.version):
+        return cond.not_modified()
+    return srv.alerts.status()
 
 # ===== NUEVOS ENDPOINTS PARA PERFORMANCE =====
 
+class TopQueryFilters:
+    """Parámetros comunes de los rankings de consultas"""
+
+    def __init__(
+        self,
+        limit: int = Query(10, ge=1, le=100),
+        database: Optional[str] = Query(None, description="Sólo planes de esta base de datos (consulta en vivo, cacheada)"),
+        min_executions: int = Query(0, ge=0),
+        cursor: Optional[str] = Query(None, description="next_cursor de la página anterior"),
+    ):
+        self.limit = limit
+        self.database = database
+        self.min_executions = min_executions
+        self.cursor = cursor
+
+async def ranked_queries(srv: MonitoredServer, sort: str, filters: TopQueryFilters, cond: Conditional) -> Any:
+    """Ranking desde el snapshot compartido del plan cache (o la lectura de una base de datos); sólo se consulta en vivo si aún no hay ninguno"""
+    plan_cache = srv.plan_cache
+    error = None
+    if filters.database:
+        cached = plan_cache.database_groups(filters.database)
+        if cached is not None and cond.check(cached[0]):
+            return cond.not_modified()
+        if cached is None:
+            data = await run_dmv(srv, lambda: plan_cache.fetch_database(filters.database), {}, work="plan_cache.database")
+            if data.get("error"):
+                return {"timestamp": time.time(), "error": data["error"], "throttled": data.get("throttled", False), "queries": []}
+            cached = plan_cache.database_groups(filters.database) or (data["timestamp"], [])
+            cond.check(cached[0])
+        collected_at, groups = cached
+    else:
+        snapshot = srv.collector.get("plan_cache")
+        if plan_cache.collected_at is not None and cond.check(plan_cache.collected_at, snapshot and snapshot.version,
+                                                              error=snapshot and snapshot.data.get("error")):
+            return cond.not_modified()
+        if snapshot is None and plan_cache.collected_at is None:
+            data = await run_dmv(srv, plan_cache.fetch, {})
+            if data.get("error"):
+                return {"timestamp": time.time(), "error": data["error"], "queries": []}
+        if snapshot is not None and snapshot.data.get("error"):
+            error = snapshot.data["error"]
+        collected_at, groups = plan_cache.collected_at, plan_cache.groups
+
+    try:
+        page = page_groups(groups, sort, filters.limit, filters.min_executions, filters.cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response = {
+        "timestamp": collected_at,
+        "sort": sort,
+        "database": filters.database,
+        "approximate": plan_cache.approximate,
+        **page,
+        "snapshot_age": round(time.time() - collected_at, 2)
+    }
+    if error:
+        response["error"] = error
+    return response
+
 @router.get("/top-slow-queries")
-async def get_top_slow_queries() -> Dict[str, Any]:
+async def get_top_slow_queries(filters: TopQueryFilters = Depends(), srv: MonitoredServer = Depends(get_server),
+                               cond: Conditional = Depends()) -> Any:
     """Obtiene las consultas más lentas del servidor"""
-    conn = get_sql_connection()
-    if not conn:
-        return {"error": "Cannot connect to SQL Server", "queries": []}
-    
-    try:
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT TOP 10
-                SUBSTRING(st.text, (qs.statement_start_offset/2)+1, 
-                    ((CASE qs.statement_end_offset 
-                        WHEN -1 THEN DATALENGTH(st.text)
-                        ELSE qs.statement_end_offset 
-                    END - qs.statement_start_offset)/2) + 1) AS query_text,
-                qs.total_elapsed_time / qs.execution_count AS avg_duration_ms,
-                qs.execution_count,
-                qs.total_worker_time / qs.execution_count AS avg_cpu_ms,
-                qs.last_execution_time,
-                DB_NAME(st.dbid) AS database_name,
-                qs.total_elapsed_time / 1000 AS total_duration_ms
-            FROM sys.dm_exec_query_stats qs
-            CROSS APPLY sys.dm_exec_sql_text(qs.sql_handle) st
-            WHERE st.text IS NOT NULL
-            ORDER BY qs.total_elapsed_time / qs.execution_count DESC
-        """)
-        
-        queries = []
-        for row in cursor.fetchall():
-            query_text = row[0][:100] + "..." if len(row[0]) > 100 else row[0]
-            queries.append({
-                "query": query_text.strip(),
-                "avg_duration_ms": round(float(row[1]) / 1000, 0) if row[1] else 0,  # Convertir a ms
-                "execution_count": row[2],
-                "avg_cpu_ms": round(float(row[3]) / 1000, 0) if row[3] else 0,
-                "last_execution": row[4].strftime("%Y-%m-%d %H:%M:%S") if row[4] else "N/A",
-                "database": row[5] if row[5] else "N/A",
-                "total_duration_ms": round(float(row[6]), 0) if row[6] else 0
-            })
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            "timestamp": time.time(),
-            "queries": queries
-        }
-        
-    except Exception as e:
-        if conn:
-            conn.close()
-        return {"error": f"Query failed: {str(e)}", "queries": []}
+    return await ranked_queries(srv, "avg_duration", filters, cond)
 
 @router.get("/top-frequent-queries")
-async def get_top_frequent_queries() -> Dict[str, Any]:
+async def get_top_frequent_queries(filters: TopQueryFilters = Depends(), srv: MonitoredServer = Depends(get_server),
+                                   cond: Conditional = Depends()) -> Any:
     """Obtiene las consultas más frecuentes"""
-    conn = get_sql_connection()
-    if not conn:
-        return {"error": "Cannot connect to SQL Server", "queries": []}
-    
-    try:
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT TOP 10
-                SUBSTRING(st.text, (qs.statement_start_offset/2)+1, 
-                    ((CASE qs.statement_end_offset 
-                        WHEN -1 THEN DATALENGTH(st.text)
-                        ELSE qs.statement_end_offset 
-                    END - qs.statement_start_offset)/2) + 1) AS query_text,
-                qs.execution_count,
-                qs.total_elapsed_time / qs.execution_count AS avg_duration_ms,
-                qs.total_worker_time / 1000 AS total_cpu_ms,
-                DB_NAME(st.dbid) AS database_name,
-                qs.last_execution_time
-            FROM sys.dm_exec_query_stats qs
-            CROSS APPLY sys.dm_exec_sql_text(qs.sql_handle) st
-            WHERE st.text IS NOT NULL
-            ORDER BY qs.execution_count DESC
-        """)
-        
-        queries = []
-        for row in cursor.fetchall():
-            query_text = row[0][:100] + "..." if len(row[0]) > 100 else row[0]
-            queries.append({
-                "query": query_text.strip(),
-                "execution_count": row[1],
-                "avg_duration_ms": round(float(row[2]) / 1000, 0) if row[2] else 0,
-                "total_cpu_ms": round(float(row[3]), 0) if row[3] else 0,
-                "database": row[4] if row[4] else "N/A",
-                "last_execution": row[5].strftime("%Y-%m-%d %H:%M:%S") if row[5] else "N/A"
-            })
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            "timestamp": time.time(),
-            "queries": queries
-        }
-        
-    except Exception as e:
-        if conn:
-            conn.close()
-        return {"error": f"Query failed: {str(e)}", "queries": []}
+    return await ranked_queries(srv, "executions", filters, cond)
+
+@router.get("/top-queries")
+async def get_top_queries(
+    sort: str = Query("avg_duration", description=f"Orden: {', '.join(SORT_KEYS)}"),
+    filters: TopQueryFilters = Depends(),
+    srv: MonitoredServer = Depends(get_server),
+    cond: Conditional = Depends(),
+) -> Any:
+    """Cualquier ranking del plan cache, servido desde memoria"""
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(SORT_KEYS)}")
+    return await ranked_queries(srv, sort, filters, cond)
 
 @router.get("/wait-types-stats")
-async def get_wait_types_stats() -> Dict[str, Any]:
-    """Obtiene estadísticas de wait types mejoradas"""
-    conn = get_sql_connection()
-    if not conn:
-        return {"error": "Cannot connect to SQL Server", "waits": {}}
-    
+async def get_wait_types_stats(window: str = Query("5m", description="Ventana: 60s, 15m, 1h..."),
+                               srv: MonitoredServer = Depends(get_server), cond: Conditional = Depends()) -> Any:
+    """Wait stats del intervalo (deltas entre snapshots de sys.dm_os_wait_stats), no acumulados desde el arranque"""
     try:
-        cursor = conn.cursor()
-        
-        # Query mejorada para wait types más específica y con mejores cálculos
-        cursor.execute("""
-            WITH FilteredWaits AS (
-                SELECT 
-                    wait_type,
-                    waiting_tasks_count,
-                    wait_time_ms,
-                    signal_wait_time_ms,
-                    wait_time_ms - signal_wait_time_ms AS resource_wait_time_ms
-                FROM sys.dm_os_wait_stats
-                WHERE wait_type NOT IN (
-                    'CLR_SEMAPHORE', 'LAZYWRITER_SLEEP', 'RESOURCE_QUEUE', 'SLEEP_TASK',
-                    'SLEEP_SYSTEMTASK', 'SQLTRACE_BUFFER_FLUSH', 'WAITFOR', 'LOGMGR_QUEUE',
-                    'CHECKPOINT_QUEUE', 'REQUEST_FOR_DEADLOCK_SEARCH', 'XE_TIMER_EVENT',
-                    'BROKER_TO_FLUSH', 'BROKER_TASK_STOP', 'CLR_MANUAL_EVENT',
-                    'CLR_AUTO_EVENT', 'DISPATCHER_QUEUE_SEMAPHORE', 'FT_IFTS_SCHEDULER_IDLE_WAIT',
-                    'XE_DISPATCHER_WAIT', 'XE_DISPATCHER_JOIN', 'SQLTRACE_INCREMENTAL_FLUSH_SLEEP',
-                    'SP_SERVER_DIAGNOSTICS_SLEEP', 'HADR_FILESTREAM_IOMGR_IOCOMPLETION', 
-                    'BROKER_EVENTHANDLER', 'BROKER_RECEIVE_WAITFOR', 'BROKER_TASK_STOP',
-                    'DIRTY_PAGE_POLL', 'HADR_DATABASE_WAIT_FOR_TRANSITION_TO_VERSIONING'
-                )
-                AND waiting_tasks_count > 0
-                AND wait_time_ms > 0
-            ),
-            WaitStats AS (
-                SELECT 
-                    SUM(wait_time_ms) AS total_wait_time,
-                    SUM(CASE WHEN wait_type LIKE '%CPU%' OR wait_type LIKE '%SOS_SCHEDULER_YIELD%' 
-                             OR wait_type LIKE '%THREADPOOL%' OR wait_type LIKE '%SOS_WORK_DISPATCHER%'
-                        THEN wait_time_ms ELSE 0 END) AS cpu_waits,
-                    SUM(CASE WHEN wait_type LIKE '%PAGEIOLATCH%' OR wait_type LIKE '%WRITELOG%' 
-                             OR wait_type LIKE '%IO_COMPLETION%' OR wait_type LIKE '%BACKUPTHREAD%'
-                             OR wait_type LIKE '%ASYNC_IO_COMPLETION%' OR wait_type LIKE '%DISKIO_SUSPEND%'
-                        THEN wait_time_ms ELSE 0 END) AS io_waits,
-                    SUM(CASE WHEN wait_type LIKE '%LCK_%' OR wait_type LIKE '%LOCK_%' 
-                             OR wait_type LIKE '%DEADLOCK%' OR wait_type LIKE '%LATCH_%'
-                        THEN wait_time_ms ELSE 0 END) AS lock_waits,
-                    SUM(CASE WHEN wait_type LIKE '%RESOURCE_SEMAPHORE%' OR wait_type LIKE '%MEMORY_%' 
-                             OR wait_type LIKE '%CMEMTHREAD%' OR wait_type LIKE '%PWAIT_RESOURCE_SEMAPHORE_FT%'
-                        THEN wait_time_ms ELSE 0 END) AS memory_waits,
-                    COUNT(*) AS total_wait_types
-                FROM FilteredWaits
-            )
-            SELECT 
-                CASE WHEN total_wait_time > 0 THEN ROUND((cpu_waits * 100.0 / total_wait_time), 1) ELSE 0 END AS cpu_wait_percent,
-                CASE WHEN total_wait_time > 0 THEN ROUND((io_waits * 100.0 / total_wait_time), 1) ELSE 0 END AS io_wait_percent,
-                CASE WHEN total_wait_time > 0 THEN ROUND((lock_waits * 100.0 / total_wait_time), 1) ELSE 0 END AS lock_wait_percent,
-                CASE WHEN total_wait_time > 0 THEN ROUND((memory_waits * 100.0 / total_wait_time), 1) ELSE 0 END AS memory_wait_percent,
-                total_wait_types,
-                total_wait_time
-            FROM WaitStats
-        """)
-        
-        result = cursor.fetchone()
-        
-        if result:
-            cpu_wait_percent = float(result[0]) if result[0] is not None else 0
-            io_wait_percent = float(result[1]) if result[1] is not None else 0
-            lock_wait_percent = float(result[2]) if result[2] is not None else 0
-            memory_wait_percent = float(result[3]) if result[3] is not None else 0
-            total_wait_types = result[4] if result[4] is not None else 0
-            total_wait_time = float(result[5]) if result[5] is not None else 0
-        else:
-            # Si no hay datos, asignar valores por defecto más realistas
-            cpu_wait_percent = 15.5
-            io_wait_percent = 35.2
-            lock_wait_percent = 5.8
-            memory_wait_percent = 8.1
-            total_wait_types = 0
-            total_wait_time = 0
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            "timestamp": time.time(),
-            "waits": {
-                "cpu_wait_percent": round(cpu_wait_percent, 1),
-                "io_wait_percent": round(io_wait_percent, 1),
-                "lock_wait_percent": round(lock_wait_percent, 1),
-                "memory_wait_percent": round(memory_wait_percent, 1),
-                "total_waits": total_wait_types,
-                "total_wait_time_ms": round(total_wait_time, 0)
-            }
-        }
-        
-    except Exception as e:
-        if conn:
-            conn.close()
-        # En caso de error, devolver datos simulados realistas
-        return {
-            "timestamp": time.time(),
-            "waits": {
-                "cpu_wait_percent": 12.3,
-                "io_wait_percent": 42.7,
-                "lock_wait_percent": 8.9,
-                "memory_wait_percent": 6.4,
-                "total_waits": 0
-            },
-            "error": f"Query failed but showing estimated values: {str(e)}"
-        }
+        seconds = parse_window(window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    snapshot = srv.collector.get("wait_stats")
+    if snapshot is not None and cond.check(snapshot.version, error=snapshot.data.get("error")):
+        return cond.not_modified()
+    wait_tracker = srv.wait_tracker
+    if not len(wait_tracker):
+        # Sin histórico todavía: una lectura en vivo; con una sola muestra la ventana es el acumulado desde el
+        # arranque de la instancia (cumulative=true, complete=false) hasta que el collector añada la siguiente
+        data = await run_dmv(srv, dmv.fetch_wait_stats_counters, {})
+        if data.get("error"):
+            return {"timestamp": time.time(), "error": data["error"]}
+        wait_tracker.add(data["timestamp"], data["counters"], data["sqlserver_start_time"])
+    
+    return {
+        "timestamp": time.time(),
+        "window": window,
+        "waits": wait_tracker.window(seconds)
+    }
 
 @router.get("/missing-indexes")
-async def get_missing_indexes() -> Dict[str, Any]:
+async def get_missing_indexes(srv: MonitoredServer = Depends(get_server), cond: Conditional = Depends()) -> Any:
     """Obtiene recomendaciones de índices faltantes"""
-    conn = get_sql_connection()
-    if not conn:
-        return {"error": "Cannot connect to SQL Server", "indexes": []}
-    
-    try:
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT TOP 10
-                DB_NAME(mid.database_id) AS database_name,
-                OBJECT_NAME(mid.object_id, mid.database_id) AS table_name,
-                mid.equality_columns + ISNULL(', ' + mid.inequality_columns, '') AS suggested_columns,
-                migs.user_seeks + migs.user_scans AS total_seeks_scans,
-                CAST(migs.avg_total_user_cost * migs.avg_user_impact / 100.0 AS DECIMAL(18,2)) AS improvement_measure,
-                CASE 
-                    WHEN migs.avg_user_impact > 80 THEN 'Alto'
-                    WHEN migs.avg_user_impact > 50 THEN 'Medio'
-                    ELSE 'Bajo'
-                END AS impact_level
-            FROM sys.dm_db_missing_index_details mid
-            INNER JOIN sys.dm_db_missing_index_groups mig ON mid.index_handle = mig.index_handle
-            INNER JOIN sys.dm_db_missing_index_group_stats migs ON mig.index_group_handle = migs.group_handle
-            WHERE mid.database_id > 4  -- Solo bases de datos de usuario
-            ORDER BY improvement_measure DESC
-        """)
-        
-        indexes = []
-        for row in cursor.fetchall():
-            indexes.append({
-                "database": row[0] if row[0] else "N/A",
-                "table": row[1] if row[1] else "N/A",
-                "suggested_columns": row[2] if row[2] else "N/A",
-                "seeks_scans": row[3] if row[3] else 0,
-                "improvement_measure": float(row[4]) if row[4] else 0,
-                "impact_level": row[5] if row[5] else "Bajo"
-            })
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            "timestamp": time.time(),
-            "indexes": indexes
-        }
-        
-    except Exception as e:
-        if conn:
-            conn.close()
-        return {"error": f"Query failed: {str(e)}", "indexes": []}
+    data = await cached_dmv(srv, "missing_indexes", settings.cache_ttl_seconds["missing_indexes"], dmv.fetch_missing_indexes, {"indexes": []},
+                            work="missing_indexes")
+    # Mientras la entrada cacheada viva su timestamp no cambia: sirve de versión (los errores no se cachean, llevan el suyo)
+    if cond.check(data.get("timestamp"), error=data.get("error")):
+        return cond.not_modified()
+    return data
 
 @router.get("/index-fragmentation")
-async def get_index_fragmentation() -> Dict[str, Any]:
-    """Obtiene información de fragmentación de índices de todas las bases de datos de usuario"""
-    conn = get_sql_connection()
-    if not conn:
-        return {"error": "Cannot connect to SQL Server", "indexes": []}
-    
-    try:
-        cursor = conn.cursor()
-        
-        # Primero obtenemos todas las bases de datos de usuario (excluyendo las del sistema)
-        cursor.execute("""
-            SELECT name, database_id 
-            FROM sys.databases 
-            WHERE database_id > 4  -- Excluir master, tempdb, model, msdb
-              AND state = 0        -- Solo bases de datos ONLINE
-              AND is_read_only = 0 -- Solo bases de datos de lectura/escritura
-            ORDER BY name
-        """)
-        
-        user_databases = cursor.fetchall()
-        all_indexes = []
-        
-        # Si no hay bases de datos de usuario, retornar vacío
-        if not user_databases:
-            cursor.close()
-            conn.close()
-            return {
-                "timestamp": time.time(),
-                "indexes": [],
-                "message": "No user databases found"
-            }
-        
-        # Recorrer cada base de datos de usuario
-        for db_name, db_id in user_databases:
-            try:
-                # Construir y ejecutar la consulta dinámicamente para cada BD
-                query = f"""
-                    USE [{db_name}];
-                    
-                    SELECT TOP 10
-                        '{db_name}' AS database_name,
-                        OBJECT_NAME(ips.object_id) AS table_name,
-                        i.name AS index_name,
-                        ips.avg_fragmentation_in_percent,
-                        ips.page_count,
-                        CASE 
-                            WHEN ips.avg_fragmentation_in_percent > 30 THEN 'REBUILD'
-                            WHEN ips.avg_fragmentation_in_percent > 10 THEN 'REORGANIZE'
-                            ELSE 'OK'
-                        END AS recommendation
-                    FROM sys.dm_db_index_physical_stats(DB_ID(), NULL, NULL, NULL, 'LIMITED') ips
-                    INNER JOIN sys.indexes i ON ips.object_id = i.object_id AND ips.index_id = i.index_id
-                    WHERE ips.avg_fragmentation_in_percent > 5
-                      AND ips.page_count > 100  -- Solo índices con suficientes páginas
-                      AND i.index_id > 0  -- Excluir heaps
-                      AND ips.object_id > 100  -- Excluir objetos del sistema
-                    ORDER BY ips.avg_fragmentation_in_percent DESC
-                """
-                
-                cursor.execute(query)
-                db_indexes = cursor.fetchall()
-                
-                # Agregar los índices de esta BD al resultado total
-                for row in db_indexes:
-                    all_indexes.append({
-                        "database": row[0] if row[0] else "N/A",
-                        "table": row[1] if row[1] else "N/A",
-                        "index_name": row[2] if row[2] else "N/A", 
-                        "fragmentation_percent": round(float(row[3]), 1) if row[3] else 0,
-                        "page_count": row[4] if row[4] else 0,
-                        "recommendation": row[5] if row[5] else "OK"
-                    })
-                    
-            except Exception as db_error:
-                # Si hay error en una BD específica, continuar con las demás
-                print(f"Error processing database {db_name}: {db_error}")
-                continue
-        
-        # Ordenar todos los índices por fragmentación descendente y tomar solo los top 20
-        all_indexes.sort(key=lambda x: x["fragmentation_percent"], reverse=True)
-        top_indexes = all_indexes[:20]
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            "timestamp": time.time(),
-            "indexes": top_indexes,
-            "databases_processed": len(user_databases),
-            "total_fragmented_indexes": len(all_indexes)
-        }
-        
-    except Exception as e:
-        if conn:
-            conn.close()
-        return {"error": f"Query failed: {str(e)}", "indexes": []}
+async def get_index_fragmentation(srv: MonitoredServer = Depends(get_server), cond: Conditional = Depends()) -> Any:
+    """Fragmentación de índices de todas las BD de usuario, desde el escaneo en segundo plano (parcial mientras corre)"""
+    if not srv.fragmentation.scanning and srv.fragmentation.status()["state"] == "idle":
+        srv.fragmentation.start_scan()
+    if cond.check(srv.fragmentation.version, srv.fragmentation.scanning):
+        return cond.not_modified()
+    return srv.fragmentation.results()
+
+@router.get("/index-fragmentation/status")
+async def get_index_fragmentation_status(srv: MonitoredServer = Depends(get_server)) -> Dict[str, Any]:
+    """Progreso del escaneo de fragmentación"""
+    return {
+        "timestamp": time.time(),
+        **srv.fragmentation.status()
+    }
+
+@router.post("/index-fragmentation/scan", status_code=202)
+async def start_index_fragmentation_scan(force: bool = Query(False, description="Reescanear también las BD sin cambios"),
+                                          srv: MonitoredServer = Depends(get_server)) -> Dict[str, Any]:
+    """Lanza un escaneo de fragmentación (si no hay uno en curso) y devuelve su estado"""
+    return {
+        "timestamp": time.time(),
+        **srv.fragmentation.start_scan(force)
+    }
+
+@router.get("/blocking-chains")
+async def get_blocking_chains(srv: MonitoredServer = Depends(get_server), cond: Conditional = Depends()) -> Any:
+    """Árbol de bloqueos por head blocker: profundidad de la cadena, espera total de las sesiones bloqueadas y sentencia"""
+    data = await cached_dmv(srv, "blocking_chains", settings.cache_ttl_seconds["blocking_chains"],
+                            dmv.fetch_blocking_chains, {"chains": []})
+    if cond.check(data.get("timestamp"), error=data.get("error")):
+        return cond.not_modified()
+    return data
+
+@router.get("/pool-stats")
+async def get_pool_stats(srv: MonitoredServer = Depends(get_server)) -> Dict[str, Any]:
+    """Estado del pool de conexiones y del executor de consultas"""
+    return {
+        "timestamp": time.time(),
+        "server": srv.name,
+        "pool": srv.pool.stats(),
+        "slow_pool": srv.slow_pool.stats(),
+        "circuit": srv.breaker.status(),
+        "executor": srv.executor.stats()
+    }
+
+@router.get("/cache-stats")
+async def get_cache_stats() -> Dict[str, Any]:
+    """Contadores de la caché de respuestas (hits, misses, peticiones coalescidas)"""
+    return {
+        "timestamp": time.time(),
+        "cache": response_cache.stats()
+    }
+
+@router.get("/internal/query-stats")
+async def get_query_stats(srv: MonitoredServer = Depends(get_server), reset: bool = False) -> Dict[str, Any]:
+    """Histogramas de latencia por consulta DMV y conexión del servidor, y por ruta/serialización de la API"""
+    response = {
+        "timestamp": time.time(),
+        "sql": srv.query_stats.snapshot(),
+        "api": api_stats.snapshot()
+    }
+    if reset:
+        srv.query_stats.reset()
+        api_stats.reset()
+    return response
+
+@router.get("/collector-status")
+async def get_collector_status(srv: MonitoredServer = Depends(get_server)) -> Dict[str, Any]:
+    """Estado de los jobs del collector en segundo plano"""
+    return {
+        "timestamp": time.time(),
+        "server": srv.name,
+        **srv.collector.status(),
+        "plan_cache": srv.plan_cache.stats(),
+        "throttle": srv.throttle.status() if srv.throttle is not None else None,
+        "websocket": srv.broadcaster.stats(),
+        "metric_archive": srv.archive.stats() if srv.archive is not None else None
+    }
+
+@router.get("/servers")
+async def get_servers() -> Dict[str, Any]:
+    """Servidores del registro; el primero es el que se usa si no se indica ?server="""
+    return {
+        "timestamp": time.time(),
+        "default": fleet.names[0] if fleet.names else None,
+        "servers": [{"name": srv.name, "host": srv.config.host, "port": srv.config.port} for srv in fleet.servers()]
+    }
+
+@router.get("/fleet-summary")
+async def get_fleet_summary() -> Dict[str, Any]:
+    """Métricas clave de todas las instancias en una sola respuesta, desde los snapshots de cada collector"""
+    return fleet.summary()
 
 # ===== NUEVO ENDPOINT PARA PERFORMANCE TRENDS =====
 
 @router.get("/performance-trends")
-async def get_performance_trends() -> Dict[str, Any]:
-    """Obtiene tendencias de performance simuladas para el gráfico de 24h"""
-    conn = get_sql_connection()
-    if not conn:
-        return {"error": "Cannot connect to SQL Server", "trends": []}
+async def get_performance_trends(
+    hours: float = Query(24, gt=0, le=24 * 90),
+    resolution: str = Query("auto"),
+    stat: str = Query("avg", pattern="^(avg|min|max)$"),
+    fmt: str = Query("rows", alias="format", pattern="^(rows|columns|binary)$",
+                     description="rows: un objeto por punto; columns: un array por serie; binary: typed arrays (ver timeseries.pack_columns)"),
+    srv: MonitoredServer = Depends(get_server),
+    cond: Conditional = Depends(),
+) -> Any:
+    """Tendencias de performance desde el histórico en memoria (raw, 1m, 1h) y, si hace falta, del archivo en disco"""
+    # Cada snapshot del dashboard añade un punto: sin snapshot nuevo la respuesta es la misma
+    snapshot = srv.collector.get("dashboard_snapshot")
+    if snapshot is not None and cond.check(snapshot.version):
+        return cond.not_modified()
+    if resolution == "auto":
+        resolution = pick_resolution(hours * 3600)
+    elif resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of auto, {', '.join(RESOLUTIONS)}")
     
-    try:
-        cursor = conn.cursor()
-        
-        # Obtener métricas actuales reales
-        cursor.execute("""
-            SELECT 
-                -- CPU metrics
-                (SELECT COUNT(*) FROM sys.dm_os_schedulers WHERE status = 'VISIBLE ONLINE') as schedulers,
-                (SELECT SUM(current_tasks_count) FROM sys.dm_os_schedulers WHERE status = 'VISIBLE ONLINE') as total_tasks,
-                
-                -- Memory metrics  
-                (SELECT ROUND(((total_physical_memory_kb - available_physical_memory_kb) * 100.0 / total_physical_memory_kb), 1) 
-                 FROM sys.dm_os_sys_memory) AS memory_usage_percent,
-                
-                -- Session metrics
-                (SELECT COUNT(*) FROM sys.dm_exec_sessions WHERE is_user_process = 1) as total_sessions,
-                (SELECT COUNT(*) FROM sys.dm_exec_sessions WHERE is_user_process = 1 AND status IN ('running', 'runnable')) as active_sessions,
-                
-                -- IO metrics
-                (SELECT SUM(num_of_bytes_read + num_of_bytes_written) / 1024.0 / 1024.0 FROM sys.dm_io_virtual_file_stats(NULL, NULL)) as total_io_mb
-        """)
-        
-        result = cursor.fetchone()
-        
-        if result:
-            schedulers = result[0] or 4
-            total_tasks = result[1] or 0
-            current_memory = float(result[2]) if result[2] is not None else 45.0
-            total_sessions = result[3] or 10
-            active_sessions = result[4] or 2
-            total_io_mb = float(result[5]) if result[5] is not None else 100.0
-            
-            # Calcular CPU actual
-            avg_activity = (total_tasks) / schedulers if schedulers > 0 else 0
-            current_cpu = min(avg_activity * 20, 100) if avg_activity > 0 else 25.0
-            if current_cpu < 5:
-                current_cpu = min(15 + (total_tasks * 2), 80)
-        else:
-            current_cpu = 25.0
-            current_memory = 45.0
-            total_sessions = 10
-            active_sessions = 2
-            total_io_mb = 100.0
-        
-        cursor.close()
-        conn.close()
-        
-        # Generar datos de tendencia para las últimas 24 horas (simulado pero basado en métricas reales)
-        import datetime
-        import random
-        
-        trends = []
-        now = datetime.datetime.now()
-        
-        # Generar 24 puntos de datos (una por hora)
-        for i in range(24, 0, -1):
-            timestamp = now - datetime.timedelta(hours=i)
-            
-            # Variaciones realistas basadas en métricas actuales
-            cpu_variation = random.uniform(-15, 15)
-            memory_variation = random.uniform(-10, 10)
-            
-            # Simular patrones de uso más altos durante horas laborales
-            hour = timestamp.hour
-            if 8 <= hour <= 18:  # Horas laborales
-                cpu_multiplier = 1.2
-                memory_multiplier = 1.1
-            elif 22 <= hour or hour <= 6:  # Horas nocturnas
-                cpu_multiplier = 0.7
-                memory_multiplier = 0.9
-            else:
-                cpu_multiplier = 1.0
-                memory_multiplier = 1.0
-            
-            # Calcular valores con variaciones
-            cpu_value = max(5, min(95, (current_cpu * cpu_multiplier) + cpu_variation))
-            memory_value = max(10, min(90, (current_memory * memory_multiplier) + memory_variation))
-            
-            trends.append({
-                "timestamp": timestamp.strftime("%H:%M"),
-                "cpu_percent": round(cpu_value, 1),
-                "memory_percent": round(memory_value, 1),
-                "sessions": max(1, int(total_sessions + random.uniform(-5, 10))),
-                "active_sessions": max(0, int(active_sessions + random.uniform(-2, 5))),
-                "io_mb": round(total_io_mb + random.uniform(-50, 100), 1)
-            })
-        
-        return {
-            "timestamp": time.time(),
-            "trends": trends,
-            "current_metrics": {
-                "cpu_percent": round(current_cpu, 1),
-                "memory_percent": round(current_memory, 1),
-                "total_sessions": total_sessions,
-                "active_sessions": active_sessions,
-                "io_mb": round(total_io_mb, 1)
-            }
-        }
-        
-    except Exception as e:
-        if conn:
-            conn.close()
-        
-        # En caso de error, generar datos simulados más realistas
-        import datetime
-        import random
-        
+    metric_store = srv.metric_store
+    end = time.time()
+    start = end - hours * 3600
+    series = metric_store.query(TREND_SERIES, start, end, resolution, stat)
+    
+    # Lo que ya no está en memoria (reinicio, o más antiguo que los rings) se lee del histórico en disco,
+    # hasta el primer punto en memoria de la serie que empiece más tarde; cada serie se completa por separado
+    firsts = [series[name][0][0] if name in series and len(series[name][0]) else end for name in TREND_SERIES]
+    if srv.archive is not None and max(firsts) > start:
+        archived = await asyncio.to_thread(srv.archive.query, list(TREND_SERIES), start, max(firsts),
+                                           RESOLUTION_SECONDS[resolution], stat)
+        prepend_older(series, archived)
+    
+    current_metrics = {}
+    for name in TREND_SERIES:
+        last = metric_store.latest(name)
+        if last:
+            current_metrics[name] = round(last[1], 1)
+    
+    meta = {"timestamp": time.time(), "resolution": resolution, "stat": stat, "current_metrics": current_metrics}
+    timestamps, columns = align_columns(series, list(TREND_SERIES))
+    if fmt == "binary":
+        return Response(content=pack_columns(timestamps, columns, meta), media_type="application/octet-stream",
+                        headers=cond.headers())
+    
+    if fmt == "columns":
+        response = {**meta, **columns_payload(timestamps, columns)}
+    else:
+        label_format = "%H:%M" if hours <= 24 else "%d/%m %H:%M"
         trends = []
-        now = datetime.datetime.now()
-        
-        for i in range(24, 0, -1):
-            timestamp = now - datetime.timedelta(hours=i)
-            hour = timestamp.hour
-            
-            # Patrones realistas por hora del día
-            if 8 <= hour <= 18:  # Horas laborales
-                base_cpu = random.uniform(30, 70)
-                base_memory = random.uniform(50, 80)
-            elif 22 <= hour or hour <= 6:  # Madrugada
-                base_cpu = random.uniform(10, 25)
-                base_memory = random.uniform(20, 40)
-            else:  # Tarde/noche
-                base_cpu = random.uniform(20, 45)
-                base_memory = random.uniform(35, 60)
-            
-            trends.append({
-                "timestamp": timestamp.strftime("%H:%M"),
-                "cpu_percent": round(base_cpu, 1),
-                "memory_percent": round(base_memory, 1),
-                "sessions": random.randint(5, 25),
-                "active_sessions": random.randint(1, 8),
-                "io_mb": round(random.uniform(50, 300), 1)
-            })
-        
-        return {
-            "timestamp": time.time(),
-            "trends": trends,
-            "error": f"Using simulated data due to: {str(e)}",
-            "current_metrics": {
-                "cpu_percent": 35.2,
-                "memory_percent": 58.7,
-                "total_sessions": 12,
-                "active_sessions": 4,
-                "io_mb": 156.3
-            }
-        }
\ No newline at end of file
+        for i, ts in enumerate(timestamps):
+            point = {"timestamp": datetime.datetime.fromtimestamp(ts).strftime(label_format)}
+            for name, values in columns.items():
+                point[name] = None if math.isnan(values[i]) else round(values[i], 1)
+            trends.append(point)
+        response = {**meta, "trends": trends}
+    if not len(timestamps):
+        response["message"] = "No samples collected yet"
+    return response
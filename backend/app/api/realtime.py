@@ -0,0 +1,76 @@
+import asyncio
+import json
+from typing import Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from ..services.fleet import fleet
+from ..services.realtime import Broadcaster, Subscriber, TOPICS
+
+router = APIRouter()
+
+def parse_topics(topics) -> set:
+    if isinstance(topics, str):
+        topics = topics.split(",")
+    elif not isinstance(topics, list):
+        return set()
+    return {t.strip() for t in topics if isinstance(t, str) and t.strip() in TOPICS}
+
+ACTIONS = ("subscribe", "unsubscribe", "resync")
+
+async def receive_commands(websocket: WebSocket, broadcaster: Broadcaster, subscriber: Subscriber):
+    """Mensajes del cliente: {"action": "subscribe" | "unsubscribe" | "resync", "topics": [...]}.
+    resync pide el estado completo de los topics que se publican como deltas (session_list).
+    Un mensaje que no es un objeto JSON con una action conocida recibe un frame de error y se ignora"""
+    while True:
+        text = await websocket.receive_text()
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict) or message.get("action") not in ACTIONS:
+            await websocket.send_json({"type": "error",
+                                       "error": f"Invalid command: expected a JSON object with action {', '.join(ACTIONS)}"})
+            continue
+        topics = parse_topics(message.get("topics"))
+        if message["action"] == "subscribe":
+            new_topics = topics - subscriber.topics
+            subscriber.topics |= topics
+            broadcaster.send_snapshot(subscriber, new_topics)
+        elif message["action"] == "unsubscribe":
+            subscriber.topics -= topics
+        else:
+            broadcaster.send_snapshot(subscriber, topics & subscriber.topics)
+            continue
+        await websocket.send_json({"type": "subscribed", "topics": sorted(subscriber.topics)})
+
+@router.websocket("/ws/monitoring")
+async def monitoring_stream(websocket: WebSocket, topics: str = ",".join(TOPICS), server: Optional[str] = None):
+    try:
+        broadcaster = fleet.get(server).broadcaster
+    except KeyError:
+        await websocket.close(code=1008, reason=f"Unknown server {server!r}")
+        return
+    await websocket.accept()
+    subscriber = broadcaster.subscribe(websocket, parse_topics(topics))
+    await websocket.send_json({"type": "subscribed", "topics": sorted(subscriber.topics)})
+    broadcaster.send_snapshot(subscriber, subscriber.topics)
+    
+    pump = asyncio.create_task(broadcaster.pump(subscriber))
+    commands = asyncio.create_task(receive_commands(websocket, broadcaster, subscriber))
+    try:
+        done, _ = await asyncio.wait({pump, commands}, return_when=asyncio.FIRST_COMPLETED)
+        task = pump if pump in done else commands
+        error = task.exception()
+        if task is pump and error is None:
+            # El broadcaster lo desconectó por no consumir los mensajes a tiempo
+            await websocket.close(code=1013, reason="Client too slow")
+        elif error is not None and not isinstance(error, WebSocketDisconnect):
+            print(f"Real-time stream error: {error!r}")
+            await websocket.close(code=1011, reason="Internal error")
+    except (WebSocketDisconnect, RuntimeError):
+        # El socket ya estaba cerrado
+        pass
+    finally:
+        broadcaster.unsubscribe(subscriber)
+        for task in (pump, commands):
+            task.cancel()
+        await asyncio.gather(pump, commands, return_exceptions=True)
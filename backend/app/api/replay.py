@@ -0,0 +1,31 @@
+import time
+from typing import Any, Dict, Optional
+from fastapi import APIRouter, HTTPException, Query
+from ..core.config import settings
+from ..services.capture import capture_status, parse_time, replay_clock, replay_status
+
+router = APIRouter()
+
+@router.get("/replay")
+async def get_replay() -> Dict[str, Any]:
+    """Modo de captura/replay: posición del reloj de replay y rango capturado por host, o estado de la captura"""
+    return {
+        "timestamp": time.time(),
+        "backend": settings.sql_backend,
+        "capture_enabled": settings.dmv_capture_enabled,
+        "capture": capture_status(),
+        "replay": replay_status() if settings.sql_backend == "replay" else None
+    }
+
+@router.post("/replay/seek")
+async def seek_replay(at: str = Query(..., description="Instante a reproducir: epoch o ISO 8601 (UTC si no lleva zona)"),
+                      speed: Optional[float] = Query(None, gt=0, description="Velocidad del reloj (1 = tiempo real)")) -> Dict[str, Any]:
+    """Mueve el reloj de replay; los snapshots del collector se ponen al día en su siguiente recogida"""
+    if settings.sql_backend != "replay":
+        raise HTTPException(status_code=409, detail="Not in replay mode (SQL_BACKEND=replay)")
+    try:
+        position = parse_time(at)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    replay_clock.seek(position, speed)
+    return {"timestamp": time.time(), **replay_status()}
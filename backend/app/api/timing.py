@@ -0,0 +1,39 @@
+import time
+from contextvars import ContextVar
+from typing import Any, Callable
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from ..services.query_stats import QueryStats
+
+# Tiempos del lado de la API (petición completa y render del JSON), comunes a todos los servidores
+api_stats = QueryStats("api")
+
+_current_route: ContextVar[str] = ContextVar("current_route", default="other")
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse que registra cuánto tarda el render del cuerpo, por ruta"""
+
+    def render(self, content: Any) -> bytes:
+        started = time.perf_counter()
+        body = super().render(content)
+        api_stats.record("serialize", _current_route.get(), (time.perf_counter() - started) * 1000)
+        return body
+
+class TimedRoute(APIRoute):
+    """Ruta que registra el tiempo total de cada petición y deja su path a mano para TimedJSONResponse"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        path = f"{','.join(sorted(self.methods))} {self.path}"
+
+        async def timed_handler(request: Request) -> Response:
+            token = _current_route.set(path)
+            started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                api_stats.record("route", path, (time.perf_counter() - started) * 1000)
+                _current_route.reset(token)
+
+        return timed_handler
@@ -1,3 +1,4 @@
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -5,10 +6,89 @@ class Settings(BaseSettings):
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
     redis_url: str = "redis://redis:6379"
-    sql_server_host: str
+    sql_server_host: str = ""
     sql_server_user: str = "sa"
-    sql_server_password: str
+    sql_server_password: str = ""
     sql_server_port: int = 1433
+    sql_server_name: str = "default"
+    sql_servers_file: str = ""
+    sql_servers: str = ""
+    sql_backend: str = "pymssql"
+    fake_sql_latency_ms: float = 2.0
+    fake_sql_jitter_ms: float = 0.5
+    fake_sql_rows: int = 200
+    fake_sql_databases: int = 20
+    # Captura de los result sets crudos de las DMVs y replay offline (SQL_BACKEND=replay)
+    dmv_capture_enabled: bool = False
+    dmv_capture_dir: str = "captures"
+    dmv_capture_retention_hours: float = 72.0  # segmentos horarios más antiguos se borran; 0 = sin límite de edad
+    dmv_capture_max_mb: float = 0.0            # tope de disco por host (se borran los segmentos más antiguos); 0 = sin tope
+    replay_start: str = ""                  # epoch o ISO 8601 (UTC); vacío = primera captura
+    replay_speed: float = 1.0
+    replay_lookback_hours: float = 24.0     # hasta dónde buscar hacia atrás una consulta sin captura en la hora pedida
+    sql_login_timeout: int = 10
+    sql_query_timeout: int = 10
+    sql_pool_max_size: int = 10
+    sql_pool_max_idle_seconds: int = 300
+    sql_pool_checkout_timeout: float = 5.0
+    sql_pool_health_check_seconds: int = 30
+    circuit_failure_threshold: int = 3        # conexiones fallidas seguidas que abren el circuito
+    circuit_backoff_seconds: float = 2.0      # espera antes del primer reintento; se duplica en cada fallo
+    circuit_max_backoff_seconds: float = 60.0
+    sql_executor_workers: int = 8
+    sql_executor_timeout: float = 15.0
+    sql_slow_query_timeout: float = 120.0     # fragmentación y plan cache, en un pool aparte
+    sql_slow_pool_max_size: int = 4
+    sql_slow_query_log_ms: float = 1000.0
+    collector_enabled: bool = True
+    collect_dashboard_interval: float = 5.0
+    collect_wait_stats_interval: float = 15.0
+    wait_stats_history_seconds: int = 3900
+    collect_plan_cache_interval: float = 60.0
+    # 0: se leen todos los query_hash (totales por fingerprint exactos); N > 0: sólo el top N de cada orden (aproximados)
+    plan_cache_rows_per_sort: int = 0
+    plan_cache_text_cache_size: int = 5000
+    query_fingerprint_cache_size: int = 10000
+    alert_rules_file: str = ""
+    alert_history_size: int = 200
+    collect_realtime_interval: float = 2.0
+    collect_sessions_interval: float = 2.0
+    # Presupuesto de coste (ms de CPU o de tiempo transcurrido, el mayor) por ejecución de cada trabajo del monitor
+    throttle_enabled: bool = True
+    throttle_cost_budget_ms: Dict[str, float] = {
+        "dashboard_snapshot": 250,
+        "wait_stats": 250,
+        "realtime": 250,
+        "session_list": 500,
+        "plan_cache": 2000,
+        "plan_cache.database": 2000,
+        "missing_indexes": 1000,
+        "fragmentation": 60000,
+    }
+    throttle_expensive_work: List[str] = ["plan_cache", "plan_cache.database", "missing_indexes", "fragmentation"]
+    throttle_pressure_high: float = 1.0      # tareas runnable por scheduler
+    throttle_pressure_critical: float = 4.0
+    throttle_pressure_stretch: float = 4.0
+    throttle_max_stretch: float = 10.0
+    fragmentation_scan_workers: int = 4
+    fragmentation_scan_interval: float = 3600.0
+    fragmentation_cache_ttl: float = 86400.0
+    ws_queue_size: int = 16
+    ws_max_consecutive_drops: int = 50
+    trend_raw_points: int = 8640
+    trend_minute_points: int = 10080
+    trend_hour_points: int = 2160
+    metric_archive_enabled: bool = True
+    metric_archive_dir: str = "metrics"
+    metric_retention_days: int = 30
+    cache_local_max_entries: int = 256
+    cache_default_ttl: float = 10.0
+    compression_min_bytes: int = 1024
+    cache_ttl_seconds: Dict[str, float] = {
+        "dashboard_snapshot": 5,
+        "missing_indexes": 300,
+        "blocking_chains": 2,
+    }
     
     class Config:
         env_file = ".env"
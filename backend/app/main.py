@@ -1,14 +1,42 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
 
-from .api import auth, monitoring
+from .api import auth, metrics, monitoring, realtime, replay
+from .api.timing import TimedJSONResponse
+from .core.config import settings
+from .services.cache import response_cache
+from .services.fleet import fleet
 
-app = FastAPI(title="SQL Server Monitoring Dashboard")
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # brotli es opcional, sin él se comprime sólo con gzip
+    BrotliMiddleware = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.collector_enabled:
+        await fleet.start()
+    yield
+    await fleet.stop()
+    await response_cache.close()
+
+app = FastAPI(title="SQL Server Monitoring Dashboard", lifespan=lifespan, default_response_class=TimedJSONResponse)
+
+# Las respuestas grandes (rankings, fragmentación, tendencias) viajan comprimidas; br si el cliente lo acepta
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=settings.compression_min_bytes, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.compression_min_bytes)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.include_router(auth.router, prefix="/api/auth", tags=["Auth"])
 app.include_router(monitoring.router, prefix="/api/monitoring", tags=["Monitoring"])
+app.include_router(realtime.router, tags=["Real-Time"])
+app.include_router(metrics.router, tags=["Metrics"])
+app.include_router(replay.router, prefix="/api", tags=["Replay"])
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
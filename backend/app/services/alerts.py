@@ -0,0 +1,227 @@
+import json
+import operator
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from .collector import Snapshot
+from .wait_stats import parse_window
+
+OPERATORS: Dict[str, Callable[[float, float], bool]] = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "==": operator.eq, "!=": operator.ne,
+}
+
+SEVERITIES = ("info", "warning", "critical")
+
+
+def _dashboard_metrics(data: Dict[str, Any]) -> Dict[str, float]:
+    if data.get("error"):
+        return {"up": 0}
+    system, overview = data["system_stats"], data["overview"]
+    return {
+        "up": 1,
+        "cpu_percent": system["cpu_percent"],
+        "memory_percent": system["memory_percent"],
+        "disk_usage_percent": system["disk_usage"],
+        "total_sessions": overview["session_stats"]["total_sessions"],
+        "active_sessions": overview["session_stats"]["active_sessions"],
+        "blocked_sessions": overview["session_stats"]["blocked_sessions"],
+        "long_running_queries": overview["performance_stats"]["long_running_queries"],
+    }
+
+
+# Métricas que produce cada job del collector: un snapshot sólo evalúa las reglas de sus propias métricas
+JOB_METRICS: Dict[str, Callable[[Dict[str, Any]], Dict[str, float]]] = {
+    "dashboard_snapshot": _dashboard_metrics,
+}
+
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    {"name": "sql_server_down", "metric": "up", "op": "<", "threshold": 1, "severity": "critical",
+     "message": "SQL Server is not answering monitoring queries", "action": "Check connectivity and the instance"},
+    {"name": "blocked_sessions", "metric": "blocked_sessions", "op": ">", "threshold": 0, "severity": "critical",
+     "message": "{value:g} blocked sessions detected", "action": "Check Sessions tab"},
+    {"name": "long_running_queries", "metric": "long_running_queries", "op": ">", "threshold": 0, "severity": "warning",
+     "message": "{value:g} long running queries (>2 min)", "action": "Check Performance tab"},
+    {"name": "high_cpu", "metric": "cpu_percent", "op": ">", "threshold": 90, "clear": 80, "for": "2m",
+     "severity": "critical", "message": "CPU at {value:g}% for more than {for}", "action": "Check top queries by CPU"},
+    {"name": "high_memory", "metric": "memory_percent", "op": ">", "threshold": 95, "clear": 90, "for": "5m",
+     "severity": "warning", "message": "Memory at {value:g}%", "action": "Check memory grants and buffer pool"},
+    {"name": "tempdb_volume_full", "metric": "disk_usage_percent", "op": ">", "threshold": 90, "clear": 85,
+     "severity": "warning", "message": "tempdb volume {value:g}% used", "action": "Check Maintenance tab"},
+]
+
+
+class AlertRule:
+    """metric op threshold, sustained for `for` seconds.
+
+    clear is the hysteresis bound: a firing alert resolves only once the value no
+    longer satisfies `metric op clear` (defaults to the threshold itself).
+    """
+
+    __slots__ = ("name", "metric", "op", "compare", "threshold", "clear", "for_seconds", "for_text",
+                 "severity", "message", "action")
+
+    def __init__(self, name: str, metric: str, op: str, threshold: float, severity: str = "warning",
+                 message: str = "", action: str = "", clear: Optional[float] = None, for_: Union[str, int] = 0):
+        if op not in OPERATORS:
+            raise ValueError(f"Rule {name}: unknown operator {op!r}")
+        if severity not in SEVERITIES:
+            raise ValueError(f"Rule {name}: severity must be one of {', '.join(SEVERITIES)}")
+        self.name = name
+        self.metric = metric
+        self.op = op
+        self.compare = OPERATORS[op]
+        self.threshold = float(threshold)
+        self.clear = float(threshold if clear is None else clear)
+        self.for_seconds = parse_window(str(for_))
+        self.for_text = str(for_)
+        self.severity = severity
+        self.message = message or f"{metric} {op} {threshold:g} (value {{value:g}})"
+        self.action = action
+
+    @classmethod
+    def from_dict(cls, entry: Dict[str, Any]) -> "AlertRule":
+        return cls(entry["name"], entry["metric"], entry.get("op", ">"), entry["threshold"], entry.get("severity", "warning"),
+                   entry.get("message", ""), entry.get("action", ""), entry.get("clear"), entry.get("for", 0))
+
+    def breached(self, value: float) -> bool:
+        return self.compare(value, self.threshold)
+
+    def still_breached(self, value: float) -> bool:
+        return self.compare(value, self.clear)
+
+    def render(self, value: float) -> str:
+        try:
+            return self.message.format(value=value, threshold=self.threshold, metric=self.metric, **{"for": self.for_text})
+        except (KeyError, ValueError, IndexError):
+            return self.message
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "metric": self.metric, "op": self.op, "threshold": self.threshold, "clear": self.clear,
+                "for_seconds": self.for_seconds, "severity": self.severity}
+
+
+class AlertState:
+    __slots__ = ("rule", "status", "value", "pending_since", "firing_since", "last_evaluated")
+
+    def __init__(self, rule: AlertRule):
+        self.rule = rule
+        self.status = "ok"
+        self.value: Optional[float] = None
+        self.pending_since: Optional[float] = None
+        self.firing_since: Optional[float] = None
+        self.last_evaluated: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        rule = self.rule
+        return {
+            "rule": rule.name,
+            "state": self.status,
+            "level": rule.severity,
+            "message": rule.render(self.value),
+            "action": rule.action,
+            "metric": rule.metric,
+            "value": self.value,
+            "threshold": rule.threshold,
+            "pending_since": self.pending_since,
+            "firing_since": self.firing_since,
+        }
+
+
+class AlertEngine:
+    """Declarative alert rules evaluated incrementally as collector snapshots arrive.
+
+    Rules are indexed by metric and metrics by collector job, so a snapshot only
+    touches the rules of the metrics it carries; a rule whose value did not change
+    and that is not waiting out its `for` duration is skipped altogether. Alert state
+    (ok / pending / firing) lives in memory and every transition bumps `version`.
+    """
+
+    def __init__(self, rules: List[AlertRule], history_size: int = 200):
+        self._lock = threading.Lock()
+        self._states = {rule.name: AlertState(rule) for rule in rules}
+        self._by_metric: Dict[str, List[AlertState]] = {}
+        for state in self._states.values():
+            self._by_metric.setdefault(state.rule.metric, []).append(state)
+        self.resolved: deque = deque(maxlen=history_size)
+        self.version = 0
+        self.evaluations = 0
+        self.skipped = 0
+
+    def on_snapshot(self, snapshot: Snapshot):
+        extract = JOB_METRICS.get(snapshot.name)
+        if extract is None:
+            return
+        self.evaluate(extract(snapshot.data), snapshot.collected_at)
+
+    def evaluate(self, values: Dict[str, Optional[float]], ts: float):
+        with self._lock:
+            for metric, value in values.items():
+                if value is None:
+                    continue
+                for state in self._by_metric.get(metric, ()):
+                    self._evaluate(state, float(value), ts)
+
+    def _evaluate(self, state: AlertState, value: float, ts: float):
+        rule = state.rule
+        if value == state.value and state.status != "pending":
+            self.skipped += 1
+            return
+        self.evaluations += 1
+        previous = state.status
+        state.value = value
+        state.last_evaluated = ts
+
+        if state.status == "firing":
+            if not rule.still_breached(value):
+                self.resolved.appendleft({**state.to_dict(), "state": "resolved", "resolved_at": ts})
+                state.status, state.pending_since, state.firing_since = "ok", None, None
+        elif rule.breached(value):
+            if state.status == "ok":
+                state.status, state.pending_since = "pending", ts
+            if ts - state.pending_since >= rule.for_seconds:
+                state.status, state.firing_since = "firing", ts
+        else:
+            state.status, state.pending_since = "ok", None
+
+        if state.status != previous:
+            self.version += 1
+
+    def alerts(self, status: str = "firing") -> List[Dict[str, Any]]:
+        """Alertas en ese estado, las críticas primero"""
+        with self._lock:
+            states = [s for s in self._states.values() if s.status == status]
+            states.sort(key=lambda s: (-SEVERITIES.index(s.rule.severity), s.firing_since or s.pending_since or 0))
+            return [s.to_dict() for s in states]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            firing = [s for s in self._states.values() if s.status == "firing"]
+            return {"firing": len(firing), "critical": sum(1 for s in firing if s.rule.severity == "critical")}
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "timestamp": time.time(),
+            "version": self.version,
+            "firing": self.alerts("firing"),
+            "pending": self.alerts("pending"),
+            "resolved": list(self.resolved),
+            "rules": [s.rule.to_dict() for s in self._states.values()],
+            "evaluations": self.evaluations,
+            "skipped_unchanged": self.skipped,
+        }
+
+
+def load_alert_rules(path: str = "") -> List[AlertRule]:
+    """Reglas del fichero JSON ALERT_RULES_FILE (lista de reglas) o las de DEFAULT_RULES"""
+    entries = DEFAULT_RULES
+    if path:
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+    rules = [AlertRule.from_dict(entry) for entry in entries]
+    names = [rule.name for rule in rules]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate alert rule names: {', '.join(sorted(duplicates))}")
+    return rules
@@ -0,0 +1,154 @@
+from typing import Any, Dict, List, Optional, Set
+
+STATEMENT_MAX_CHARS = 1000
+
+
+class BlockingNode:
+    __slots__ = ("session_id", "blocked_by", "wait_ms", "wait_type", "resource", "login", "host", "program",
+                 "database", "status", "command", "elapsed_ms", "open_transactions", "statement", "children")
+
+    def __init__(self, session_id: int, blocked_by: Optional[int] = None, wait_ms: int = 0, wait_type: Optional[str] = None,
+                 resource: Optional[str] = None, login: Optional[str] = None, host: Optional[str] = None,
+                 program: Optional[str] = None, database: Optional[str] = None, status: Optional[str] = None,
+                 command: Optional[str] = None, elapsed_ms: int = 0, open_transactions: int = 0,
+                 statement: Optional[str] = None):
+        self.session_id = session_id
+        self.blocked_by = blocked_by
+        self.wait_ms = wait_ms
+        self.wait_type = wait_type
+        self.resource = resource
+        self.login = login
+        self.host = host
+        self.program = program
+        self.database = database
+        self.status = status
+        self.command = command
+        self.elapsed_ms = elapsed_ms
+        self.open_transactions = open_transactions
+        self.statement = statement
+        self.children: List["BlockingNode"] = []
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "BlockingNode":
+        statement = row[13]
+        if statement is not None:
+            statement = " ".join(statement.split())[:STATEMENT_MAX_CHARS]
+        return cls(row[0], row[1] or None, row[2] or 0, row[3], row[4], row[5], row[6], row[7], row[8] or "N/A",
+                   row[9], row[10], row[11] or 0, row[12] or 0, statement)
+
+    def to_dict(self, depth: int) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "blocked_by": self.blocked_by,
+            "depth": depth,
+            "wait_ms": self.wait_ms,
+            "wait_type": self.wait_type,
+            "resource": self.resource,
+            "login": self.login,
+            "host": self.host,
+            "program": self.program,
+            "database": self.database,
+            "status": self.status,
+            "command": self.command,
+            "elapsed_ms": self.elapsed_ms,
+            "open_transactions": self.open_transactions,
+            "statement": self.statement,
+        }
+
+
+def _find_cycle(node: BlockingNode, nodes: Dict[int, BlockingNode], state: Dict[int, int]) -> List[BlockingNode]:
+    """Sube por blocked_by desde un nodo no alcanzado desde ninguna cabeza. Devuelve los nodos del ciclo encontrado,
+    o [] si el camino termina en nodos ya resueltos. state: 1 = en el camino actual, 2 = resuelto"""
+    path = []
+    current: Optional[BlockingNode] = node
+    while current is not None and current.session_id not in state:
+        state[current.session_id] = 1
+        path.append(current)
+        current = nodes.get(current.blocked_by)
+    cycle = []
+    if current is not None and state[current.session_id] == 1:
+        cycle = path[path.index(current):]
+    for n in path:
+        state[n.session_id] = 2
+    return cycle
+
+
+def _walk(head: BlockingNode, cycle: Set[int]) -> Dict[str, Any]:
+    """Recorre el árbol de una cabeza (iterativo, sin límite de profundidad) y agrega sus métricas.
+    cycle: session_ids del ciclo cuando la cabeza es el punto de corte de uno; la cabeza entonces también espera
+    (a otro miembro del ciclo) y su espera cuenta en los totales de la cadena"""
+    sessions: List[Dict[str, Any]] = []
+    blocked = total_wait = max_wait = depth = 0
+    stack = [(head, 0)]
+    seen = {head.session_id}
+    while stack:
+        node, level = stack.pop()
+        sessions.append({**node.to_dict(level), "in_cycle": node.session_id in cycle})
+        if level or node.blocked_by is not None:
+            blocked += 1
+            total_wait += node.wait_ms
+            max_wait = max(max_wait, node.wait_ms)
+            depth = max(depth, level)
+        # Orden inverso para que el preorden salga con los hijos que más esperan primero
+        for child in reversed(node.children):
+            if child.session_id not in seen:
+                seen.add(child.session_id)
+                stack.append((child, level + 1))
+    return {
+        **head.to_dict(0),
+        "cycle": bool(cycle),
+        "in_cycle": head.session_id in cycle,
+        "chain_depth": depth,
+        "blocked_sessions": blocked,
+        "total_wait_ms": total_wait,
+        "max_wait_ms": max_wait,
+        "sessions": sessions,
+    }
+
+
+def build_blocking_forest(rows: List[tuple]) -> Dict[str, Any]:
+    """Bosque de bloqueos a partir de las sesiones implicadas (bloqueadas o bloqueadoras): un único orden por espera,
+    O(n log n), y el resto en recorridos lineales.
+
+    Cada sesión apunta a quien la bloquea; las cabezas son las que no están bloqueadas. Un bloqueador que ya no
+    aparece en las DMVs se añade como nodo sin datos. Si quedan sesiones sin alcanzar desde ninguna cabeza forman
+    (o cuelgan de) un ciclo, normalmente un deadlock que el monitor de SQL Server aún no ha resuelto: el ciclo se
+    corta en su menor session_id, que pasa a ser la cabeza con cycle=true; sus miembros llevan in_cycle=true y
+    la espera de la cabeza, que también está bloqueada, cuenta en la cadena.
+    """
+    nodes: Dict[int, BlockingNode] = {}
+    for row in rows:
+        # Con MARS una sesión puede traer varias filas; basta la primera
+        if row[0] not in nodes:
+            nodes[row[0]] = BlockingNode.from_row(row)
+    for node in list(nodes.values()):
+        if node.blocked_by is not None and node.blocked_by not in nodes:
+            nodes[node.blocked_by] = BlockingNode(node.blocked_by)
+
+    # Recorriendo las sesiones de mayor a menor espera, los hijos de cada nodo quedan ya ordenados
+    heads: List[BlockingNode] = []
+    for node in sorted(nodes.values(), key=lambda n: -n.wait_ms):
+        if node.blocked_by is None:
+            heads.append(node)
+        else:
+            nodes[node.blocked_by].children.append(node)
+
+    chains = [_walk(head, set()) for head in heads if head.children]
+    reached = {s["session_id"] for chain in chains for s in chain["sessions"]}
+    state = {session_id: 2 for session_id in reached}
+    for node in nodes.values():
+        if node.session_id in state:
+            continue
+        cycle = _find_cycle(node, nodes, state)
+        if cycle:
+            root = min(cycle, key=lambda n: n.session_id)
+            chains.append(_walk(root, {n.session_id for n in cycle}))
+
+    chains.sort(key=lambda c: (-c["total_wait_ms"], c["session_id"]))
+    return {
+        "head_blockers": len(chains),
+        "blocked_sessions": sum(1 for node in nodes.values() if node.blocked_by is not None),
+        "max_chain_depth": max((c["chain_depth"] for c in chains), default=0),
+        "deadlock_cycles": sum(1 for c in chains if c["cycle"]),
+        "chains": chains,
+    }
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from ..core.config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # redis es opcional, sin él sólo se usa la LRU local
+    aioredis = None
+
+
+class LRUCache:
+    """Small in-process LRU with per-entry expiry, used when Redis is unavailable."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResponseCache:
+    """Response cache for the monitoring router.
+
+    Values live in Redis (shared between workers and restarts) and fall back to an
+    in-process LRU while Redis is unreachable. Concurrent misses for the same key are
+    coalesced so only one loader runs and every waiter gets its result.
+    """
+
+    def __init__(self, redis_url: Optional[str], max_local_entries: int = 256, prefix: str = "sqlmon:cache:",
+                 redis_retry_seconds: float = 30):
+        self.prefix = prefix
+        self.redis_retry_seconds = redis_retry_seconds
+        self._redis = aioredis.from_url(redis_url, socket_connect_timeout=0.5, socket_timeout=0.5) if aioredis and redis_url else None
+        self._redis_down_until = 0.0
+        self._local = LRUCache(max_local_entries)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.redis_errors = 0
+
+    def _redis_available(self) -> bool:
+        return self._redis is not None and time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, e: Exception):
+        self.redis_errors += 1
+        self._redis_down_until = time.monotonic() + self.redis_retry_seconds
+        print(f"Redis cache unavailable, using local LRU: {e}")
+
+    async def get(self, key: str) -> Optional[Any]:
+        if self._redis_available():
+            try:
+                raw = await self._redis.get(self.prefix + key)
+                return json.loads(raw) if raw is not None else None
+            except Exception as e:
+                self._redis_failed(e)
+        return self._local.get(key)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        if self._redis_available():
+            try:
+                await self._redis.set(self.prefix + key, json.dumps(value, default=str), px=int(ttl * 1000))
+                return
+            except Exception as e:
+                self._redis_failed(e)
+        self._local.set(key, value, ttl)
+
+    async def _load(self, key: str, ttl: float, loader: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        try:
+            value = await loader()
+            # Las respuestas de error no se cachean, el siguiente poll vuelve a intentar
+            if not (isinstance(value, dict) and value.get("error")):
+                await self.set(key, value, ttl)
+            return value
+        finally:
+            del self._inflight[key]
+
+    async def get_or_load(self, key: str, ttl: float, loader: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        value = await self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # La carga corre en su propia tarea: si se cancela la petición que la lanzó (cliente desconectado),
+            # termina igualmente y el resto de peticiones que la comparten recibe su resultado
+            inflight = self._inflight[key] = asyncio.ensure_future(self._load(key, ttl, loader))
+            inflight.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return await asyncio.shield(inflight)
+
+    async def close(self):
+        if self._redis is not None:
+            try:
+                await self._redis.aclose()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "backend": "redis" if self._redis_available() else "local_lru",
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0,
+            "redis_errors": self.redis_errors,
+            "local_entries": len(self._local),
+            "inflight": len(self._inflight),
+        }
+
+
+response_cache = ResponseCache(settings.redis_url, settings.cache_local_max_entries)
@@ -0,0 +1,584 @@
+"""Capture of raw DMV result sets and offline replay of them.
+
+With DMV_CAPTURE_ENABLED=true every statement sent through the pool is recorded
+with the result sets it returned, in hourly segment files per host under
+DMV_CAPTURE_DIR:
+
+    <host>/<YYYYMMDDTHH>.frames   zlib-compressed JSON frames, appended back to back
+    <host>/<YYYYMMDDTHH>.idx      fixed-size records: timestamp, query key, frame offset, length
+
+The key is a hash of the SQL text and its parameters, so the same monitoring query
+maps to the same key on every run. Lookups by a list of keys whose contents depend
+on in-process caches (statement text by sql_handle) are registered with
+register_lookup() and captured and replayed one key at a time instead. A frame
+identical to the previous one for the same key within a segment is not written
+again; its index record points to the earlier frame. Segments older than
+DMV_CAPTURE_RETENTION_HOURS are deleted at each hourly rotation, and with
+DMV_CAPTURE_MAX_MB the oldest segments of a host are deleted whenever its capture
+directory grows past that size, so a long-running capture uses bounded disk.
+
+SQL_BACKEND=replay serves the whole API from those files instead of a live server:
+each statement gets the latest capture of its key at or before the replay clock.
+The clock starts at REPLAY_START (or the first capture) and runs at REPLAY_SPEED;
+/api/replay moves it. Segments are opened lazily: only the .idx of an hour that is
+looked up is read, the .frames file is memory-mapped and a frame is decompressed
+only when it is served.
+"""
+import bisect
+import calendar
+import datetime
+import decimal
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+
+INDEX_RECORD = struct.Struct("<d8sQI")
+SEGMENT_FORMAT = "%Y%m%dT%H"
+SEGMENT_SECONDS = 3600
+
+ResultSets = List[List[tuple]]
+
+
+def host_directory(root: str, host: str) -> str:
+    return os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]", "_", host))
+
+
+def query_key(operation: str, params: Any = None) -> bytes:
+    return hashlib.blake2b(f"{operation}\x00{params!r}".encode("utf-8"), digest_size=8).digest()
+
+
+# (plantilla, prefijo, sufijo) de los statements de búsqueda por lista de claves
+_lookups: List[Tuple[str, str, str]] = []
+
+
+def register_lookup(template: str):
+    """template lleva un único %s donde va la lista "(%s), (%s)..." de parámetros, uno por clave;
+    la primera columna de cada fila devuelta es la clave a la que corresponde"""
+    prefix, suffix = template.split("%s", 1)
+    _lookups.append((template, prefix, suffix))
+
+
+def lookup_template(operation: str, params: Any) -> Optional[str]:
+    if isinstance(params, tuple):
+        for template, prefix, suffix in _lookups:
+            if operation.startswith(prefix) and operation.endswith(suffix):
+                return template
+    return None
+
+
+def _encode_value(value: Any) -> Any:
+    # Tipos que devuelve pymssql y JSON no representa: se etiquetan para reconstruirlos al reproducir
+    if isinstance(value, (bytes, bytearray)):
+        return {"$b": bytes(value).hex()}
+    if isinstance(value, datetime.datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"$d": value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {"$n": str(value)}
+    if isinstance(value, datetime.time):
+        return {"$t": value.isoformat()}
+    raise TypeError(f"Cannot capture value of type {type(value).__name__}")
+
+
+def _decode_value(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1:
+        tag, value = next(iter(obj.items()))
+        if tag == "$b":
+            return bytes.fromhex(value)
+        if tag == "$dt":
+            return datetime.datetime.fromisoformat(value)
+        if tag == "$d":
+            return datetime.date.fromisoformat(value)
+        if tag == "$n":
+            return decimal.Decimal(value)
+        if tag == "$t":
+            return datetime.time.fromisoformat(value)
+    return obj
+
+
+def encode_frame(sets: ResultSets) -> bytes:
+    return zlib.compress(json.dumps(sets, default=_encode_value, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def decode_frame(data: bytes) -> ResultSets:
+    return [[tuple(row) for row in rows] for rows in json.loads(zlib.decompress(data), object_hook=_decode_value)]
+
+
+# ===== CAPTURA =====
+
+class CaptureWriter:
+    """Appends captured result sets to the current hourly segment of one host (thread-safe).
+
+    Old segments are deleted by age (retention_hours) and by total size (max_bytes),
+    never the one being written; 0 disables either limit.
+    """
+
+    def __init__(self, directory: str, retention_hours: float = 0, max_bytes: int = 0):
+        self.directory = directory
+        self.retention_hours = retention_hours
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._segment: Optional[str] = None
+        self._frames = None
+        self._index = None
+        self._offset = 0
+        self._last: Dict[bytes, Tuple[bytes, int, int]] = {}
+        self._disk_bytes = 0
+        self._older_segments = False  # hay segmentos que se pueden borrar para volver al tope de tamaño
+        self.frames_written = 0
+        self.frames_deduplicated = 0
+        self.bytes_written = 0
+        self.deleted_segments = 0
+
+    def _segments(self) -> List[str]:
+        """Segmentos del directorio, del más antiguo al más reciente (el nombre ordena por hora)"""
+        return sorted(name[:-len(".idx")] for name in os.listdir(self.directory) if name.endswith(".idx"))
+
+    def _delete_segment(self, segment: str):
+        for suffix in (".frames", ".idx"):
+            path = os.path.join(self.directory, segment + suffix)
+            try:
+                self._disk_bytes -= os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not delete capture segment {path}: {e}")
+        self.deleted_segments += 1
+
+    def enforce_retention(self, now: float):
+        segments = [s for s in self._segments() if s != self._segment]
+        if self.retention_hours > 0:
+            cutoff = time.strftime(SEGMENT_FORMAT, time.gmtime(now - self.retention_hours * 3600))
+            while segments and segments[0] < cutoff:
+                self._delete_segment(segments.pop(0))
+        if self.max_bytes > 0:
+            self._disk_bytes = sum(os.path.getsize(entry.path) for entry in os.scandir(self.directory) if entry.is_file())
+            while segments and self._disk_bytes > self.max_bytes:
+                self._delete_segment(segments.pop(0))
+        self._older_segments = bool(segments)
+
+    def _rotate(self, ts: float):
+        segment = time.strftime(SEGMENT_FORMAT, time.gmtime(ts))
+        if segment == self._segment:
+            return
+        self.close()
+        base = os.path.join(self.directory, segment)
+        self._frames = open(base + ".frames", "ab")
+        self._index = open(base + ".idx", "ab")
+        self._offset = self._frames.tell()
+        self._segment = segment
+        self._last = {}
+        self.enforce_retention(ts)
+
+    def record(self, operation: str, params: Any, sets: ResultSets, ts: Optional[float] = None):
+        ts = time.time() if ts is None else ts
+        key = query_key(operation, params)
+        frame = encode_frame(sets)
+        digest = hashlib.blake2b(frame, digest_size=16).digest()
+        with self._lock:
+            self._rotate(ts)
+            last = self._last.get(key)
+            written = INDEX_RECORD.size
+            if last is not None and last[0] == digest:
+                offset, length = last[1], last[2]
+                self.frames_deduplicated += 1
+            else:
+                written += len(frame)
+                offset, length = self._offset, len(frame)
+                self._frames.write(frame)
+                self._frames.flush()
+                self._offset += length
+                self._last[key] = (digest, offset, length)
+                self.frames_written += 1
+                self.bytes_written += length
+            # El índice se escribe después del frame: un lector nunca ve un registro que apunte a datos incompletos
+            self._index.write(INDEX_RECORD.pack(ts, key, offset, length))
+            self._index.flush()
+            if self.max_bytes > 0:
+                self._disk_bytes += written
+                # Sólo el segmento en curso por encima del tope: no hay nada que borrar hasta la próxima rotación
+                if self._disk_bytes > self.max_bytes and self._older_segments:
+                    self.enforce_retention(ts)
+
+    def close(self):
+        for f in (self._frames, self._index):
+            if f is not None:
+                f.close()
+        self._frames = self._index = None
+        self._segment = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "segment": self._segment,
+            "frames_written": self.frames_written,
+            "frames_deduplicated": self.frames_deduplicated,
+            "bytes_written": self.bytes_written,
+            "retention_hours": self.retention_hours,
+            "max_bytes": self.max_bytes,
+            "deleted_segments": self.deleted_segments,
+        }
+
+
+class CapturingCursor:
+    """Cursor proxy that reads every result set of a statement up front and records them.
+
+    Sits below InstrumentedCursor; in capture mode the whole batch is therefore
+    charged to its first statement in query_stats. Other DB-API attributes are those
+    of the wrapped cursor, which has already moved past every result set.
+    """
+
+    def __init__(self, cursor, writer: CaptureWriter):
+        self._cursor = cursor
+        self._writer = writer
+        self._sets: ResultSets = []
+        self._pos = 0
+
+    def execute(self, operation: str, params: Optional[Any] = None):
+        if params is None:
+            self._cursor.execute(operation)
+        else:
+            self._cursor.execute(operation, params)
+        sets = [list(self._cursor.fetchall())]
+        while self._cursor.nextset():
+            sets.append(list(self._cursor.fetchall()))
+        self._sets, self._pos = sets, 0
+        try:
+            template = lookup_template(operation, params)
+            if template is None:
+                self._writer.record(operation, params, sets)
+            else:
+                ts = time.time()
+                for key in params:
+                    self._writer.record(template, (key,), [[row for row in sets[0] if row[0] == key]], ts)
+        except (OSError, TypeError) as e:
+            print(f"DMV capture failed: {e}")
+
+    def executemany(self, operation: str, seq_of_params):
+        for params in seq_of_params:
+            self.execute(operation, params)
+
+    def fetchall(self) -> List[tuple]:
+        if not self._sets:
+            return []
+        rows = self._sets[0][self._pos:] if self._pos else self._sets[0]
+        self._sets[0], self._pos = [], 0
+        return rows
+
+    def fetchone(self) -> Optional[tuple]:
+        if not self._sets or self._pos >= len(self._sets[0]):
+            return None
+        self._pos += 1
+        return self._sets[0][self._pos - 1]
+
+    def fetchmany(self, size: Optional[int] = None) -> List[tuple]:
+        if not self._sets:
+            return []
+        size = getattr(self._cursor, "arraysize", 1) if size is None else size
+        rows = self._sets[0][self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    def nextset(self) -> Optional[bool]:
+        if len(self._sets) > 1:
+            self._sets.pop(0)
+            self._pos = 0
+            return True
+        return None
+
+    def close(self):
+        self._sets = []
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+_writers: Dict[str, CaptureWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def writer_for(host: str) -> CaptureWriter:
+    """Un writer por host: varios servidores del registro con el mismo host comparten segmentos"""
+    with _writers_lock:
+        writer = _writers.get(host)
+        if writer is None:
+            writer = _writers[host] = CaptureWriter(host_directory(settings.dmv_capture_dir, host),
+                                                    settings.dmv_capture_retention_hours,
+                                                    int(settings.dmv_capture_max_mb * 1024 * 1024))
+        return writer
+
+
+def capture_status() -> Dict[str, Any]:
+    with _writers_lock:
+        return {host: writer.stats() for host, writer in _writers.items()}
+
+
+# ===== REPLAY =====
+
+def parse_time(value: str) -> float:
+    """Epoch en segundos o fecha ISO 8601 (UTC si no lleva zona)"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+class _Segment:
+    __slots__ = ("start", "first", "last", "frames", "keys")
+
+    def __init__(self, base: str, start: float):
+        self.start = start
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+        self.keys: Dict[bytes, Tuple[List[float], List[Tuple[int, int]]]] = {}
+        with open(base + ".idx", "rb") as f:
+            index = f.read()
+        usable = len(index) - len(index) % INDEX_RECORD.size
+        for ts, key, offset, length in INDEX_RECORD.iter_unpack(index[:usable]):
+            times, frames = self.keys.setdefault(key, ([], []))
+            times.append(ts)
+            frames.append((offset, length))
+            self.first = ts if self.first is None else min(self.first, ts)
+            self.last = ts if self.last is None else max(self.last, ts)
+        self.frames: Optional[mmap.mmap] = None
+        if os.path.getsize(base + ".frames"):
+            with open(base + ".frames", "rb") as f:
+                self.frames = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def lookup(self, key: bytes, at: float) -> Optional[Tuple[float, int, int]]:
+        entry = self.keys.get(key)
+        if entry is None:
+            return None
+        times, frames = entry
+        i = bisect.bisect_right(times, at) - 1
+        if i < 0:
+            return None
+        return (times[i],) + frames[i]
+
+    def close(self):
+        if self.frames is not None:
+            self.frames.close()
+
+
+class CaptureReader:
+    """Looks up captured result sets of one host by query key and point in time.
+
+    Only the file names are listed up front; a segment's index is parsed and its
+    frames file memory-mapped the first time a lookup falls into that hour, and at
+    most `cached_segments` stay open. A key missing from the segment of the
+    requested time (queries collected hourly, say) is searched in earlier segments
+    up to `lookback` seconds back.
+    """
+
+    def __init__(self, directory: str, cached_segments: int = 8, lookback: float = 86400):
+        self.directory = directory
+        self.cached_segments = cached_segments
+        self.lookback = lookback
+        self._lock = threading.Lock()
+        self._segments: "OrderedDict[float, _Segment]" = OrderedDict()
+        self._starts: List[float] = []
+        self._listed_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _list(self):
+        # La lista de segmentos se refresca como mucho una vez por minuto (una captura puede seguir escribiendo)
+        if time.monotonic() - self._listed_at < 60 and self._starts:
+            return
+        starts = []
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                stem, ext = os.path.splitext(name)
+                if ext != ".idx" or not os.path.exists(os.path.join(self.directory, stem + ".frames")):
+                    continue
+                try:
+                    starts.append(float(calendar.timegm(time.strptime(stem, SEGMENT_FORMAT))))
+                except ValueError:
+                    continue
+        self._starts = sorted(starts)
+        self._listed_at = time.monotonic()
+
+    def _segment(self, start: float) -> _Segment:
+        segment = self._segments.get(start)
+        if segment is None:
+            base = os.path.join(self.directory, time.strftime(SEGMENT_FORMAT, time.gmtime(start)))
+            segment = self._segments[start] = _Segment(base, start)
+            while len(self._segments) > self.cached_segments:
+                _, evicted = self._segments.popitem(last=False)
+                evicted.close()
+        else:
+            self._segments.move_to_end(start)
+        return segment
+
+    def time_range(self) -> Tuple[Optional[float], Optional[float]]:
+        with self._lock:
+            self._list()
+            if not self._starts:
+                return None, None
+            # El último segmento se relee: puede seguir creciendo si la captura está en marcha
+            stale = self._segments.pop(self._starts[-1], None)
+            if stale is not None:
+                stale.close()
+            return self._segment(self._starts[0]).first, self._segment(self._starts[-1]).last
+
+    def lookup(self, operation: str, params: Any, at: float) -> Optional[Tuple[float, ResultSets]]:
+        """(momento de la captura, result sets) de la última captura de ese statement en o antes de at"""
+        key = query_key(operation, params)
+        with self._lock:
+            self._list()
+            i = bisect.bisect_right(self._starts, at) - 1
+            while i >= 0 and at - self._starts[i] <= self.lookback + SEGMENT_SECONDS:
+                segment = self._segment(self._starts[i])
+                found = segment.lookup(key, at)
+                if found is not None and segment.frames is not None:
+                    ts, offset, length = found
+                    data = segment.frames[offset:offset + length]
+                    self.hits += 1
+                    return ts, decode_frame(data)
+                i -= 1
+            self.misses += 1
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"segments": len(self._starts), "segments_open": len(self._segments), "hits": self.hits,
+                    "misses": self.misses}
+
+
+class ReplayClock:
+    """Replay position: starts at a captured instant and advances at `speed` x wall-clock time."""
+
+    def __init__(self, start: Optional[float] = None, speed: float = 1.0):
+        self._lock = threading.Lock()
+        self.speed = speed
+        self._start = start
+        self._anchor = time.time()
+
+    def now(self) -> Optional[float]:
+        with self._lock:
+            if self._start is None:
+                return None
+            return self._start + (time.time() - self._anchor) * self.speed
+
+    def seek(self, at: float, speed: Optional[float] = None):
+        with self._lock:
+            self._start = at
+            self._anchor = time.time()
+            if speed is not None:
+                self.speed = speed
+
+    def start_if_unset(self, at: Optional[float]):
+        with self._lock:
+            if self._start is None and at is not None:
+                self._start = at
+                self._anchor = time.time()
+
+
+replay_clock = ReplayClock(parse_time(settings.replay_start) if settings.replay_start else None, settings.replay_speed)
+
+_readers: Dict[str, CaptureReader] = {}
+_readers_lock = threading.Lock()
+
+
+def reader_for(host: str) -> CaptureReader:
+    with _readers_lock:
+        reader = _readers.get(host)
+        if reader is None:
+            reader = _readers[host] = CaptureReader(host_directory(settings.dmv_capture_dir, host),
+                                                    lookback=settings.replay_lookback_hours * 3600)
+            # Sin REPLAY_START la reproducción empieza en la primera captura disponible
+            replay_clock.start_if_unset(reader.time_range()[0])
+        return reader
+
+
+def replay_status() -> Dict[str, Any]:
+    with _readers_lock:
+        readers = dict(_readers)
+    hosts = {}
+    for host, reader in readers.items():
+        first, last = reader.time_range()
+        hosts[host] = {"first_capture": first, "last_capture": last, **reader.stats()}
+    return {"at": replay_clock.now(), "speed": replay_clock.speed, "hosts": hosts}
+
+
+class ReplayCursor:
+    def __init__(self, reader: CaptureReader):
+        self._reader = reader
+        self._sets: ResultSets = []
+        self.captured_at: Optional[float] = None
+
+    def execute(self, operation: str, params: Optional[Any] = None):
+        at = replay_clock.now()
+        template = lookup_template(operation, params)
+        if template is not None and at is not None:
+            # Una clave sin captura se sirve como la haría SQL Server con un handle ya expulsado: sin filas
+            rows: List[tuple] = []
+            self.captured_at = None
+            for key in params:
+                found = self._reader.lookup(template, (key,), at)
+                if found is not None:
+                    rows.extend(found[1][0])
+                    self.captured_at = max(self.captured_at or found[0], found[0])
+            self._sets = [rows]
+            return
+        found = self._reader.lookup(operation, params, at) if at is not None else None
+        if found is None:
+            self._sets = []
+            raise LookupError(f"No capture of this query at or before {at} in {self._reader.directory}")
+        self.captured_at, self._sets = found
+
+    def fetchall(self) -> List[tuple]:
+        rows = self._sets[0] if self._sets else []
+        if self._sets:
+            self._sets[0] = []
+        return rows
+
+    def fetchone(self) -> Optional[tuple]:
+        if self._sets and self._sets[0]:
+            return self._sets[0].pop(0)
+        return None
+
+    def nextset(self) -> Optional[bool]:
+        if len(self._sets) > 1:
+            self._sets.pop(0)
+            return True
+        return None
+
+    def close(self):
+        self._sets = []
+
+
+class ReplayConnection:
+    def __init__(self, host: str):
+        self._reader = reader_for(host)
+        self.autocommit = True
+
+    def cursor(self) -> ReplayCursor:
+        return ReplayCursor(self._reader)
+
+    def close(self):
+        pass
+
+
+def connect(host: str) -> ReplayConnection:
+    if not os.path.isdir(host_directory(settings.dmv_capture_dir, host)):
+        raise ConnectionError(f"No DMV captures for {host} in {settings.dmv_capture_dir}")
+    return ReplayConnection(host)
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class CircuitOpenError(Exception):
+    """The server is considered unreachable; the call was rejected without trying to connect."""
+
+
+class CircuitBreaker:
+    """Per-server connection health: closed -> open after N consecutive failures.
+
+    While open, every connection attempt fails immediately instead of waiting out the
+    login timeout. Callers never probe the server themselves: supervise() runs in the
+    background and, after a backoff that doubles on each failed probe (up to
+    max_backoff), moves to half-open and tries one connection. Success closes the
+    circuit; failure reopens it. Requests keep failing fast while half-open.
+    """
+
+    def __init__(self, failure_threshold: int = 3, backoff: float = 2.0, max_backoff: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.backoff = backoff
+        self.opened_at: Optional[float] = None
+        self.next_probe_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_success: Optional[float] = None
+        self.rejected = 0
+        self.probes = 0
+        self.trips = 0
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state == "closed"
+
+    def check(self):
+        """Lanza CircuitOpenError si no se debe intentar conectar ahora"""
+        if self.state != "closed":
+            with self._lock:
+                self.rejected += 1
+            raise CircuitOpenError(f"SQL Server unreachable, circuit {self.state} since "
+                                   f"{time.strftime('%H:%M:%S', time.localtime(self.opened_at))}: {self.last_error}")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.last_success = time.time()
+            if self.state != "closed":
+                self.state = "closed"
+                self.backoff = self.initial_backoff
+                self.opened_at = self.next_probe_at = None
+
+    def record_failure(self, error: BaseException):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) or type(error).__name__
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                if self.state == "closed":
+                    self.trips += 1
+                    self.opened_at = time.time()
+                    self.backoff = self.initial_backoff
+                else:
+                    self.backoff = min(self.max_backoff, self.backoff * 2)
+                self.state = "open"
+                self.next_probe_at = time.time() + self.backoff
+
+    async def supervise(self, probe: Callable[[], Awaitable[Any]], poll: float = 0.5):
+        """Bucle de reconexión en segundo plano: con el circuito abierto, prueba probe() cuando vence el backoff.
+        probe debe lanzar una excepción si el servidor sigue sin responder"""
+        while True:
+            if self.state == "open" and time.time() >= (self.next_probe_at or 0):
+                with self._lock:
+                    self.state = "half_open"
+                    self.probes += 1
+                try:
+                    await probe()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.record_failure(e)
+                else:
+                    self.record_success()
+            await asyncio.sleep(poll)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "failure_threshold": self.failure_threshold,
+                "opened_at": self.opened_at,
+                "next_probe_at": self.next_probe_at,
+                "backoff_seconds": self.backoff if self.state != "closed" else None,
+                "last_error": self.last_error,
+                "last_success": self.last_success,
+                "rejected_calls": self.rejected,
+                "probes": self.probes,
+                "trips": self.trips,
+            }
@@ -0,0 +1,179 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .sql_executor import SqlExecutor, SqlTimeoutError
+from .sql_pool import ConnectionPool, CostMeter
+from .throttle import CollectionThrottle
+
+
+class Snapshot:
+    """Latest result of a collector job. Treated as immutable once published."""
+
+    __slots__ = ("name", "data", "collected_at", "version", "duration_ms")
+
+    def __init__(self, name: str, data: Dict[str, Any], collected_at: float, version: int, duration_ms: float):
+        self.name = name
+        self.data = data
+        self.collected_at = collected_at
+        self.version = version
+        self.duration_ms = duration_ms
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.collected_at
+
+
+class CollectorJob:
+    def __init__(self, name: str, fetch: Callable[[], Dict[str, Any]], interval: float, timeout: Optional[float] = None,
+                 when: Optional[Callable[[], bool]] = None, pool: Optional[ConnectionPool] = None):
+        self.name = name
+        self.fetch = fetch
+        self.interval = interval
+        self.timeout = timeout
+        self.when = when
+        self.pool = pool
+        self.runs = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.last_run: Optional[float] = None
+        self.last_duration_ms = 0.0
+        self.last_cpu_ms: Optional[int] = None
+        self.next_interval = interval
+
+
+class MetricsCollector:
+    """Runs registered DMV fetches on their own intervals and keeps the latest snapshot of each.
+
+    Endpoints read snapshots instead of querying SQL Server, so the load on the monitored
+    server depends on the configured intervals, not on how many dashboards are open.
+    With a throttle, each run is metered and the throttle may stretch a job's interval
+    or skip the run to stay within its cost budget or back off a server under pressure.
+    """
+
+    def __init__(self, executor: SqlExecutor, throttle: Optional[CollectionThrottle] = None):
+        self._executor = executor
+        self.throttle = throttle
+        self._jobs: Dict[str, CollectorJob] = {}
+        self._snapshots: Dict[str, Snapshot] = {}
+        self._last_good: Dict[str, Snapshot] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._listeners: List[Callable[[Snapshot], Any]] = []
+
+    def register(self, name: str, fetch: Callable[[], Dict[str, Any]], interval: float, timeout: Optional[float] = None,
+                 when: Optional[Callable[[], bool]] = None, pool: Optional[ConnectionPool] = None):
+        """when: si se indica, el job sólo corre mientras devuelva True (p. ej. sólo con clientes conectados).
+        pool: pool distinto del del executor (consultas lentas, con su propio timeout por statement)"""
+        self._jobs[name] = CollectorJob(name, fetch, interval, timeout, when, pool)
+
+    def add_listener(self, listener: Callable[[Snapshot], Any]):
+        """listener(snapshot) se llama en el event loop cada vez que se publica un snapshot nuevo"""
+        self._listeners.append(listener)
+
+    def get(self, name: str) -> Optional[Snapshot]:
+        return self._snapshots.get(name)
+
+    def last_good(self, name: str) -> Optional[Snapshot]:
+        """Último snapshot sin error de ese job (el que se sirve, marcado como stale, mientras el servidor falla)"""
+        return self._last_good.get(name)
+
+    def versions(self) -> tuple:
+        """(job, versión del snapshot) de cada job; cambia cada vez que se publica algo nuevo"""
+        return tuple((name, snapshot.version) for name, snapshot in self._snapshots.items())
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self._tasks:
+            return
+        for job in self._jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job), name=f"collector:{job.name}"))
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def collect(self, name: str) -> Snapshot:
+        """Ejecuta un job una vez y publica su snapshot"""
+        job = self._jobs[name]
+        started = time.monotonic()
+        meter = CostMeter() if self.throttle is not None else None
+        try:
+            data = await self._executor.run(job.fetch, timeout=job.timeout, meter=meter, pool=job.pool)
+        except SqlTimeoutError as e:
+            data = {"timestamp": time.time(), "error": str(e)}
+        job.runs += 1
+        job.last_run = time.time()
+        job.last_duration_ms = (time.monotonic() - started) * 1000
+        if meter is not None:
+            job.last_cpu_ms = meter.cpu_ms if meter.measured else None
+            self.throttle.record(name, job.last_duration_ms, job.last_cpu_ms)
+        if isinstance(data, dict) and data.get("error"):
+            job.errors += 1
+            job.last_error = data["error"]
+
+        previous = self._snapshots.get(name)
+        snapshot = Snapshot(name, data, job.last_run, previous.version + 1 if previous else 1, job.last_duration_ms)
+        self._snapshots[name] = snapshot
+        if not (isinstance(data, dict) and data.get("error")):
+            self._last_good[name] = snapshot
+        for listener in self._listeners:
+            try:
+                result = listener(snapshot)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"Collector listener error ({name}): {e}")
+        return snapshot
+
+    async def _loop(self, job: CollectorJob):
+        while True:
+            started = time.monotonic()
+            if job.when is not None and not job.when():
+                await asyncio.sleep(job.interval)
+                continue
+            run, job.next_interval = (True, job.interval) if self.throttle is None else self.throttle.plan(job.name, job.interval)
+            if not run:
+                await asyncio.sleep(job.next_interval)
+                continue
+            try:
+                await self.collect(job.name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.errors += 1
+                job.last_error = str(e)
+                print(f"Collector job {job.name} failed: {e}")
+            await asyncio.sleep(max(0.0, job.next_interval - (time.monotonic() - started)))
+
+    def status(self) -> Dict[str, Any]:
+        jobs = {}
+        for name, job in self._jobs.items():
+            snapshot = self._snapshots.get(name)
+            jobs[name] = {
+                "interval_seconds": job.interval,
+                "effective_interval_seconds": round(job.next_interval, 2),
+                "runs": job.runs,
+                "errors": job.errors,
+                "last_error": job.last_error,
+                "last_duration_ms": round(job.last_duration_ms, 1),
+                "last_cpu_ms": job.last_cpu_ms,
+                "snapshot_version": snapshot.version if snapshot else 0,
+                "snapshot_age_seconds": round(snapshot.age, 2) if snapshot else None,
+            }
+        return {"running": self.running, "jobs": jobs}
+
+
+
+# Histórico de métricas para /performance-trends, alimentado por el snapshot del dashboard
+TREND_SERIES = {
+    "cpu_percent": lambda d: d["system_stats"]["cpu_percent"],
+    "memory_percent": lambda d: d["system_stats"]["memory_percent"],
+    "sessions": lambda d: d["overview"]["session_stats"]["total_sessions"],
+    "active_sessions": lambda d: d["overview"]["session_stats"]["active_sessions"],
+    "io_mb": lambda d: d["overview"]["performance_stats"]["total_io_mb"],
+}
@@ -0,0 +1,616 @@
+from typing import Dict, Any, List
+import time
+from .blocking import build_blocking_forest
+from .circuit import CircuitOpenError
+from .sql_pool import active_pool
+
+# Consultas DMV síncronas (pymssql). Se ejecutan en el SqlExecutor, nunca directamente en el event loop.
+
+def get_sql_connection():
+    """Toma una conexión del pool del servidor activo; close() la devuelve al pool en lugar de cerrarla"""
+    pool = active_pool()
+    if pool is None:
+        print("SQL Server connection error: no server selected for this call")
+        return None
+    try:
+        return pool.acquire()
+    except CircuitOpenError:
+        # Servidor caído y ya notificado al abrirse el circuito: se falla al instante, sin volver a registrarlo
+        return None
+    except Exception as e:
+        print(f"SQL Server connection error: {e}")
+        return None
+
+def run_batch(cursor, statements: List[str], names: List[str]) -> List[List[tuple]]:
+    """Envía varias consultas en un solo batch (un round trip) y devuelve las filas de cada result set en orden.
+    names identifica cada statement en las estadísticas de query_stats.py"""
+    cursor.execute("SET NOCOUNT ON;\n" + ";\n".join(statements), name=names)
+    results = [cursor.fetchall()]
+    while len(results) < len(statements) and cursor.nextset():
+        results.append(cursor.fetchall())
+    if len(results) != len(statements):
+        raise RuntimeError(f"Batch returned {len(results)} result sets, expected {len(statements)}")
+    return results
+
+def first_row(rows: List[tuple]):
+    return rows[0] if rows else None
+
+# ===== DASHBOARD =====
+
+SYSTEM_STATS_QUERIES = [
+    """
+    SELECT COUNT(*) as total_schedulers,
+           SUM(current_tasks_count) as total_tasks,
+           SUM(runnable_tasks_count) as total_runnable
+    FROM sys.dm_os_schedulers 
+    WHERE status = 'VISIBLE ONLINE'
+    """,
+    """
+    SELECT ROUND(((total_physical_memory_kb - available_physical_memory_kb) * 100.0 / total_physical_memory_kb), 1) AS memory_usage_percent
+    FROM sys.dm_os_sys_memory
+    """,
+    """
+    SELECT TOP 1 CAST(ROUND(((vs.total_bytes - vs.available_bytes) * 100.0 / vs.total_bytes), 1) AS DECIMAL(5,1)) AS Used_Percentage
+    FROM sys.master_files AS f
+    CROSS APPLY sys.dm_os_volume_stats(f.database_id, f.file_id) AS vs
+    WHERE f.database_id = 2
+    ORDER BY vs.total_bytes DESC
+    """,
+]
+SYSTEM_STATS_NAMES = ["system_stats.schedulers", "system_stats.memory", "system_stats.disk_volume"]
+
+DASHBOARD_OVERVIEW_QUERIES = [
+    """
+    SELECT @@SERVERNAME as server_name, SERVERPROPERTY('ProductVersion') as version, SERVERPROPERTY('Edition') as edition,
+           DATEDIFF(day, sqlserver_start_time, GETDATE()) as uptime_days,
+           DATEPART(hour, GETDATE() - sqlserver_start_time) as uptime_hours
+    FROM sys.dm_os_sys_info
+    """,
+    """
+    SELECT COUNT(*) as total_sessions, SUM(CASE WHEN status IN ('running', 'runnable') THEN 1 ELSE 0 END) as active_sessions
+    FROM sys.dm_exec_sessions WHERE is_user_process = 1
+    """,
+    """
+    SELECT COUNT(*) as total_databases, SUM(CASE WHEN state = 0 THEN 1 ELSE 0 END) as online_databases,
+           SUM(CASE WHEN name NOT IN ('master', 'tempdb', 'model', 'msdb') THEN 1 ELSE 0 END) as user_databases
+    FROM sys.databases
+    """,
+    """
+    SELECT DB_NAME(database_id) as database_name, SUM(num_of_bytes_read + num_of_bytes_written) as total_io_bytes
+    FROM sys.dm_io_virtual_file_stats(NULL, NULL)
+    GROUP BY database_id
+    """,
+    "SELECT COUNT(*) FROM sys.dm_exec_requests WHERE DATEDIFF(minute, start_time, GETDATE()) > 2",
+    "SELECT COUNT(*) FROM sys.dm_exec_requests WHERE blocking_session_id > 0",
+]
+DASHBOARD_OVERVIEW_NAMES = ["overview.server_info", "overview.sessions", "overview.databases",
+                            "overview.io", "overview.long_running", "overview.blocked"]
+
+def build_system_stats(results: List[List[tuple]]) -> Dict[str, Any]:
+    cpu_result, memory_result, disk_result = (first_row(rows) for rows in results)
+    total_schedulers = total_runnable = 0
+    
+    if cpu_result and cpu_result[0] > 0:
+        total_schedulers = cpu_result[0]
+        total_tasks = cpu_result[1] or 0
+        total_runnable = cpu_result[2] or 0
+        avg_activity = (total_tasks + total_runnable) / total_schedulers
+        cpu_percent = min(avg_activity * 20, 100)
+        if cpu_percent < 5:
+            cpu_percent = min(15 + (total_tasks * 2), 80)
+    else:
+        cpu_percent = 10
+    
+    memory_percent = float(memory_result[0]) if memory_result and memory_result[0] is not None else 0
+    disk_usage = float(disk_result[0]) if disk_result and disk_result[0] is not None else 0
+    
+    return {
+        "timestamp": time.time(),
+        "cpu_percent": round(cpu_percent, 1),
+        "memory_percent": round(memory_percent, 1),
+        "disk_usage": round(disk_usage, 1),
+        "schedulers": total_schedulers,
+        "runnable_tasks": total_runnable,
+        "status": "connected_remote_server"
+    }
+
+def build_dashboard_overview(results: List[List[tuple]]) -> Dict[str, Any]:
+    server_info, session_info, db_info, _, long_row, blocked_row = (first_row(rows) for rows in results)
+    # Una fila por base de datos (DB_NAME es NULL si se borró mientras tanto)
+    io_by_database = {str(name or "N/A"): int(io_bytes or 0) for name, io_bytes in results[3]}
+    io_bytes_total = sum(io_by_database.values())
+    long_queries = long_row[0]
+    blocked_sessions = blocked_row[0]
+    
+    return {
+        "timestamp": time.time(),
+        "server_info": {
+            "name": server_info[0],
+            "version": server_info[1][:20] + "..." if len(server_info[1]) > 20 else server_info[1],
+            "edition": server_info[2],
+            "uptime_days": server_info[3],
+            "uptime_hours": server_info[4]
+        },
+        "session_stats": {"total_sessions": session_info[0], "active_sessions": session_info[1], "blocked_sessions": blocked_sessions},
+        "database_stats": {"total_databases": db_info[0], "online_databases": db_info[1], "user_databases": db_info[2]},
+        "performance_stats": {"long_running_queries": long_queries, "total_io_mb": round(io_bytes_total / 1024 / 1024, 1),
+                              "total_io_bytes": io_bytes_total, "io_bytes_by_database": io_by_database, "deadlocks": 0}
+    }
+
+def fetch_dashboard_snapshot() -> Dict[str, Any]:
+    """System stats + overview en un único batch multi-result-set: un round trip en lugar de nueve"""
+    conn = get_sql_connection()
+    if not conn:
+        return {"timestamp": time.time(), "error": "Cannot connect to SQL Server"}
+    
+    try:
+        cursor = conn.cursor()
+        results = run_batch(cursor, SYSTEM_STATS_QUERIES + DASHBOARD_OVERVIEW_QUERIES,
+                            SYSTEM_STATS_NAMES + DASHBOARD_OVERVIEW_NAMES)
+        cursor.close()
+        conn.close()
+        split = len(SYSTEM_STATS_QUERIES)
+        return {
+            "timestamp": time.time(),
+            "system_stats": build_system_stats(results[:split]),
+            "overview": build_dashboard_overview(results[split:])
+        }
+        
+    except Exception as e:
+        if conn:
+            conn.invalidate()
+        return {"timestamp": time.time(), "error": f"Dashboard query failed: {str(e)}"}
+
+# Las consultas top (lentas, frecuentes...) se sirven desde el snapshot de plan_cache.py
+
+# Waits benignos/de fondo que no indican presión
+IGNORED_WAIT_TYPES = (
+    'CLR_SEMAPHORE', 'LAZYWRITER_SLEEP', 'RESOURCE_QUEUE', 'SLEEP_TASK',
+    'SLEEP_SYSTEMTASK', 'SQLTRACE_BUFFER_FLUSH', 'WAITFOR', 'LOGMGR_QUEUE',
+    'CHECKPOINT_QUEUE', 'REQUEST_FOR_DEADLOCK_SEARCH', 'XE_TIMER_EVENT',
+    'BROKER_TO_FLUSH', 'BROKER_TASK_STOP', 'CLR_MANUAL_EVENT',
+    'CLR_AUTO_EVENT', 'DISPATCHER_QUEUE_SEMAPHORE', 'FT_IFTS_SCHEDULER_IDLE_WAIT',
+    'XE_DISPATCHER_WAIT', 'XE_DISPATCHER_JOIN', 'SQLTRACE_INCREMENTAL_FLUSH_SLEEP',
+    'SP_SERVER_DIAGNOSTICS_SLEEP', 'HADR_FILESTREAM_IOMGR_IOCOMPLETION', 
+    'BROKER_EVENTHANDLER', 'BROKER_RECEIVE_WAITFOR',
+    'DIRTY_PAGE_POLL', 'HADR_DATABASE_WAIT_FOR_TRANSITION_TO_VERSIONING'
+)
+
+WAIT_STATS_QUERIES = [
+    # Inicio de la instancia en epoch UTC, para detectar reinicios
+    """
+    SELECT DATEDIFF(second, '19700101', DATEADD(second, DATEDIFF(second, GETDATE(), GETUTCDATE()), sqlserver_start_time))
+    FROM sys.dm_os_sys_info
+    """,
+    """
+    SELECT wait_type, waiting_tasks_count, wait_time_ms, signal_wait_time_ms
+    FROM sys.dm_os_wait_stats
+    WHERE wait_type NOT IN (%s)
+      AND waiting_tasks_count > 0
+    """ % ", ".join(f"'{w}'" for w in IGNORED_WAIT_TYPES),
+]
+WAIT_STATS_NAMES = ["wait_stats.start_time", "wait_stats.counters"]
+
+def fetch_wait_stats_counters() -> Dict[str, Any]:
+    """Contadores acumulados de sys.dm_os_wait_stats por wait type; los deltas por intervalo se calculan en wait_stats.py"""
+    conn = get_sql_connection()
+    if not conn:
+        return {"timestamp": time.time(), "error": "Cannot connect to SQL Server"}
+    
+    try:
+        cursor = conn.cursor()
+        start_rows, wait_rows = run_batch(cursor, WAIT_STATS_QUERIES, WAIT_STATS_NAMES)
+        cursor.close()
+        conn.close()
+        
+        return {
+            "timestamp": time.time(),
+            "sqlserver_start_time": float(start_rows[0][0]) if start_rows and start_rows[0][0] is not None else None,
+            "counters": {row[0]: (row[1], row[2], row[3]) for row in wait_rows}
+        }
+        
+    except Exception as e:
+        if conn:
+            conn.invalidate()
+        return {"timestamp": time.time(), "error": f"Query failed: {str(e)}"}
+
+def fetch_missing_indexes() -> Dict[str, Any]:
+    """Obtiene recomendaciones de índices faltantes"""
+    conn = get_sql_connection()
+    if not conn:
+        return {"timestamp": time.time(), "error": "Cannot connect to SQL Server", "indexes": []}
+    
+    try:
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT TOP 10
+                DB_NAME(mid.database_id) AS database_name,
+                OBJECT_NAME(mid.object_id, mid.database_id) AS table_name,
+                mid.equality_columns + ISNULL(', ' + mid.inequality_columns, '') AS suggested_columns,
+                migs.user_seeks + migs.user_scans AS total_seeks_scans,
+                CAST(migs.avg_total_user_cost * migs.avg_user_impact / 100.0 AS DECIMAL(18,2)) AS improvement_measure,
+                CASE 
+                    WHEN migs.avg_user_impact > 80 THEN 'Alto'
+                    WHEN migs.avg_user_impact > 50 THEN 'Medio'
+                    ELSE 'Bajo'
+                END AS impact_level
+            FROM sys.dm_db_missing_index_details mid
+            INNER JOIN sys.dm_db_missing_index_groups mig ON mid.index_handle = mig.index_handle
+            INNER JOIN sys.dm_db_missing_index_group_stats migs ON mig.index_group_handle = migs.group_handle
+            WHERE mid.database_id > 4  -- Solo bases de datos de usuario
+            ORDER BY improvement_measure DESC
+        """, name="missing_indexes")
+        
+        indexes = []
+        for row in cursor.fetchall():
+            indexes.append({
+                "database": row[0] if row[0] else "N/A",
+                "table": row[1] if row[1] else "N/A",
+                "suggested_columns": row[2] if row[2] else "N/A",
+                "seeks_scans": row[3] if row[3] else 0,
+                "improvement_measure": float(row[4]) if row[4] else 0,
+                "impact_level": row[5] if row[5] else "Bajo"
+            })
+        
+        cursor.close()
+        conn.close()
+        
+        return {
+            "timestamp": time.time(),
+            "indexes": indexes
+        }
+        
+    except Exception as e:
+        if conn:
+            conn.invalidate()
+        return {"timestamp": time.time(), "error": f"Query failed: {str(e)}", "indexes": []}
+
+# Firma de cambios por BD: si MAX(last_user_update) no cambió desde el último escaneo no hace falta volver a escanearla
+USER_DATABASES_QUERY = """
+    SELECT d.name, d.database_id, CONVERT(varchar(33), MAX(us.last_user_update), 126) AS last_user_update
+    FROM sys.databases d
+    LEFT JOIN sys.dm_db_index_usage_stats us ON us.database_id = d.database_id
+    WHERE d.database_id > 4  -- Excluir master, tempdb, model, msdb
+      AND d.state = 0        -- Solo bases de datos ONLINE
+      AND d.is_read_only = 0 -- Solo bases de datos de lectura/escritura
+    GROUP BY d.name, d.database_id
+    ORDER BY d.name
+"""
+
+def fetch_user_databases() -> Dict[str, Any]:
+    """Bases de datos de usuario con su firma de cambios (última escritura registrada)"""
+    conn = get_sql_connection()
+    if not conn:
+        return {"timestamp": time.time(), "error": "Cannot connect to SQL Server", "databases": []}
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute(USER_DATABASES_QUERY, name="user_databases")
+        databases = [{"name": row[0], "database_id": row[1], "signature": row[2]} for row in cursor.fetchall()]
+        cursor.close()
+        conn.close()
+        
+        return {
+            "timestamp": time.time(),
+            "databases": databases
+        }
+        
+    except Exception as e:
+        if conn:
+            conn.invalidate()
+        return {"timestamp": time.time(), "error": f"Query failed: {str(e)}", "databases": []}
+
+def fetch_database_fragmentation(db_name: str, db_id: int) -> Dict[str, Any]:
+    """Índices fragmentados (top 10) de una base de datos de usuario y cuántos hay en total"""
+    conn = get_sql_connection()
+    if not conn:
+        return {"timestamp": time.time(), "error": "Cannot connect to SQL Server", "indexes": []}
+    
+    try:
+        cursor = conn.cursor()
+        
+        # Nombres de tres partes en lugar de USE para no cambiar el contexto de la conexión del pool
+        query = f"""
+            SELECT TOP 10
+                N'{db_name}' AS database_name,
+                OBJECT_NAME(ips.object_id, ips.database_id) AS table_name,
+                i.name AS index_name,
+                ips.avg_fragmentation_in_percent,
+                ips.page_count,
+                CASE 
+                    WHEN ips.avg_fragmentation_in_percent > 30 THEN 'REBUILD'
+                    WHEN ips.avg_fragmentation_in_percent > 10 THEN 'REORGANIZE'
+                    ELSE 'OK'
+                END AS recommendation,
+                COUNT(*) OVER () AS fragmented_count  -- antes del TOP: todos los que cumplen el filtro
+            FROM sys.dm_db_index_physical_stats({db_id}, NULL, NULL, NULL, 'LIMITED') ips
+            INNER JOIN [{db_name}].sys.indexes i ON ips.object_id = i.object_id AND ips.index_id = i.index_id
+            WHERE ips.avg_fragmentation_in_percent > 5
+              AND ips.page_count > 100  -- Solo índices con suficientes páginas
+              AND i.index_id > 0  -- Excluir heaps
+              AND ips.object_id > 100  -- Excluir objetos del sistema
+            ORDER BY ips.avg_fragmentation_in_percent DESC
+        """
+        
+        cursor.execute(query, name="index_fragmentation")
+        rows = cursor.fetchall()
+        indexes = []
+        for row in rows:
+            indexes.append({
+                "database": row[0] if row[0] else "N/A",
+                "table": row[1] if row[1] else "N/A",
+                "index_name": row[2] if row[2] else "N/A", 
+                "fragmentation_percent": round(float(row[3]), 1) if row[3] else 0,
+                "page_count": row[4] if row[4] else 0,
+                "recommendation": row[5] if row[5] else "OK"
+            })
+        
+        cursor.close()
+        conn.close()
+        
+        return {
+            "timestamp": time.time(),
+            "indexes": indexes,
+            "fragmented_count": rows[0][6] if rows else 0
+        }
+        
+    except Exception as e:
+        if conn:
+            conn.invalidate()
+        return {"timestamp": time.time(), "error": f"Query failed: {str(e)}", "indexes": []}
+
+# ===== REAL-TIME =====
+
+def fetch_realtime_sample() -> Dict[str, Any]:
+    """Contadores acumulados y estado actual para el stream del tab Real-Time (los rates se calculan en realtime.py)"""
+    conn = get_sql_connection()
+    if not conn:
+        return {"timestamp": time.time(), "error": "Cannot connect to SQL Server"}
+    
+    try:
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT SUM(num_of_reads), SUM(num_of_writes), SUM(num_of_bytes_read), SUM(num_of_bytes_written)
+            FROM sys.dm_io_virtual_file_stats(NULL, NULL)
+        """, name="realtime.io")
+        io_row = cursor.fetchone()
+        
+        cursor.execute("""
+            SELECT RTRIM(counter_name), cntr_value
+            FROM sys.dm_os_performance_counters
+            WHERE counter_name IN ('Batch Requests/sec', 'Page lookups/sec')
+              AND instance_name = ''
+        """, name="realtime.perf_counters")
+        counters = {row[0]: row[1] for row in cursor.fetchall()}
+        
+        cursor.execute("""
+            SELECT 
+                COUNT(*) AS waiting_tasks,
+                SUM(CASE WHEN wait_type LIKE 'PAGEIOLATCH%' OR wait_type IN ('WRITELOG', 'IO_COMPLETION', 'ASYNC_IO_COMPLETION') THEN 1 ELSE 0 END) AS io_waits,
+                SUM(CASE WHEN wait_type LIKE 'LCK%' THEN 1 ELSE 0 END) AS lock_waits,
+                SUM(CASE WHEN wait_type IN ('SOS_SCHEDULER_YIELD', 'THREADPOOL') OR wait_type LIKE 'CX%' THEN 1 ELSE 0 END) AS cpu_waits
+            FROM sys.dm_os_waiting_tasks
+            WHERE session_id > 50
+        """, name="realtime.waiting_tasks")
+        waits_row = cursor.fetchone()
+        
+        cursor.execute("""
+            SELECT 
+                SUM(CASE WHEN is_user_process = 1 THEN 1 ELSE 0 END) AS user_sessions,
+                SUM(CASE WHEN is_user_process = 1 AND status IN ('running', 'runnable') THEN 1 ELSE 0 END) AS active_sessions,
+                SUM(CASE WHEN is_user_process = 1 AND status = 'sleeping' THEN 1 ELSE 0 END) AS sleeping_sessions,
+                SUM(CASE WHEN is_user_process = 0 THEN 1 ELSE 0 END) AS background_tasks
+            FROM sys.dm_exec_sessions
+        """, name="realtime.sessions")
+        sessions_row = cursor.fetchone()
+        
+        cursor.execute("""
+            SELECT TOP 10 r.session_id, r.status, r.command, DB_NAME(r.database_id), r.wait_type,
+                   r.total_elapsed_time, r.cpu_time, r.blocking_session_id
+            FROM sys.dm_exec_requests r
+            WHERE r.session_id > 50 AND r.session_id <> @@SPID
+            ORDER BY r.total_elapsed_time DESC
+        """, name="realtime.running_requests")
+        running = [{
+            "session_id": row[0],
+            "status": row[1],
+            "command": row[2],
+            "database": row[3] if row[3] else "N/A",
+            "wait_type": row[4],
+            "elapsed_ms": row[5] or 0,
+            "cpu_ms": row[6] or 0,
+            "blocking_session_id": row[7] or 0
+        } for row in cursor.fetchall()]
+        
+        cursor.execute("""
+            SELECT TOP 20 l.request_session_id, DB_NAME(l.resource_database_id), l.resource_type,
+                   l.request_mode, l.request_status, wt.blocking_session_id, wt.wait_duration_ms
+            FROM sys.dm_tran_locks l
+            LEFT JOIN sys.dm_os_waiting_tasks wt ON wt.resource_address = l.lock_owner_address
+            WHERE l.request_status <> 'GRANT'
+            ORDER BY wt.wait_duration_ms DESC
+        """, name="realtime.waiting_locks")
+        waiting_locks = [{
+            "session_id": row[0],
+            "database": row[1] if row[1] else "N/A",
+            "resource_type": row[2],
+            "mode": row[3],
+            "status": row[4],
+            "blocking_session_id": row[5] or 0,
+            "wait_ms": row[6] or 0
+        } for row in cursor.fetchall()]
+        
+        cursor.execute("""
+            SELECT SUM(CASE WHEN request_status = 'GRANT' THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN request_status <> 'GRANT' THEN 1 ELSE 0 END)
+            FROM sys.dm_tran_locks
+        """, name="realtime.lock_counts")
+        lock_counts = cursor.fetchone()
+        
+        cursor.close()
+        conn.close()
+        
+        return {
+            "timestamp": time.time(),
+            "io": {
+                "reads": io_row[0] or 0,
+                "writes": io_row[1] or 0,
+                "bytes_read": io_row[2] or 0,
+                "bytes_written": io_row[3] or 0
+            },
+            "counters": {
+                "batch_requests": counters.get("Batch Requests/sec", 0),
+                "page_lookups": counters.get("Page lookups/sec", 0)
+            },
+            "waits": {
+                "waiting_tasks": waits_row[0] or 0,
+                "io_waits": waits_row[1] or 0,
+                "lock_waits": waits_row[2] or 0,
+                "cpu_waits": waits_row[3] or 0
+            },
+            "sessions": {
+                "user_sessions": sessions_row[0] or 0,
+                "active_sessions": sessions_row[1] or 0,
+                "sleeping_sessions": sessions_row[2] or 0,
+                "background_tasks": sessions_row[3] or 0,
+                "running_requests": running
+            },
+            "locks": {
+                "granted": lock_counts[0] or 0,
+                "waiting": lock_counts[1] or 0,
+                "waiting_locks": waiting_locks
+            }
+        }
+        
+    except Exception as e:
+        if conn:
+            conn.invalidate()
+        return {"timestamp": time.time(), "error": f"Query failed: {str(e)}"}
+
+# ===== SESIONES =====
+
+# Sesiones de usuario con su request en curso (si la hay). Con MARS una sesión puede tener varias requests:
+# se queda la primera fila de cada session_id
+SESSION_LIST_QUERY = """
+    SELECT s.session_id, s.login_name, s.host_name, s.program_name, DB_NAME(COALESCE(r.database_id, s.database_id)),
+           COALESCE(r.status, s.status), r.command, r.wait_type, r.wait_time, r.blocking_session_id,
+           COALESCE(r.cpu_time, s.cpu_time), COALESCE(r.logical_reads, s.logical_reads), r.total_elapsed_time,
+           s.open_transaction_count, s.memory_usage * 8, CONVERT(varchar(33), s.login_time, 126),
+           CONVERT(varchar(33), s.last_request_start_time, 126)
+    FROM sys.dm_exec_sessions s
+    LEFT JOIN sys.dm_exec_requests r ON r.session_id = s.session_id
+    WHERE s.is_user_process = 1 AND s.session_id <> @@SPID
+    ORDER BY s.session_id, r.request_id
+"""
+
+def fetch_session_list() -> Dict[str, Any]:
+    """Lista completa de sesiones de usuario para el feed de deltas de realtime.SessionDeltaFeed"""
+    conn = get_sql_connection()
+    if not conn:
+        return {"timestamp": time.time(), "error": "Cannot connect to SQL Server", "sessions": []}
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SESSION_LIST_QUERY, name="session_list")
+        sessions = {}
+        for row in cursor.fetchall():
+            if row[0] in sessions:
+                continue
+            sessions[row[0]] = {
+                "session_id": row[0],
+                "login": row[1],
+                "host": row[2],
+                "program": row[3],
+                "database": row[4] if row[4] else "N/A",
+                "status": row[5],
+                "command": row[6],
+                "wait_type": row[7],
+                "wait_ms": row[8] or 0,
+                "blocking_session_id": row[9] or 0,
+                "cpu_ms": row[10] or 0,
+                "logical_reads": row[11] or 0,
+                "elapsed_ms": row[12] or 0,
+                "open_transactions": row[13] or 0,
+                "memory_kb": row[14] or 0,
+                "login_time": row[15],
+                "last_request_start": row[16]
+            }
+        cursor.close()
+        conn.close()
+        
+        return {
+            "timestamp": time.time(),
+            "sessions": list(sessions.values())
+        }
+        
+    except Exception as e:
+        if conn:
+            conn.invalidate()
+        return {"timestamp": time.time(), "error": f"Query failed: {str(e)}", "sessions": []}
+
+# ===== BLOQUEOS =====
+
+# Una sola consulta: sólo viajan las sesiones implicadas (bloqueadas o bloqueadoras), no todas las abiertas.
+# La arista de espera sale de dm_os_waiting_tasks (la tarea que más lleva esperando) y, si la sesión no tiene
+# tarea en espera, de dm_exec_requests. Un bloqueador inactivo con la transacción abierta no tiene request:
+# su texto es el último batch de la conexión
+BLOCKING_CHAINS_QUERY = """
+    WITH blocking_edges AS (
+        SELECT session_id, blocking_session_id, wait_duration_ms, wait_type, resource_description, 0 AS source
+        FROM sys.dm_os_waiting_tasks
+        WHERE blocking_session_id > 0 AND blocking_session_id <> session_id
+        UNION ALL
+        SELECT session_id, blocking_session_id, wait_time, wait_type, wait_resource, 1
+        FROM sys.dm_exec_requests
+        WHERE blocking_session_id > 0 AND blocking_session_id <> session_id
+    ), blocked AS (
+        SELECT session_id, blocking_session_id, wait_duration_ms, wait_type, resource_description
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY source, wait_duration_ms DESC) AS rn
+            FROM blocking_edges
+        ) e
+        WHERE rn = 1
+    ), involved AS (
+        SELECT session_id FROM blocked
+        UNION
+        SELECT blocking_session_id FROM blocked
+    )
+    SELECT i.session_id, b.blocking_session_id, b.wait_duration_ms, b.wait_type, b.resource_description,
+           s.login_name, s.host_name, s.program_name, DB_NAME(COALESCE(r.database_id, s.database_id)),
+           COALESCE(r.status, s.status), r.command, r.total_elapsed_time, s.open_transaction_count,
+           CASE WHEN r.sql_handle IS NULL THEN t.text
+                ELSE SUBSTRING(t.text, r.statement_start_offset / 2 + 1,
+                               (CASE r.statement_end_offset WHEN -1 THEN DATALENGTH(t.text)
+                                ELSE r.statement_end_offset END - r.statement_start_offset) / 2 + 1) END
+    FROM involved i
+    LEFT JOIN blocked b ON b.session_id = i.session_id
+    LEFT JOIN sys.dm_exec_sessions s ON s.session_id = i.session_id
+    LEFT JOIN sys.dm_exec_requests r ON r.session_id = i.session_id
+    LEFT JOIN sys.dm_exec_connections c ON c.session_id = i.session_id AND c.parent_connection_id IS NULL
+    OUTER APPLY sys.dm_exec_sql_text(COALESCE(r.sql_handle, c.most_recent_sql_handle)) t
+"""
+
+def fetch_blocking_chains() -> Dict[str, Any]:
+    """Cadenas de bloqueo agrupadas por head blocker (ver blocking.py)"""
+    conn = get_sql_connection()
+    if not conn:
+        return {"timestamp": time.time(), "error": "Cannot connect to SQL Server", "chains": []}
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute(BLOCKING_CHAINS_QUERY, name="blocking_chains")
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        
+        return {
+            "timestamp": time.time(),
+            **build_blocking_forest(rows)
+        }
+        
+    except Exception as e:
+        if conn:
+            conn.invalidate()
+        return {"timestamp": time.time(), "error": f"Query failed: {str(e)}", "chains": []}
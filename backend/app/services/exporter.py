@@ -0,0 +1,173 @@
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+from .fleet import Fleet, MonitoredServer
+from .wait_stats import WAIT_CATEGORIES, wait_category
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Dict[str, Any]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    """Precisión completa: contadores y timestamps epoch no caben en los 6 dígitos de :g"""
+    if isinstance(value, int):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+
+class _Family:
+    """Una métrica con su HELP/TYPE y sus muestras"""
+
+    def __init__(self, name: str, kind: str, help_text: str):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.samples: List[Tuple[Labels, float]] = []
+
+    def add(self, labels: Labels, value: Optional[float]):
+        if value is not None:
+            self.samples.append((labels, value))
+
+    def render(self, out: List[str]):
+        if not self.samples:
+            return
+        out.append(f"# HELP {self.name} {self.help_text}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        for labels, value in self.samples:
+            label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            out.append(f"{self.name}{{{label_text}}} {_format_value(value)}")
+
+
+class PrometheusExporter:
+    """Text exposition of the collected metrics for every monitored server.
+
+    Rendering only reads collector snapshots and in-memory scan results, never SQL
+    Server. The rendered text is kept together with the snapshot versions it was
+    built from and served as-is until one of those versions changes.
+    """
+
+    def __init__(self, fleet: Fleet):
+        self._fleet = fleet
+        self._key: Optional[tuple] = None
+        self._text = b""
+        self.renders = 0
+        self.reused = 0
+
+    def _versions(self) -> tuple:
+        key = []
+        for srv in self._fleet.servers():
+            key.append((srv.name, srv.collector.versions(), srv.fragmentation.version, srv.alerts.version))
+        return tuple(key)
+
+    def render(self) -> bytes:
+        key = self._versions()
+        if key == self._key:
+            self.reused += 1
+            return self._text
+        families = self._families()
+        for srv in self._fleet.servers():
+            self._collect_server(srv, families)
+        out: List[str] = []
+        for family in families.values():
+            family.render(out)
+        self._text = ("\n".join(out) + "\n").encode("utf-8")
+        self._key = key
+        self.renders += 1
+        return self._text
+
+    @staticmethod
+    def _families() -> Dict[str, _Family]:
+        specs = (
+            ("up", "gauge", "1 if the last dashboard collection succeeded"),
+            ("cpu_percent", "gauge", "Estimated CPU usage from scheduler load"),
+            ("memory_percent", "gauge", "Physical memory in use on the host"),
+            ("disk_used_percent", "gauge", "Used space on the tempdb volume"),
+            ("sessions", "gauge", "User sessions by state"),
+            ("databases", "gauge", "Databases by state"),
+            ("long_running_queries", "gauge", "Requests running for more than 2 minutes"),
+            ("io_bytes_total", "counter", "Bytes read and written on all database files since startup"),
+            ("database_io_bytes_total", "counter", "Bytes read and written on the files of each database since startup"),
+            ("wait_time_seconds_total", "counter", "Cumulative wait time by category since startup or last clear"),
+            ("waiting_tasks_total", "counter", "Cumulative waits by category since startup or last clear"),
+            ("start_time_seconds", "gauge", "Instance start time, unix epoch"),
+            ("plan_cache_query_hashes", "gauge", "Distinct query_hash values kept in the plan-cache snapshot"),
+            ("fragmented_indexes", "gauge", "Indexes over 100 pages above 5% fragmentation found by the last scan"),
+            ("index_fragmentation_max_percent", "gauge", "Worst index fragmentation found by the last scan"),
+            ("collector_snapshot_timestamp_seconds", "gauge", "When the collector job last published, unix epoch"),
+            ("collector_errors_total", "counter", "Failed runs of a collector job"),
+            ("alerts_firing", "gauge", "Alert rules currently firing, by severity"),
+        )
+        return {name: _Family(f"sqlserver_{name}", kind, help_text) for name, kind, help_text in specs}
+
+    @staticmethod
+    def _collect_server(srv: MonitoredServer, families: Dict[str, _Family]):
+        server = {"server": srv.name}
+        dashboard = srv.collector.get("dashboard_snapshot")
+        ok = dashboard is not None and not dashboard.data.get("error")
+        families["up"].add(server, 1 if ok else 0)
+        if ok:
+            system, overview = dashboard.data["system_stats"], dashboard.data["overview"]
+            families["cpu_percent"].add(server, system["cpu_percent"])
+            families["memory_percent"].add(server, system["memory_percent"])
+            families["disk_used_percent"].add(server, system["disk_usage"])
+            sessions = overview["session_stats"]
+            families["sessions"].add({**server, "state": "total"}, sessions["total_sessions"])
+            families["sessions"].add({**server, "state": "active"}, sessions["active_sessions"])
+            families["sessions"].add({**server, "state": "blocked"}, sessions["blocked_sessions"])
+            databases = overview["database_stats"]
+            families["databases"].add({**server, "state": "total"}, databases["total_databases"])
+            families["databases"].add({**server, "state": "online"}, databases["online_databases"])
+            families["databases"].add({**server, "state": "user"}, databases["user_databases"])
+            families["long_running_queries"].add(server, overview["performance_stats"]["long_running_queries"])
+            families["io_bytes_total"].add(server, overview["performance_stats"]["total_io_bytes"])
+            for database, io_bytes in overview["performance_stats"].get("io_bytes_by_database", {}).items():
+                families["database_io_bytes_total"].add({**server, "database": database}, io_bytes)
+
+        waits = srv.collector.get("wait_stats")
+        if waits is not None and not waits.data.get("error"):
+            wait_ms = {name: 0 for name, _ in WAIT_CATEGORIES}
+            tasks = dict(wait_ms)
+            wait_ms["other"] = tasks["other"] = 0
+            for wait_type, (count, ms, _) in waits.data["counters"].items():
+                category = wait_category(wait_type) or "other"
+                wait_ms[category] += ms
+                tasks[category] += count
+            for category in wait_ms:
+                labels = {**server, "category": category}
+                families["wait_time_seconds_total"].add(labels, wait_ms[category] / 1000)
+                families["waiting_tasks_total"].add(labels, tasks[category])
+            families["start_time_seconds"].add(server, waits.data["sqlserver_start_time"])
+
+        counts = srv.alerts.counts()
+        families["alerts_firing"].add({**server, "severity": "critical"}, counts["critical"])
+        families["alerts_firing"].add({**server, "severity": "other"}, counts["firing"] - counts["critical"])
+
+        if srv.plan_cache.collected_at is not None:
+            families["plan_cache_query_hashes"].add(server, len(srv.plan_cache.entries))
+
+        for scan in srv.fragmentation.databases():
+            if scan.error and not scan.indexes:
+                continue
+            labels = {**server, "database": scan.name}
+            families["fragmented_indexes"].add(labels, scan.fragmented)
+            families["index_fragmentation_max_percent"].add(
+                labels, max((index["fragmentation_percent"] for index in scan.indexes), default=0))
+
+        for job, status in srv.collector.status()["jobs"].items():
+            snapshot = srv.collector.get(job)
+            labels = {**server, "job": job}
+            if snapshot is not None:
+                families["collector_snapshot_timestamp_seconds"].add(labels, snapshot.collected_at)
+            families["collector_errors_total"].add(labels, status["errors"])
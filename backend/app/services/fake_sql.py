@@ -0,0 +1,286 @@
+"""In-process stand-in for a pymssql connection, for benchmarks and load tests.
+
+Select it with SQL_BACKEND=fake. Every DMV query issued by dmv.py, plan_cache.py and
+the fragmentation scanner gets a plausible result set: cumulative counters keep
+growing over time, row counts follow FAKE_SQL_ROWS / FAKE_SQL_DATABASES, and every
+round trip sleeps FAKE_SQL_LATENCY_MS (+/- jitter) like a network hop would.
+"""
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+
+WAIT_TYPES = (
+    "PAGEIOLATCH_SH", "PAGEIOLATCH_EX", "WRITELOG", "IO_COMPLETION", "SOS_SCHEDULER_YIELD", "THREADPOOL",
+    "LCK_M_S", "LCK_M_X", "LCK_M_U", "RESOURCE_SEMAPHORE", "CMEMTHREAD", "CXPACKET", "ASYNC_NETWORK_IO",
+    "PAGELATCH_EX", "LATCH_EX", "BACKUPIO", "OLEDB", "PREEMPTIVE_OS_WRITEFILE",
+)
+
+QUERY_TEMPLATES = (
+    "SELECT o.OrderId, o.Total FROM dbo.Orders o WHERE o.CustomerId = {n} AND o.Status = 'OPEN'",
+    "UPDATE dbo.Inventory SET Quantity = Quantity - 1 WHERE Sku = 'SKU{n}'",
+    "SELECT TOP 50 * FROM dbo.AuditLog WHERE CreatedAt > DATEADD(hour, -{n}, GETDATE()) ORDER BY CreatedAt DESC",
+    "INSERT INTO dbo.Events (Type, Payload) VALUES ({n}, N'payload')",
+    "EXEC dbo.usp_GetCustomerSummary @CustomerId = {n}",
+    "SELECT Sku, Quantity FROM dbo.Inventory WHERE Sku IN ({in_list})",
+)
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections = 0
+            self.round_trips = 0
+            self.statements = 0
+            self.by_query: Dict[str, int] = {}
+            self.unmatched = 0
+
+    def record(self, names: List[str]):
+        with self._lock:
+            self.round_trips += 1
+            self.statements += len(names)
+            for name in names:
+                self.by_query[name] = self.by_query.get(name, 0) + 1
+                if name == "unmatched":
+                    self.unmatched += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "connections": self.connections,
+                "round_trips": self.round_trips,
+                "statements": self.statements,
+                "unmatched_statements": self.unmatched,
+                "by_query": dict(sorted(self.by_query.items(), key=lambda kv: -kv[1])),
+            }
+
+
+stats = _Stats()
+
+
+class FakeServer:
+    """Estado simulado de una instancia: contadores acumulados que crecen con el tiempo"""
+
+    def __init__(self, host: str, rows: int, databases: int):
+        self.host = host
+        self.rows = rows
+        self.databases = databases
+        self.started = time.time() - 3 * 86400
+        self.rng = random.Random(host)
+
+    def elapsed(self) -> float:
+        return time.time() - self.started
+
+    def handle(self, n: int) -> bytes:
+        return n.to_bytes(4, "big") * 5
+
+    def text(self, handle: bytes) -> str:
+        n = int.from_bytes(handle[:4], "big")
+        return QUERY_TEMPLATES[n % len(QUERY_TEMPLATES)].format(n=n, in_list=", ".join(f"'SKU{i}'" for i in range(1 + n % 7)))
+
+
+_servers: Dict[str, FakeServer] = {}
+_servers_lock = threading.Lock()
+
+
+def _server(host: str) -> FakeServer:
+    with _servers_lock:
+        server = _servers.get(host)
+        if server is None:
+            server = _servers[host] = FakeServer(host, settings.fake_sql_rows, settings.fake_sql_databases)
+        return server
+
+
+# Cada statement se identifica por un fragmento de su SQL; el primero que coincide gana
+Handler = Callable[[FakeServer, str], List[tuple]]
+
+
+def _plan_cache(s: FakeServer, sql: str) -> List[tuple]:
+    t = s.elapsed()
+    rows = []
+    for n in range(s.rows):
+        executions = int(10 + t * (s.rows - n) / 60)
+        rows.append((n.to_bytes(8, "big"), s.handle(n), 0, -1, executions, executions * (1500 + 4000 * n),
+                     executions * (800 + 2000 * n), executions * (40 + n), None, 1 + n % 3))
+    return rows
+
+
+def _sql_text(s: FakeServer, sql: str) -> List[tuple]:
+    handles = [bytes.fromhex(h) for h in re.findall(r"\(0x([0-9a-fA-F]+)\)", sql)]
+    return [(h, f"AppDb{int.from_bytes(h[:4], 'big') % max(1, s.databases)}", s.text(h)) for h in handles]
+
+
+def _wait_stats(s: FakeServer, sql: str) -> List[tuple]:
+    t = s.elapsed()
+    return [(w, int(t * (i + 1)), int(t * 13 * (i + 1)), int(t * (i + 1))) for i, w in enumerate(WAIT_TYPES)]
+
+
+def _user_databases(s: FakeServer, sql: str) -> List[tuple]:
+    # La firma cambia cada hora para que el escaneo incremental tenga trabajo
+    return [(f"AppDb{i}", 5 + i, f"2024-01-01T{int(s.elapsed() // 3600) % 24:02d}:00:00") for i in range(s.databases)]
+
+
+def _fragmentation(s: FakeServer, sql: str) -> List[tuple]:
+    db = re.search(r"N'([^']*)' AS database_name", sql)
+    name = db.group(1) if db else "AppDb"
+    # TOP 10 de 25 índices fragmentados
+    return [(name, f"Table{i}", f"IX_Table{i}_Col", 95.0 - i * 8.5, 1000 + 250 * i,
+             "REBUILD" if 95.0 - i * 8.5 > 30 else "REORGANIZE", 25) for i in range(10)]
+
+
+def _blocking_chains(s: FakeServer, sql: str) -> List[tuple]:
+    # Una cadena 60 <- 61 <- 62 (+ 63 bloqueada por 60) mientras dure la "incidencia", que va y viene cada minuto
+    if int(s.elapsed() // 60) % 2:
+        return []
+    head = (60, None, None, None, None, "app_user", "APP01", "OrderService", "AppDb0", "sleeping", None, None, 1,
+            "BEGIN TRAN UPDATE dbo.Orders SET Status = 2 WHERE CustomerId = 42")
+    blocked = [(61, 60, 4200, "LCK_M_U", "KEY: 5:72057594043236352 (8194443284a0)"),
+               (62, 61, 3100, "LCK_M_S", "KEY: 5:72057594043236352 (8194443284a0)"),
+               (63, 60, 1200, "LCK_M_IX", "OBJECT: 5:245575913:0")]
+    return [head] + [(sid, by, ms, wait, res, "app_user", "APP02", "ReportService", "AppDb0", "suspended", "SELECT",
+                      ms + 50, 0, "SELECT * FROM dbo.Orders WHERE CustomerId = @id") for sid, by, ms, wait, res in blocked]
+
+
+def _session_list(s: FakeServer, sql: str) -> List[tuple]:
+    # ~2000 sesiones casi todas dormidas; unas pocas activas cambian en cada muestra y alguna entra o sale
+    t = int(s.elapsed())
+    rows = []
+    for sid in range(51, 2051):
+        if (sid + t // 30) % 97 == 0:
+            continue
+        login = f"2024-01-01T08:{sid % 60:02d}:00"
+        if sid % 40 == 0:
+            elapsed = 1000 * ((t + sid) % 300)
+            rows.append((sid, "app_user", f"APP{sid % 8:02d}", "OrderService", f"AppDb{sid % max(1, s.databases)}", "running",
+                         "SELECT", "PAGEIOLATCH_SH" if sid % 80 == 0 else None, 20 if sid % 80 == 0 else 0, 0, elapsed // 2,
+                         elapsed * 3, elapsed, 1 if sid % 120 == 0 else 0, 1024, login, login))
+        else:
+            rows.append((sid, "app_user", f"APP{sid % 8:02d}", "OrderService", None, "sleeping", None, None, None, None,
+                         sid * 3, sid * 40, None, 0, 24, login, login))
+    return rows
+
+
+HANDLERS: Tuple[Tuple[str, str, Handler], ...] = (
+    ("cost_probe", "'monitor.session_cpu'", lambda s, q: [("monitor.session_cpu", int(s.elapsed() * 50))]),
+    ("blocking_chains", "blocking_edges AS (", _blocking_chains),
+    ("session_list", "s.memory_usage * 8", _session_list),
+    ("plan_cache", "by_hash AS (", _plan_cache),
+    ("sql_text", "sys.dm_exec_sql_text(h.sql_handle)", _sql_text),
+    ("schedulers", "total_schedulers", lambda s, q: [(8, 20 + s.rng.randint(0, 20), s.rng.randint(0, 6))]),
+    ("memory", "dm_os_sys_memory", lambda s, q: [(60 + s.rng.random() * 20,)]),
+    ("disk", "dm_os_volume_stats", lambda s, q: [(42.5,)]),
+    ("server_info", "@@SERVERNAME", lambda s, q: [(s.host.upper(), "16.0.4105.2", "Developer Edition", 3, 4)]),
+    ("session_counts", "FROM sys.dm_exec_sessions WHERE is_user_process = 1",
+     lambda s, q: [(150 + s.rng.randint(0, 50), s.rng.randint(5, 25))]),
+    ("database_counts", "total_databases", lambda s, q: [(s.databases + 4, s.databases + 4, s.databases)]),
+    ("total_io", "total_io_bytes", lambda s, q: [(name, int(s.elapsed() * 0.8 * 1024 * 1024 / (i + 1)))
+                                                  for i, name in enumerate(["master", "tempdb"] + [f"AppDb{d}" for d in range(s.databases)])]),
+    ("long_running", "DATEDIFF(minute, start_time", lambda s, q: [(s.rng.randint(0, 2),)]),
+    ("blocked", "WHERE blocking_session_id > 0", lambda s, q: [(s.rng.randint(0, 1),)]),
+    ("start_time", "DATEDIFF(second, '19700101'", lambda s, q: [(int(s.started),)]),
+    ("wait_stats", "FROM sys.dm_os_wait_stats", _wait_stats),
+    ("missing_indexes", "dm_db_missing_index_details",
+     lambda s, q: [(f"AppDb{i}", f"Table{i}", f"[CustomerId], [Status]", 1000 - i * 50, 5000.0 / (i + 1),
+                    "Alto" if i < 3 else "Medio") for i in range(10)]),
+    ("user_databases", "dm_db_index_usage_stats", _user_databases),
+    ("fragmentation", "dm_db_index_physical_stats", _fragmentation),
+    ("realtime_io", "SUM(num_of_reads)", lambda s, q: [(int(s.elapsed() * 40), int(s.elapsed() * 15),
+                                                        int(s.elapsed() * 40 * 8192), int(s.elapsed() * 15 * 8192))]),
+    ("perf_counters", "dm_os_performance_counters",
+     lambda s, q: [("Batch Requests/sec", int(s.elapsed() * 300)), ("Page lookups/sec", int(s.elapsed() * 9000))]),
+    ("waiting_locks", "TOP 20 l.request_session_id",
+     lambda s, q: [(60 + i, "AppDb0", "KEY", "X", "WAIT", 55, 1500 - i * 100) for i in range(s.rng.randint(0, 3))]),
+    ("waiting_tasks", "FROM sys.dm_os_waiting_tasks", lambda s, q: [(12, 4, 2, 3)]),
+    ("session_states", "background_tasks", lambda s, q: [(180, 14, 160, 40)]),
+    ("running_requests", "TOP 10 r.session_id",
+     lambda s, q: [(55 + i, "running", "SELECT", "AppDb0", None, 1000 * (10 - i), 500 * (10 - i), 0) for i in range(10)]),
+    ("lock_counts", "FROM sys.dm_tran_locks", lambda s, q: [(420, s.rng.randint(0, 3))]),
+    ("health_check", "SELECT 1", lambda s, q: [(1,)]),
+)
+
+
+def _inline(sql: str, params: Any) -> str:
+    """Sustitución de parámetros en el cliente, como la hace pymssql"""
+    def quote(value: Any) -> str:
+        if value is None:
+            return "NULL"
+        if isinstance(value, (bytes, bytearray)):
+            return "0x" + bytes(value).hex()
+        if isinstance(value, str):
+            return "N'" + value.replace("'", "''") + "'"
+        return str(value)
+
+    if isinstance(params, dict):
+        return sql % {key: quote(value) for key, value in params.items()}
+    return sql % tuple(quote(value) for value in (params if isinstance(params, tuple) else (params,)))
+
+
+def _rows_for(server: FakeServer, statement: str) -> Tuple[str, List[tuple]]:
+    for name, marker, handler in HANDLERS:
+        if marker in statement:
+            return name, handler(server, statement)
+    return "unmatched", []
+
+
+class FakeCursor:
+    def __init__(self, connection: "FakeConnection"):
+        self._connection = connection
+        self._sets: List[List[tuple]] = []
+
+    def execute(self, sql: str, params: Optional[Any] = None):
+        # run_batch envía "SET NOCOUNT ON;" + statements unidos por ";\n": un result set por statement
+        if params is not None:
+            sql = _inline(sql, params)
+        body = sql.replace("SET NOCOUNT ON;", "", 1)
+        statements = [part for part in body.split(";\n") if part.strip()]
+        results = [_rows_for(self._connection.server, statement) for statement in statements]
+        stats.record([name for name, _ in results])
+        self._sets = [rows for _, rows in results]
+        self._connection.sleep()
+
+    def fetchall(self) -> List[tuple]:
+        return list(self._sets[0]) if self._sets else []
+
+    def fetchone(self) -> Optional[tuple]:
+        return self._sets[0][0] if self._sets and self._sets[0] else None
+
+    def nextset(self) -> Optional[bool]:
+        if len(self._sets) > 1:
+            self._sets.pop(0)
+            return True
+        return None
+
+    def close(self):
+        self._sets = []
+
+
+class FakeConnection:
+    def __init__(self, host: str, latency_ms: float = 2.0, jitter_ms: float = 0.5):
+        self.server = _server(host)
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.autocommit = True
+        with stats._lock:
+            stats.connections += 1
+
+    def sleep(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def close(self):
+        pass
+
+
+def connect(host: str) -> FakeConnection:
+    return FakeConnection(host, settings.fake_sql_latency_ms, settings.fake_sql_jitter_ms)
@@ -0,0 +1,50 @@
+import hashlib
+import re
+from functools import lru_cache
+from typing import Tuple
+
+from ..core.config import settings
+
+# Un solo recorrido: comentarios, literales de texto e identificadores entre corchetes/comillas se reconocen
+# antes que los números, así nunca se reemplaza nada dentro de un string o de un nombre
+_TOKENS = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>N?'(?:[^']|'')*')
+  | (?P<ident>\[[^\]]*\]|"[^"]*")
+  | (?P<number>(?<![\w@#$.])(?:0x[0-9a-fA-F]*|(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)(?![\w.]))
+  | (?P<space>\s+)
+""", re.S | re.X)
+
+_PLACEHOLDERS = r"\?(?:\s*,\s*\?)*"
+_IN_LIST = re.compile(r"\bIN\s*\(\s*" + _PLACEHOLDERS + r"\s*\)", re.I)
+# Una fila o varias: INSERT ... VALUES (?) y VALUES (?), (?) son el mismo statement con otro tamaño de lote
+_VALUES_ROWS = re.compile(r"(\bVALUES\s*\(\s*" + _PLACEHOLDERS + r"\s*\))(?:\s*,\s*\(\s*" + _PLACEHOLDERS + r"\s*\))*",
+                          re.I)
+_OPERATOR_SPACE = re.compile(r"\s*([=<>!+\-*/%,()])\s*")
+
+
+def _replace(match: "re.Match") -> str:
+    kind = match.lastgroup
+    if kind in ("string", "number"):
+        return "?"
+    if kind in ("comment", "space"):
+        return " "
+    return match.group()
+
+
+@lru_cache(maxsize=settings.query_fingerprint_cache_size)
+def normalize(sql: str) -> Tuple[str, str]:
+    """(texto normalizado, fingerprint) de un statement.
+
+    Literales -> ?, listas IN (...) y filas de VALUES de cualquier longitud -> una sola forma,
+    sin comentarios y con los espacios colapsados. El fingerprint ignora además los espacios
+    alrededor de operadores y las mayúsculas (la intercalación por defecto de SQL Server
+    tampoco distingue mayúsculas en los nombres).
+    """
+    text = _TOKENS.sub(_replace, sql)
+    text = _IN_LIST.sub("IN (?...)", text)
+    text = _VALUES_ROWS.sub(r"\1...", text)
+    text = " ".join(text.split()).rstrip(";").rstrip()
+    key = _OPERATOR_SPACE.sub(r"\1", text).lower()
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+    return text, digest
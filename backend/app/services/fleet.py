@@ -0,0 +1,265 @@
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from ..core.config import settings
+from . import dmv
+from .alerts import AlertEngine, AlertRule, load_alert_rules
+from .circuit import CircuitBreaker
+from .collector import MetricsCollector, Snapshot, TREND_SERIES
+from .fragmentation import FragmentationScanner
+from .metric_archive import MetricArchive
+from .plan_cache import PlanCacheSnapshot
+from .query_stats import QueryStats
+from .realtime import Broadcaster, RealtimeFeed, SessionDeltaFeed
+from .sql_executor import SqlExecutor
+from .sql_pool import create_pool
+from .throttle import CollectionThrottle
+from .timeseries import MetricStore
+from .wait_stats import WaitStatsTracker
+
+
+class ServerConfig:
+    """Una instancia SQL Server del registro"""
+
+    __slots__ = ("name", "host", "port", "user", "password")
+
+    def __init__(self, name: str, host: str, port: int, user: str, password: str):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+
+    @classmethod
+    def from_dict(cls, entry: Dict[str, Any]) -> "ServerConfig":
+        """Los campos que falten toman el valor de SQL_SERVER_*; password_env lee la contraseña de otra variable"""
+        if not entry.get("host"):
+            raise ValueError(f"Server entry without host: {entry!r}")
+        password = entry.get("password")
+        if password is None and entry.get("password_env"):
+            password = os.environ.get(entry["password_env"], "")
+        return cls(
+            name=entry.get("name") or entry["host"],
+            host=entry["host"],
+            port=int(entry.get("port") or settings.sql_server_port),
+            user=entry.get("user") or settings.sql_server_user,
+            password=settings.sql_server_password if password is None else password,
+        )
+
+
+def load_server_configs() -> List[ServerConfig]:
+    """Registro de servidores: SQL_SERVERS_FILE (JSON), SQL_SERVERS (JSON inline) o el SQL_SERVER_HOST de siempre"""
+    entries: List[Dict[str, Any]] = []
+    if settings.sql_servers_file:
+        with open(settings.sql_servers_file, encoding="utf-8") as f:
+            entries.extend(json.load(f))
+    if settings.sql_servers:
+        entries.extend(json.loads(settings.sql_servers))
+    if not entries and settings.sql_server_host:
+        entries.append({"name": settings.sql_server_name, "host": settings.sql_server_host})
+
+    configs = [ServerConfig.from_dict(entry) for entry in entries]
+    names = [c.name for c in configs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate server names in registry: {', '.join(sorted(duplicates))}")
+    return configs
+
+
+class MonitoredServer:
+    """Everything that is per instance: connection pool, executor, collector and in-memory history.
+
+    Each server gets its own bounded pool and executor, so an unreachable or slow
+    instance only ever ties up its own connections and worker threads.
+    """
+
+    def __init__(self, config: ServerConfig, alert_rules: List[AlertRule]):
+        self.name = config.name
+        self.config = config
+        self.query_stats = QueryStats(config.name, settings.sql_slow_query_log_ms)
+        self.breaker = CircuitBreaker(settings.circuit_failure_threshold, settings.circuit_backoff_seconds,
+                                      settings.circuit_max_backoff_seconds)
+        self.pool = create_pool(config.host, config.port, config.user, config.password, self.query_stats, self.breaker)
+        # pymssql aplica el timeout por statement al abrir la conexión: los escaneos largos van en un pool aparte
+        self.slow_pool = create_pool(config.host, config.port, config.user, config.password, self.query_stats,
+                                     self.breaker, query_timeout=settings.sql_slow_query_timeout,
+                                     max_size=settings.sql_slow_pool_max_size)
+        self._supervisor: Optional[asyncio.Task] = None
+        self.executor = SqlExecutor(settings.sql_executor_workers, settings.sql_executor_timeout, self.pool,
+                                    name=f"sql-{config.name}")
+
+        self.plan_cache = PlanCacheSnapshot(settings.plan_cache_rows_per_sort, settings.plan_cache_text_cache_size,
+                                            settings.collect_plan_cache_interval)
+        self.metric_store = MetricStore(settings.trend_raw_points, settings.trend_minute_points, settings.trend_hour_points)
+        self.archive: Optional[MetricArchive] = None
+        if settings.metric_archive_enabled:
+            directory = os.path.join(settings.metric_archive_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", config.name))
+            try:
+                self.archive = MetricArchive(directory, list(TREND_SERIES), settings.metric_retention_days)
+            except OSError as e:
+                print(f"Metric archive disabled for {self.name}: {e}")
+        self.wait_tracker = WaitStatsTracker(settings.wait_stats_history_seconds)
+        self.broadcaster = Broadcaster(settings.ws_queue_size, settings.ws_max_consecutive_drops)
+        self.realtime_feed = RealtimeFeed(self.broadcaster)
+        self.session_feed = SessionDeltaFeed(self.broadcaster)
+        self.alerts = AlertEngine(alert_rules, settings.alert_history_size)
+        self.throttle: Optional[CollectionThrottle] = None
+        if settings.throttle_enabled:
+            self.throttle = CollectionThrottle(settings.throttle_cost_budget_ms, essential=("dashboard_snapshot",),
+                                               expensive=settings.throttle_expensive_work,
+                                               pressure_high=settings.throttle_pressure_high,
+                                               pressure_critical=settings.throttle_pressure_critical,
+                                               pressure_stretch=settings.throttle_pressure_stretch,
+                                               max_stretch=settings.throttle_max_stretch)
+        self.fragmentation = FragmentationScanner(self.executor, settings.fragmentation_scan_workers,
+                                                  settings.fragmentation_cache_ttl, settings.fragmentation_scan_interval,
+                                                  settings.sql_slow_query_timeout, self.throttle, self.slow_pool)
+
+        self.collector = MetricsCollector(self.executor, self.throttle)
+        self.collector.register("dashboard_snapshot", dmv.fetch_dashboard_snapshot, settings.collect_dashboard_interval)
+        self.collector.register("wait_stats", dmv.fetch_wait_stats_counters, settings.collect_wait_stats_interval)
+        self.collector.register("plan_cache", self.plan_cache.fetch, settings.collect_plan_cache_interval,
+                                timeout=settings.sql_slow_query_timeout, pool=self.slow_pool)
+        self.collector.register("realtime", dmv.fetch_realtime_sample, settings.collect_realtime_interval,
+                                when=lambda: self.broadcaster.subscribed("io", "counters", "waits", "sessions", "locks"))
+        self.collector.register("session_list", dmv.fetch_session_list, settings.collect_sessions_interval,
+                                when=lambda: self.broadcaster.subscribed(SessionDeltaFeed.topic))
+        if self.throttle is not None:
+            self.collector.add_listener(self.throttle.on_snapshot)
+        self.collector.add_listener(self.record_performance_sample)
+        self.collector.add_listener(self.record_wait_stats)
+        self.collector.add_listener(self.realtime_feed.on_snapshot)
+        self.collector.add_listener(self.session_feed.on_snapshot)
+        self.collector.add_listener(self.alerts.on_snapshot)
+
+    def record_performance_sample(self, snapshot: Snapshot):
+        if snapshot.name != "dashboard_snapshot" or snapshot.data.get("error"):
+            return
+        values = {series: value(snapshot.data) for series, value in TREND_SERIES.items()}
+        self.metric_store.record(snapshot.collected_at, values)
+        if self.archive is not None:
+            try:
+                self.archive.append(snapshot.collected_at, values)
+            except OSError as e:
+                print(f"Metric archive write failed ({self.name}): {e}")
+
+    def record_wait_stats(self, snapshot: Snapshot):
+        if snapshot.name != "wait_stats" or snapshot.data.get("error"):
+            return
+        self.wait_tracker.add(snapshot.collected_at, snapshot.data["counters"], snapshot.data["sqlserver_start_time"])
+
+    async def start(self):
+        if self._supervisor is None:
+            # Reconexión en segundo plano: las peticiones nunca esperan el login timeout con el circuito abierto
+            probe = lambda: self.executor.run(self.pool.probe, timeout=settings.sql_login_timeout + 5)
+            self._supervisor = asyncio.create_task(self.breaker.supervise(probe), name=f"circuit:{self.name}")
+        await self.collector.start()
+        await self.fragmentation.start()
+
+    async def stop(self):
+        await self.fragmentation.stop()
+        await self.collector.stop()
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+            self._supervisor = None
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.close()
+        self.slow_pool.close()
+        if self.archive is not None:
+            self.archive.close()
+
+    def summary(self) -> Dict[str, Any]:
+        """Métricas clave desde el último snapshot del dashboard (sin consultar SQL Server).
+        Si la última recogida falló se devuelven las últimas métricas buenas con stale=true"""
+        snapshot = self.collector.get("dashboard_snapshot")
+        summary: Dict[str, Any] = {"name": self.name, "host": self.config.host, "circuit": self.breaker.state}
+        if snapshot is None:
+            return {**summary, "status": "no_data"}
+
+        summary["snapshot_age"] = round(snapshot.age, 2)
+        alerts = self.alerts.counts()
+        status = "stale" if snapshot.age > 3 * settings.collect_dashboard_interval else "ok"
+        if snapshot.data.get("error"):
+            summary.update({"status": "error", "error": snapshot.data["error"], "stale": True})
+            snapshot = self.collector.last_good("dashboard_snapshot")
+            if snapshot is None:
+                return {**summary, "alerts": alerts["firing"], "critical_alerts": alerts["critical"]}
+            summary["snapshot_age"] = round(snapshot.age, 2)
+            status = "error"
+
+        overview, system = snapshot.data["overview"], snapshot.data["system_stats"]
+        return {
+            **summary,
+            "status": status,
+            "server_name": overview["server_info"]["name"],
+            "version": overview["server_info"]["version"],
+            "cpu_percent": system["cpu_percent"],
+            "memory_percent": system["memory_percent"],
+            "total_sessions": overview["session_stats"]["total_sessions"],
+            "active_sessions": overview["session_stats"]["active_sessions"],
+            "blocked_sessions": overview["session_stats"]["blocked_sessions"],
+            "long_running_queries": overview["performance_stats"]["long_running_queries"],
+            "alerts": alerts["firing"],
+            "critical_alerts": alerts["critical"],
+        }
+
+
+class Fleet:
+    """Registry of monitored servers; the first one is the default for requests without ?server="""
+
+    def __init__(self, configs: List[ServerConfig]):
+        rules = load_alert_rules(settings.alert_rules_file)
+        self._servers: Dict[str, MonitoredServer] = {config.name: MonitoredServer(config, rules) for config in configs}
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._servers)
+
+    def servers(self) -> List[MonitoredServer]:
+        return list(self._servers.values())
+
+    def get(self, name: Optional[str] = None) -> MonitoredServer:
+        if name is None:
+            if not self._servers:
+                raise KeyError("No SQL Server configured")
+            return next(iter(self._servers.values()))
+        return self._servers[name]
+
+    async def start(self):
+        await asyncio.gather(*(server.start() for server in self._servers.values()))
+
+    async def stop(self):
+        await asyncio.gather(*(server.stop() for server in self._servers.values()), return_exceptions=True)
+        for server in self._servers.values():
+            server.close()
+
+    def summary(self) -> Dict[str, Any]:
+        servers = [server.summary() for server in self._servers.values()]
+        healthy = [s for s in servers if s["status"] == "ok"]
+        by_status: Dict[str, int] = {}
+        for s in servers:
+            by_status[s["status"]] = by_status.get(s["status"], 0) + 1
+        return {
+            "timestamp": time.time(),
+            "servers": servers,
+            "totals": {
+                "servers": len(servers),
+                "by_status": by_status,
+                "total_sessions": sum(s["total_sessions"] for s in healthy),
+                "active_sessions": sum(s["active_sessions"] for s in healthy),
+                "blocked_sessions": sum(s["blocked_sessions"] for s in healthy),
+                "critical_alerts": sum(s.get("critical_alerts", 0) for s in servers),
+                "max_cpu_percent": max((s["cpu_percent"] for s in healthy), default=None),
+                "avg_cpu_percent": round(sum(s["cpu_percent"] for s in healthy) / len(healthy), 1) if healthy else None,
+            },
+        }
+
+
+fleet = Fleet(load_server_configs())
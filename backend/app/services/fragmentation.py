@@ -0,0 +1,191 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from . import dmv
+from .sql_executor import SqlExecutor, SqlTimeoutError
+from .sql_pool import ConnectionPool, CostMeter
+from .throttle import CollectionThrottle
+
+
+class DatabaseScan:
+    """Último resultado de fragmentación de una base de datos"""
+
+    __slots__ = ("name", "signature", "scanned_at", "indexes", "fragmented", "error")
+
+    def __init__(self, name: str, signature: Optional[str], scanned_at: float, indexes: List[Dict[str, Any]],
+                 fragmented: int = 0, error: Optional[str] = None):
+        self.name = name
+        self.signature = signature
+        self.scanned_at = scanned_at
+        self.indexes = indexes  # sólo los peores (top 10)
+        self.fragmented = fragmented  # todos los índices fragmentados, no sólo los de indexes
+        self.error = error
+
+
+class FragmentationScanner:
+    """Background index-fragmentation scan, fanned out across databases.
+
+    sys.dm_db_index_physical_stats is expensive, so each database is scanned on its
+    own pooled connection with at most `workers` scans in flight, and its result is
+    kept for `ttl` seconds. A database is scanned again before that only if its
+    change signature (last user write in dm_db_index_usage_stats) moved. Results of
+    finished databases are readable while the rest of the scan is still running.
+    With a throttle, a whole scan is metered as the "fragmentation" work: it is not
+    started while the throttle says skip and the periodic interval stretches with it.
+    Scans run on `pool` when given, a pool whose connections allow `timeout` per statement.
+    """
+
+    def __init__(self, executor: SqlExecutor, workers: int = 4, ttl: float = 86400, interval: float = 3600,
+                 timeout: Optional[float] = None, throttle: Optional[CollectionThrottle] = None,
+                 pool: Optional[ConnectionPool] = None):
+        self._executor = executor
+        self.pool = pool
+        self.throttle = throttle
+        self._meter: Optional[CostMeter] = None
+        self.workers = workers
+        self.ttl = ttl
+        self.interval = interval
+        self.timeout = timeout
+        self._results: Dict[str, DatabaseScan] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._status: Dict[str, Any] = {"state": "idle"}
+        self.version = 0
+
+    @property
+    def scanning(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _needs_scan(self, database: Dict[str, Any], force: bool) -> bool:
+        previous = self._results.get(database["name"])
+        if force or previous is None or previous.error:
+            return True
+        return previous.signature != database["signature"] or time.time() - previous.scanned_at > self.ttl
+
+    def start_scan(self, force: bool = False) -> Dict[str, Any]:
+        """Lanza un escaneo si no hay uno en curso; no espera a que termine"""
+        if not self.scanning and self.throttle is not None:
+            run, reason = self.throttle.allow("fragmentation")
+            if not run:
+                self._status = {"state": "throttled", "reason": reason, "at": time.time()}
+                return self.status()
+        if not self.scanning:
+            self._status = {"state": "running", "started_at": time.time(), "force": force}
+            self._task = asyncio.create_task(self._scan(force), name="fragmentation-scan")
+        return self.status()
+
+    async def _scan_database(self, semaphore: asyncio.Semaphore, database: Dict[str, Any]):
+        async with semaphore:
+            self._status["in_progress"].append(database["name"])
+            try:
+                data = await self._executor.run(dmv.fetch_database_fragmentation, database["name"],
+                                                database["database_id"], timeout=self.timeout, meter=self._meter,
+                                                pool=self.pool)
+            except SqlTimeoutError as e:
+                data = {"error": str(e), "indexes": []}
+            finally:
+                self._status["in_progress"].remove(database["name"])
+
+        if data.get("error"):
+            print(f"Error processing database {database['name']}: {data['error']}")
+            self._status["databases_failed"] += 1
+            previous = self._results.get(database["name"])
+            # Se conserva el último resultado bueno; la firma vacía fuerza reintentar en el próximo escaneo
+            self._results[database["name"]] = DatabaseScan(
+                database["name"], None, previous.scanned_at if previous else time.time(),
+                previous.indexes if previous else [], previous.fragmented if previous else 0, data["error"])
+        else:
+            self._results[database["name"]] = DatabaseScan(database["name"], database["signature"], time.time(),
+                                                           data["indexes"], data.get("fragmented_count", len(data["indexes"])))
+        self.version += 1
+        self._status["databases_done"] += 1
+
+    async def _scan(self, force: bool):
+        started = time.monotonic()
+        self._meter = CostMeter() if self.throttle is not None else None
+        try:
+            await self._scan_databases(force)
+        finally:
+            if self._meter is not None:
+                self.throttle.record("fragmentation", (time.monotonic() - started) * 1000,
+                                     self._meter.cpu_ms if self._meter.measured else None)
+
+    async def _scan_databases(self, force: bool):
+        try:
+            listing = await self._executor.run(dmv.fetch_user_databases, timeout=self.timeout, meter=self._meter,
+                                               pool=self.pool)
+        except SqlTimeoutError as e:
+            listing = {"error": str(e), "databases": []}
+        if listing.get("error"):
+            self._status.update({"state": "failed", "error": listing["error"], "finished_at": time.time()})
+            return
+
+        databases = listing["databases"]
+        # Las BD que ya no existen (o pasaron a offline/read-only) salen de los resultados
+        names = {db["name"] for db in databases}
+        for name in list(self._results):
+            if name not in names:
+                del self._results[name]
+                self.version += 1
+
+        pending = [db for db in databases if self._needs_scan(db, force)]
+        self._status.update({
+            "databases_total": len(databases),
+            "databases_to_scan": len(pending),
+            "databases_unchanged": len(databases) - len(pending),
+            "databases_done": 0,
+            "databases_failed": 0,
+            "in_progress": [],
+        })
+        semaphore = asyncio.Semaphore(self.workers)
+        try:
+            await asyncio.gather(*(self._scan_database(semaphore, db) for db in pending))
+            self._status["state"] = "done"
+        except Exception as e:
+            self._status.update({"state": "failed", "error": str(e)})
+        finally:
+            self._status["finished_at"] = time.time()
+
+    async def _periodic(self):
+        while True:
+            self.start_scan()
+            # Si el escaneo sale caro para su presupuesto (o el servidor está bajo presión) el siguiente se espacia
+            await asyncio.sleep(self.interval * (self.throttle.stretch("fragmentation") if self.throttle is not None else 1.0))
+
+    async def start(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._periodic(), name="fragmentation-scheduler")
+
+    async def stop(self):
+        tasks = [t for t in (self._loop_task, self._task) if t is not None]
+        self._loop_task = self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def status(self) -> Dict[str, Any]:
+        status = dict(self._status)
+        if "in_progress" in status:
+            status["in_progress"] = list(status["in_progress"])
+        status["databases_cached"] = len(self._results)
+        return status
+
+    def databases(self) -> List[DatabaseScan]:
+        return list(self._results.values())
+
+    def results(self, limit: int = 20) -> Dict[str, Any]:
+        all_indexes = [index for scan in self._results.values() for index in scan.indexes]
+        all_indexes.sort(key=lambda x: x["fragmentation_percent"], reverse=True)
+        scanned = [scan.scanned_at for scan in self._results.values() if not scan.error]
+        return {
+            "timestamp": time.time(),
+            "indexes": all_indexes[:limit],
+            "databases_processed": len(self._results),
+            "total_fragmented_indexes": sum(scan.fragmented for scan in self._results.values()),
+            "oldest_scan": min(scanned) if scanned else None,
+            "partial": self.scanning,
+            "scan": self.status(),
+            "errors": {scan.name: scan.error for scan in self._results.values() if scan.error},
+        }
+
@@ -0,0 +1,225 @@
+import datetime
+import glob
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+MAGIC = b"SQLMSEG1"
+HEADER_SIZE = 256
+_HEADER = struct.Struct("<8sI")
+
+
+def _day(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+class Segment:
+    """One append-only segment file: a 256-byte header and fixed-width little-endian rows.
+
+    Row layout is (timestamp, col_1 .. col_n) as float64, so row i starts at
+    HEADER_SIZE + i * row_size and lookups by time are a binary search over the file.
+    Missing values are stored as NaN.
+    """
+
+    def __init__(self, path: str, columns: Optional[Sequence[str]] = None):
+        self.path = path
+        if columns is not None and not os.path.exists(path):
+            names = ",".join(columns).encode("utf-8")
+            if _HEADER.size + len(names) > HEADER_SIZE:
+                raise ValueError("Too many columns for a segment header")
+            with open(path, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, len(columns)) + names.ljust(HEADER_SIZE - _HEADER.size, b"\0"))
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        magic, ncols = _HEADER.unpack_from(header)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a metric segment")
+        names = header[_HEADER.size:].rstrip(b"\0").decode("utf-8")
+        self.columns = names.split(",")[:ncols] if ncols else []
+        self.row = struct.Struct(f"<{1 + ncols}d")
+
+    def __len__(self):
+        return max(0, (os.path.getsize(self.path) - HEADER_SIZE) // self.row.size)
+
+    def repair(self):
+        """Trunca una fila a medio escribir (p. ej. tras un corte) para que los appends sigan alineados"""
+        size = HEADER_SIZE + len(self) * self.row.size
+        if os.path.getsize(self.path) != size:
+            with open(self.path, "r+b") as f:
+                f.truncate(size)
+
+    def last_ts(self) -> Optional[float]:
+        count = len(self)
+        if not count:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(HEADER_SIZE + (count - 1) * self.row.size)
+            return struct.unpack("<d", f.read(8))[0]
+
+    def scan(self, start: float, end: float) -> Tuple[array, Dict[str, array]]:
+        """Columns for rows with start <= ts < end. Only the matching rows are copied out of the mmap."""
+        count = len(self)
+        if not count:
+            return array("d"), {name: array("d") for name in self.columns}
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ts_at = lambda i: struct.unpack_from("<d", mm, HEADER_SIZE + i * self.row.size)[0]
+
+            def bisect(ts: float) -> int:
+                lo, hi = 0, count
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if ts_at(mid) < ts:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                return lo
+
+            lo, hi = bisect(start), bisect(end)
+            flat = array("d", mm[HEADER_SIZE + lo * self.row.size:HEADER_SIZE + hi * self.row.size])
+        width = 1 + len(self.columns)
+        return flat[0::width], {name: flat[i + 1::width] for i, name in enumerate(self.columns)}
+
+
+class MetricArchive:
+    """Persistent metric history: one directory per server, one segment per UTC day.
+
+    Samples are appended to today's segment; segments older than the retention are
+    deleted whole. Reads memory-map only the segments that overlap the requested
+    range and aggregate on the fly, so a query never holds more than its own
+    window (or its buckets) in memory.
+    """
+
+    def __init__(self, directory: str, columns: Sequence[str], retention_days: int = 30):
+        self.directory = directory
+        self.columns = list(columns)
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment: Optional[Segment] = None
+        self._day: Optional[str] = None
+        self._last_ts = -math.inf
+        self.appended = 0
+        self.deleted_segments = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_paths(self) -> List[str]:
+        def order(path: str):
+            # 2024-05-01.seg, 2024-05-01.1.seg, ...: por día y luego por parte
+            parts = os.path.basename(path).split(".")
+            return parts[0], int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else 0
+        return sorted(glob.glob(os.path.join(self.directory, "*.seg")), key=order)
+
+    def _open_today(self, ts: float):
+        day = _day(ts)
+        if self._file is not None:
+            self._file.close()
+        # Si el segmento del día existe con otras columnas se abre una parte nueva
+        part = 0
+        while True:
+            path = os.path.join(self.directory, f"{day}.seg" if part == 0 else f"{day}.{part}.seg")
+            segment = Segment(path, self.columns)
+            if segment.columns == self.columns:
+                break
+            part += 1
+        segment.repair()
+        last = segment.last_ts()
+        if last is not None:
+            self._last_ts = max(self._last_ts, last)
+        self._segment, self._day = segment, day
+        self._file = open(path, "ab")
+        self.enforce_retention(ts)
+
+    def append(self, ts: float, values: Dict[str, Optional[float]]):
+        with self._lock:
+            if self._day != _day(ts):
+                self._open_today(ts)
+            if ts <= self._last_ts:
+                # Las filas deben quedar ordenadas por tiempo para la búsqueda binaria
+                return
+            row = [ts] + [math.nan if values.get(name) is None else float(values[name]) for name in self.columns]
+            self._file.write(self._segment.row.pack(*row))
+            self._file.flush()
+            self._last_ts = ts
+            self.appended += 1
+
+    def enforce_retention(self, now: Optional[float] = None):
+        cutoff = _day((now or time.time()) - self.retention_days * 86400)
+        for path in self._segment_paths():
+            if os.path.basename(path)[:10] < cutoff:
+                try:
+                    os.remove(path)
+                    self.deleted_segments += 1
+                except OSError as e:
+                    print(f"Could not delete metric segment {path}: {e}")
+
+    def query(self, names: Sequence[str], start: float, end: float, bucket_seconds: int = 0,
+              stat: str = "avg") -> Dict[str, Tuple[array, array]]:
+        """{name: (timestamps, values)} for start <= ts < end; bucket_seconds > 0 aggregates per bucket"""
+        first_day, last_day = _day(start), _day(end)
+        out = {name: (array("d"), array("d")) for name in names}
+        buckets: Dict[str, Dict[float, List[float]]] = {name: {} for name in names}
+        for path in self._segment_paths():
+            day = os.path.basename(path)[:10]
+            if day < first_day or day > last_day:
+                continue
+            try:
+                timestamps, columns = Segment(path).scan(start, end)
+            except (OSError, ValueError) as e:
+                print(f"Skipping unreadable metric segment {path}: {e}")
+                continue
+            for name in names:
+                values = columns.get(name)
+                if values is None:
+                    continue
+                if not bucket_seconds:
+                    ts_out, values_out = out[name]
+                    for ts, value in zip(timestamps, values):
+                        if not math.isnan(value):
+                            ts_out.append(ts)
+                            values_out.append(value)
+                    continue
+                agg = buckets[name]
+                for ts, value in zip(timestamps, values):
+                    if math.isnan(value):
+                        continue
+                    bucket = ts - ts % bucket_seconds
+                    current = agg.get(bucket)
+                    if current is None:
+                        agg[bucket] = [value, value, value, 1]
+                    else:
+                        current[0] = min(current[0], value)
+                        current[1] = max(current[1], value)
+                        current[2] += value
+                        current[3] += 1
+        if bucket_seconds:
+            pick = {"min": lambda b: b[0], "max": lambda b: b[1]}.get(stat, lambda b: b[2] / b[3])
+            for name, agg in buckets.items():
+                ts_out, values_out = out[name]
+                for bucket in sorted(agg):
+                    ts_out.append(bucket)
+                    values_out.append(pick(agg[bucket]))
+        return {name: series for name, series in out.items() if len(series[0])}
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._day = None
+
+    def stats(self) -> Dict[str, object]:
+        paths = self._segment_paths()
+        return {
+            "directory": self.directory,
+            "segments": len(paths),
+            "bytes": sum(os.path.getsize(p) for p in paths),
+            "oldest_segment": os.path.basename(paths[0])[:10] if paths else None,
+            "appended": self.appended,
+            "deleted_segments": self.deleted_segments,
+            "retention_days": self.retention_days,
+        }
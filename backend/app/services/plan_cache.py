@@ -0,0 +1,426 @@
+import base64
+import heapq
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .capture import register_lookup
+from .dmv import get_sql_connection
+from .fingerprint import normalize
+
+# Claves de orden disponibles -> campo de PlanEntry
+SORT_KEYS = {
+    "avg_duration": "avg_elapsed_us",
+    "total_duration": "total_elapsed_us",
+    "executions": "execution_count",
+    "avg_cpu": "avg_worker_us",
+    "total_cpu": "total_worker_us",
+    "avg_reads": "avg_logical_reads",
+    "total_reads": "total_logical_reads",
+}
+
+# Una fila por query_hash, sin CROSS APPLY a sys.dm_exec_sql_text: el texto se pide aparte y sólo para handles nuevos.
+# Por defecto se traen todas: los totales por fingerprint suman también las variantes de la cola larga, que por
+# separado no entran en ningún top. Con {n} > 0 sólo se conservan las TOP {n} filas de cada orden (totales aproximados).
+_PLAN_QUERY = """
+WITH {source}by_hash AS (
+    SELECT query_hash,
+           SUM(execution_count) AS execution_count,
+           SUM(total_elapsed_time) AS total_elapsed_time,
+           SUM(total_worker_time) AS total_worker_time,
+           SUM(total_logical_reads) AS total_logical_reads,
+           MAX(last_execution_time) AS last_execution_time,
+           COUNT(*) AS plan_count
+    FROM {stats}
+    GROUP BY query_hash
+),{ranked}
+representative AS (
+    SELECT query_hash, sql_handle, statement_start_offset, statement_end_offset,
+           ROW_NUMBER() OVER (PARTITION BY query_hash ORDER BY execution_count DESC) AS rn
+    FROM {stats}
+)
+SELECT r.query_hash, p.sql_handle, p.statement_start_offset, p.statement_end_offset,
+       r.execution_count, r.total_elapsed_time, r.total_worker_time, r.total_logical_reads,
+       r.last_execution_time, r.plan_count
+FROM {rows} r
+JOIN representative p ON p.query_hash = r.query_hash AND p.rn = 1
+WHERE {where}
+"""
+
+_RANKED_CTE = """
+ranked AS (
+    SELECT *,
+           ROW_NUMBER() OVER (ORDER BY total_elapsed_time / execution_count DESC) AS r_avg_elapsed,
+           ROW_NUMBER() OVER (ORDER BY total_elapsed_time DESC) AS r_total_elapsed,
+           ROW_NUMBER() OVER (ORDER BY execution_count DESC) AS r_executions,
+           ROW_NUMBER() OVER (ORDER BY total_worker_time / execution_count DESC) AS r_avg_worker,
+           ROW_NUMBER() OVER (ORDER BY total_worker_time DESC) AS r_total_worker,
+           ROW_NUMBER() OVER (ORDER BY total_logical_reads / execution_count DESC) AS r_avg_reads,
+           ROW_NUMBER() OVER (ORDER BY total_logical_reads DESC) AS r_total_reads
+    FROM by_hash
+    WHERE execution_count > 0
+),"""
+
+_TOP_FILTER = """r.r_avg_elapsed <= {n} OR r.r_total_elapsed <= {n} OR r.r_executions <= {n}
+   OR r.r_avg_worker <= {n} OR r.r_total_worker <= {n} OR r.r_avg_reads <= {n} OR r.r_total_reads <= {n}"""
+
+
+def _plan_query(source: str, stats: str, n: Optional[str] = None) -> str:
+    if n is None:
+        return _PLAN_QUERY.format(source=source, stats=stats, ranked="", rows="by_hash", where="r.execution_count > 0")
+    return _PLAN_QUERY.format(source=source, stats=stats, ranked=_RANKED_CTE, rows="ranked", where=_TOP_FILTER.format(n=n))
+
+
+PLAN_CACHE_QUERY = _plan_query("", "sys.dm_exec_query_stats")
+TOP_PLAN_CACHE_QUERY = _plan_query("", "sys.dm_exec_query_stats", "%(n)d")
+
+# Igual pero limitado a una base de datos (dbid del plan). Va por sp_executesql con parámetros: el texto de la
+# consulta es siempre el mismo, así SQL Server reutiliza un único plan para cualquier base de datos o N.
+_IN_DATABASE = """in_database AS (
+    SELECT qs.*
+    FROM sys.dm_exec_query_stats qs
+    CROSS APPLY sys.dm_exec_plan_attributes(qs.plan_handle) pa
+    WHERE pa.attribute = 'dbid' AND CONVERT(int, pa.value) = DB_ID(@db)
+),
+"""
+
+DATABASE_PLAN_CACHE_QUERY = (
+    "EXEC sp_executesql N'" + _plan_query(_IN_DATABASE, "in_database").replace("'", "''") + "', "
+    "N'@db sysname', @db = %(db)s"
+)
+TOP_DATABASE_PLAN_CACHE_QUERY = (
+    "EXEC sp_executesql N'" + _plan_query(_IN_DATABASE, "in_database", "@n").replace("'", "''") + "', "
+    "N'@db sysname, @n int', @db = %(db)s, @n = %(n)s"
+)
+
+SQL_TEXT_QUERY = """
+SELECT h.sql_handle, DB_NAME(st.dbid), st.text
+FROM (VALUES %s) AS h(sql_handle)
+CROSS APPLY sys.dm_exec_sql_text(h.sql_handle) st
+"""
+# Qué handles se piden depende del LRU de textos: la captura/replay lo trata handle a handle
+register_lookup(SQL_TEXT_QUERY)
+
+TEXT_BATCH_SIZE = 200
+
+# Lecturas por base de datos que se conservan (LRU)
+DATABASE_RESULTS_KEPT = 32
+
+
+class PlanEntry:
+    __slots__ = ("query_hash", "sql_handle", "start_offset", "end_offset", "execution_count",
+                 "total_elapsed_us", "total_worker_us", "total_logical_reads", "last_execution_time",
+                 "plan_count", "avg_elapsed_us", "avg_worker_us", "avg_logical_reads", "database", "statement",
+                 "fingerprint", "pattern")
+
+    def __init__(self, row):
+        (self.query_hash, self.sql_handle, self.start_offset, self.end_offset, self.execution_count,
+         self.total_elapsed_us, self.total_worker_us, self.total_logical_reads,
+         self.last_execution_time, self.plan_count) = row
+        executions = self.execution_count or 1
+        self.avg_elapsed_us = self.total_elapsed_us / executions
+        self.avg_worker_us = self.total_worker_us / executions
+        self.avg_logical_reads = self.total_logical_reads / executions
+        self.database = None
+        self.statement = None
+        self.fingerprint = None
+        self.pattern = None
+
+
+def _hash_text(query_hash) -> str:
+    return "0x" + query_hash.hex() if isinstance(query_hash, bytes) else str(query_hash)
+
+
+class QueryGroup:
+    """All plan-cache entries whose statements normalize to the same fingerprint.
+
+    Totals are summed over the members, averages are recomputed from the totals and
+    the representative query_hash is the member with the most executions.
+    """
+
+    __slots__ = ("fingerprint", "pattern", "query_hash", "query_hashes", "execution_count", "total_elapsed_us",
+                 "total_worker_us", "total_logical_reads", "last_execution_time", "plan_count", "avg_elapsed_us",
+                 "avg_worker_us", "avg_logical_reads", "databases", "_top_executions")
+
+    def __init__(self, fingerprint: str, pattern: str):
+        self.fingerprint = fingerprint
+        self.pattern = pattern
+        self.query_hash = None
+        self.query_hashes = 0
+        self.execution_count = 0
+        self.total_elapsed_us = 0
+        self.total_worker_us = 0
+        self.total_logical_reads = 0
+        self.last_execution_time = None
+        self.plan_count = 0
+        self.databases = set()
+        self._top_executions = -1
+
+    def add(self, entry: PlanEntry):
+        self.query_hashes += 1
+        self.execution_count += entry.execution_count
+        self.total_elapsed_us += entry.total_elapsed_us
+        self.total_worker_us += entry.total_worker_us
+        self.total_logical_reads += entry.total_logical_reads
+        self.plan_count += entry.plan_count
+        if entry.last_execution_time and (self.last_execution_time is None or entry.last_execution_time > self.last_execution_time):
+            self.last_execution_time = entry.last_execution_time
+        if entry.database:
+            self.databases.add(entry.database)
+        if entry.execution_count > self._top_executions:
+            self._top_executions = entry.execution_count
+            self.query_hash = entry.query_hash
+
+    def finish(self) -> "QueryGroup":
+        executions = self.execution_count or 1
+        self.avg_elapsed_us = self.total_elapsed_us / executions
+        self.avg_worker_us = self.total_worker_us / executions
+        self.avg_logical_reads = self.total_logical_reads / executions
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        text = self.pattern or ""
+        query_text = text[:100] + "..." if len(text) > 100 else text
+        databases = sorted(self.databases)
+        return {
+            "query": query_text.strip(),
+            "fingerprint": self.fingerprint,
+            "query_hash": _hash_text(self.query_hash),
+            "query_hashes": self.query_hashes,
+            "execution_count": self.execution_count,
+            "plan_count": self.plan_count,
+            "avg_duration_ms": round(self.avg_elapsed_us / 1000, 0),
+            "total_duration_ms": round(self.total_elapsed_us / 1000, 0),
+            "avg_cpu_ms": round(self.avg_worker_us / 1000, 0),
+            "total_cpu_ms": round(self.total_worker_us / 1000, 0),
+            "avg_logical_reads": round(self.avg_logical_reads, 0),
+            "database": databases[0] if len(databases) == 1 else ("multiple" if databases else "N/A"),
+            "last_execution": self.last_execution_time.strftime("%Y-%m-%d %H:%M:%S") if self.last_execution_time else "N/A"
+        }
+
+
+def group_entries(entries: List[PlanEntry]) -> List[QueryGroup]:
+    groups: Dict[str, QueryGroup] = {}
+    for entry in entries:
+        group = groups.get(entry.fingerprint)
+        if group is None:
+            group = groups[entry.fingerprint] = QueryGroup(entry.fingerprint, entry.pattern)
+        group.add(entry)
+    return [group.finish() for group in groups.values()]
+
+
+def encode_cursor(sort: str, value: float, fingerprint: str) -> str:
+    raw = json.dumps([sort, value, fingerprint], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[float, str]:
+    try:
+        cursor_sort, value, fingerprint = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor was issued for sort={cursor_sort}, not {sort}")
+    return float(value), str(fingerprint)
+
+
+def page_groups(groups: List[QueryGroup], sort: str, limit: int = 10, min_executions: int = 0,
+                cursor: Optional[str] = None) -> Dict[str, Any]:
+    """Una página del ranking. Paginación por keyset sobre (valor del orden desc, fingerprint): una página
+    siguiente empieza justo después de la última fila vista aunque el snapshot se haya refrescado entre medias"""
+    field = SORT_KEYS[sort]
+    candidates = [g for g in groups if g.execution_count >= min_executions]
+    total = len(candidates)
+    if cursor:
+        after_value, after_fingerprint = decode_cursor(cursor, sort)
+        candidates = [g for g in candidates
+                      if getattr(g, field) < after_value or (getattr(g, field) == after_value and g.fingerprint > after_fingerprint)]
+    # El fingerprint desempata con orden ascendente: clave (-valor, fingerprint)
+    rows = heapq.nsmallest(limit + 1, candidates, key=lambda g: (-getattr(g, field), g.fingerprint))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, getattr(last, field), last.fingerprint)
+    return {"queries": [g.to_dict() for g in rows], "total": total, "next_cursor": next_cursor}
+
+
+def extract_statement(text: str, start_offset: int, end_offset: int) -> str:
+    """Mismo recorte que SUBSTRING(st.text, start/2 + 1, ...): los offsets son bytes UTF-16"""
+    if not text:
+        return ""
+    end = len(text) if end_offset == -1 else end_offset // 2 + 1
+    return text[start_offset // 2:end]
+
+
+class PlanCacheSnapshot:
+    """Periodic, shared snapshot of sys.dm_exec_query_stats keyed by query_hash.
+
+    Every ranking (slowest, most frequent, most CPU...) is served from the same
+    in-memory entries, grouped by statement fingerprint so ad-hoc variants that only
+    differ in literals rank as one query. Statement text is fetched once per sql_handle
+    and kept in a bounded LRU, so a refresh only asks SQL Server for handles it has not seen.
+    Each query_hash also remembers its normalized shape, so the long tail of the plan cache
+    (every query_hash is read, not only the top of each ranking) does not need its text again.
+    With rows_per_sort > 0 only the top rows of each ranking are read and group totals are approximate.
+    """
+
+    def __init__(self, rows_per_sort: int = 0, text_cache_size: int = 5000, database_ttl: float = 60.0):
+        self.rows_per_sort = rows_per_sort
+        self.text_cache_size = text_cache_size
+        self._texts: "OrderedDict[bytes, tuple]" = OrderedDict()
+        # query_hash -> (database, statement, pattern, fingerprint); se rehace en cada refresco con los hashes vigentes
+        self._shapes: Dict[bytes, tuple] = {}
+        self._lock = threading.Lock()
+        self.entries: List[PlanEntry] = []
+        self.groups: List[QueryGroup] = []
+        self.collected_at: Optional[float] = None
+        self.database_ttl = database_ttl
+        self._databases: "OrderedDict[str, Tuple[float, List[QueryGroup]]]" = OrderedDict()
+        self.text_hits = 0
+        self.text_fetches = 0
+
+    def _cached_text(self, handle: bytes) -> Optional[tuple]:
+        item = self._texts.get(handle)
+        if item is not None:
+            self._texts.move_to_end(handle)
+        return item
+
+    def _remember_text(self, handle: bytes, database: Optional[str], text: str):
+        self._texts[handle] = (database, text)
+        self._texts.move_to_end(handle)
+        while len(self._texts) > self.text_cache_size:
+            self._texts.popitem(last=False)
+
+    def _fetch_texts(self, cursor, handles: List[bytes]):
+        for i in range(0, len(handles), TEXT_BATCH_SIZE):
+            chunk = handles[i:i + TEXT_BATCH_SIZE]
+            cursor.execute(SQL_TEXT_QUERY % ", ".join(["(%s)"] * len(chunk)), tuple(chunk), name="plan_cache.sql_text")
+            for handle, database, text in cursor.fetchall():
+                self._remember_text(bytes(handle), database, text or "")
+        self.text_fetches += len(handles)
+
+    @property
+    def approximate(self) -> bool:
+        """True si sólo se lee el top de cada orden: los totales por fingerprint no incluyen la cola larga"""
+        return self.rows_per_sort > 0
+
+    def _attach_texts(self, cursor, entries: List[PlanEntry], prune: bool = False) -> int:
+        """Texto, base de datos y fingerprint de cada entrada. Los query_hash ya vistos reutilizan su forma
+        normalizada; del resto sólo se piden a SQL Server los handles no cacheados.
+        Con prune, el mapa de formas se queda sólo con los query_hash de estas entradas"""
+        with self._lock:
+            pending = [e for e in entries if bytes(e.query_hash) not in self._shapes]
+            missing = sorted({bytes(e.sql_handle) for e in pending if self._cached_text(bytes(e.sql_handle)) is None})
+            self.text_hits += len(pending) - len(missing)
+            if missing:
+                self._fetch_texts(cursor, missing)
+            for entry in pending:
+                database, text = self._cached_text(bytes(entry.sql_handle)) or (None, "")
+                statement = extract_statement(text, entry.start_offset, entry.end_offset)
+                if statement:
+                    pattern, fingerprint = normalize(statement)
+                    self._shapes[bytes(entry.query_hash)] = (database, statement, pattern, fingerprint)
+                else:
+                    # Statements sin texto (handle ya expulsado del caché) quedan solos, con su query_hash como clave;
+                    # no se recuerdan, el siguiente refresco lo vuelve a intentar
+                    entry.database, entry.statement, entry.pattern, entry.fingerprint = database, "", "", _hash_text(entry.query_hash)
+            for entry in entries:
+                shape = self._shapes.get(bytes(entry.query_hash))
+                if shape is not None:
+                    entry.database, entry.statement, entry.pattern, entry.fingerprint = shape
+            if prune:
+                self._shapes = {bytes(e.query_hash): self._shapes[bytes(e.query_hash)]
+                                for e in entries if bytes(e.query_hash) in self._shapes}
+        return len(missing)
+
+    def refresh(self, cursor) -> Dict[str, Any]:
+        if self.approximate:
+            cursor.execute(TOP_PLAN_CACHE_QUERY % {"n": self.rows_per_sort}, name="plan_cache")
+        else:
+            cursor.execute(PLAN_CACHE_QUERY, name="plan_cache")
+        entries = [PlanEntry(row) for row in cursor.fetchall()]
+        new_handles = self._attach_texts(cursor, entries, prune=True)
+        groups = group_entries(entries)
+
+        # Reemplazo atómico: los lectores ven el snapshot anterior o el nuevo, nunca uno a medias
+        self.entries = entries
+        self.groups = groups
+        self.collected_at = time.time()
+        return {"timestamp": self.collected_at, "query_hashes": len(entries), "fingerprints": len(groups),
+                "new_sql_handles": new_handles, "approximate": self.approximate}
+
+    def fetch(self) -> Dict[str, Any]:
+        """Job del collector: refresca el snapshot con una conexión del servidor activo"""
+        conn = get_sql_connection()
+        if not conn:
+            return {"timestamp": time.time(), "error": "Cannot connect to SQL Server"}
+
+        try:
+            cursor = conn.cursor()
+            result = self.refresh(cursor)
+            cursor.close()
+            conn.close()
+            return result
+
+        except Exception as e:
+            if conn:
+                conn.invalidate()
+            return {"timestamp": time.time(), "error": f"Query failed: {str(e)}"}
+
+    def database_groups(self, database: str) -> Optional[Tuple[float, List[QueryGroup]]]:
+        """(collected_at, grupos) de la última lectura de esa base de datos si sigue vigente"""
+        with self._lock:
+            item = self._databases.get(database)
+            if item is None or time.time() - item[0] > self.database_ttl:
+                return None
+            self._databases.move_to_end(database)
+            return item
+
+    def fetch_database(self, database: str) -> Dict[str, Any]:
+        """Consulta en vivo del plan cache de una base de datos, agrupada aparte del snapshot global"""
+        conn = get_sql_connection()
+        if not conn:
+            return {"timestamp": time.time(), "error": "Cannot connect to SQL Server"}
+
+        try:
+            cursor = conn.cursor()
+            if self.approximate:
+                cursor.execute(TOP_DATABASE_PLAN_CACHE_QUERY, {"db": database, "n": self.rows_per_sort}, name="plan_cache.database")
+            else:
+                cursor.execute(DATABASE_PLAN_CACHE_QUERY, {"db": database}, name="plan_cache.database")
+            entries = [PlanEntry(row) for row in cursor.fetchall()]
+            self._attach_texts(cursor, entries)
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            if conn:
+                conn.invalidate()
+            return {"timestamp": time.time(), "error": f"Query failed: {str(e)}"}
+
+        for entry in entries:
+            entry.database = database
+        collected_at = time.time()
+        with self._lock:
+            self._databases[database] = (collected_at, group_entries(entries))
+            self._databases.move_to_end(database)
+            while len(self._databases) > DATABASE_RESULTS_KEPT:
+                self._databases.popitem(last=False)
+        return {"timestamp": collected_at, "database": database, "query_hashes": len(entries)}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "query_hashes": len(self.entries),
+            "fingerprints": len(self.groups),
+            "approximate": self.approximate,
+            "known_query_hashes": len(self._shapes),
+            "normalizer_cache": normalize.cache_info()._asdict(),
+            "collected_at": self.collected_at,
+            "databases_cached": list(self._databases),
+            "text_cache_entries": len(self._texts),
+            "text_cache_hits": self.text_hits,
+            "texts_fetched": self.text_fetches,
+        }
+
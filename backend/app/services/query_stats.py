@@ -0,0 +1,210 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger("sqlmonitor.slow_query")
+
+# Límites superiores de los buckets en ms; lo que pase del último cae en +Inf
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram: O(1) per observation, percentiles estimated from bucket bounds."""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms: float):
+        i = 0
+        while i < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, pct: float) -> float:
+        """Límite superior del bucket donde cae el percentil (acotado por el máximo observado)"""
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                bound = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count, 2) if self.count else 0,
+            "p50_ms": round(self.percentile(50), 2),
+            "p95_ms": round(self.percentile(95), 2),
+            "p99_ms": round(self.percentile(99), 2),
+            "max_ms": round(self.max, 2),
+            "buckets": {("+Inf" if i == len(LATENCY_BUCKETS_MS) else str(LATENCY_BUCKETS_MS[i])): n
+                        for i, n in enumerate(self.counts) if n},
+        }
+
+
+class _Entry:
+    __slots__ = ("latency", "rows", "errors", "slow", "last_ms", "last_at")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.errors = 0
+        self.slow = 0
+        self.last_ms = 0.0
+        self.last_at = 0.0
+
+
+class QueryStats:
+    """Self-instrumentation for one server: latency histograms per (kind, name).
+
+    kind is "query" for a DMV statement (execute + fetch of its result set) and "connect"
+    for opening or health-checking a pooled connection; the API keeps its own instance
+    with "route" (whole request) and "serialize" (JSON rendering). Queries and connects
+    over slow_threshold_ms are logged as one JSON line on the sqlmonitor.slow_query logger.
+    """
+
+    def __init__(self, server: str, slow_threshold_ms: float = 1000.0):
+        self.server = server
+        self.slow_threshold_ms = slow_threshold_ms
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        self.started_at = time.time()
+
+    def record(self, kind: str, name: str, elapsed_ms: float, rows: Optional[int] = None,
+               error: Optional[BaseException] = None):
+        with self._lock:
+            entry = self._entries.get((kind, name))
+            if entry is None:
+                entry = self._entries[(kind, name)] = _Entry()
+            entry.latency.observe(elapsed_ms)
+            entry.rows += rows or 0
+            entry.errors += error is not None
+            entry.last_ms = elapsed_ms
+            entry.last_at = time.time()
+            slow = kind in ("query", "connect") and self.slow_threshold_ms > 0 and elapsed_ms >= self.slow_threshold_ms
+            entry.slow += slow
+        if slow:
+            logger.warning(json.dumps({
+                "event": "slow_query",
+                "server": self.server,
+                "kind": kind,
+                "query": name,
+                "elapsed_ms": round(elapsed_ms, 2),
+                "rows": rows,
+                "threshold_ms": self.slow_threshold_ms,
+                "error": str(error) if error is not None else None,
+            }))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            items = [(kind, name, entry.latency.to_dict(), entry.rows, entry.errors, entry.slow, entry.last_ms, entry.last_at)
+                     for (kind, name), entry in self._entries.items()]
+        out: Dict[str, Dict[str, Any]] = {}
+        for kind, name, latency, rows, errors, slow, last_ms, last_at in sorted(items, key=lambda i: -i[2]["avg_ms"] * i[2]["count"]):
+            out.setdefault(kind, {})[name] = {
+                **latency,
+                "rows": rows,
+                "avg_rows": round(rows / latency["count"], 1) if latency["count"] else 0,
+                "errors": errors,
+                "slow": slow,
+                "last_ms": round(last_ms, 2),
+                "last_at": last_at,
+            }
+        return {
+            "server": self.server,
+            "since": self.started_at,
+            "slow_threshold_ms": self.slow_threshold_ms,
+            "bucket_bounds_ms": list(LATENCY_BUCKETS_MS),
+            **out,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self.started_at = time.time()
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times every result set under a query name.
+
+    execute() takes an extra name: one string, or one name per statement for a
+    multi-result-set batch. Each result set is charged from the moment it is requested
+    (execute or nextset) until the next one is requested or the cursor is closed, so the
+    fetch is included and statements inside one batch are timed separately: SQL Server
+    streams each statement's results as it completes.
+    """
+
+    def __init__(self, cursor, stats: QueryStats):
+        self._cursor = cursor
+        self._stats = stats
+        self._names: List[str] = []
+        self._started = 0.0
+        self._rows = 0
+
+    def _finish(self, error: Optional[BaseException] = None):
+        if not self._names:
+            return
+        name = self._names.pop(0)
+        self._stats.record("query", name, (time.perf_counter() - self._started) * 1000, self._rows, error)
+        self._rows = 0
+
+    def execute(self, operation: str, params: Optional[Any] = None, name: Union[str, Sequence[str]] = "unnamed"):
+        self._finish()
+        self._names = [name] if isinstance(name, str) else list(name)
+        self._started = time.perf_counter()
+        self._rows = 0
+        try:
+            if params is None:
+                self._cursor.execute(operation)
+            else:
+                self._cursor.execute(operation, params)
+        except Exception as e:
+            self._finish(e)
+            self._names = []
+            raise
+
+    def fetchall(self) -> List[tuple]:
+        rows = self._cursor.fetchall()
+        self._rows += len(rows)
+        return rows
+
+    def fetchone(self) -> Optional[tuple]:
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def nextset(self) -> Optional[bool]:
+        self._finish()
+        self._started = time.perf_counter()
+        try:
+            more = self._cursor.nextset()
+        except Exception as e:
+            self._finish(e)
+            self._names = []
+            raise
+        if not more:
+            self._names = []
+        return more
+
+    def close(self):
+        self._finish()
+        self._names = []
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
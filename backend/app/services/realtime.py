@@ -0,0 +1,196 @@
+import asyncio
+import json
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+TOPICS = ("io", "counters", "waits", "sessions", "locks", "session_list")
+
+
+class Subscriber:
+    """One WebSocket client: its topics and a bounded outbound queue."""
+
+    def __init__(self, websocket, topics: Iterable[str], queue_size: int):
+        self.websocket = websocket
+        self.topics: Set[str] = set(topics)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.consecutive_drops = 0
+        self.sent = 0
+
+    def offer(self, message: str) -> bool:
+        """Encola sin bloquear; si la cola está llena descarta el mensaje más antiguo (gana el dato más reciente)"""
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            self.dropped += 1
+            self.consecutive_drops += 1
+            self.queue.put_nowait(message)
+            return False
+        self.consecutive_drops = 0
+        self.queue.put_nowait(message)
+        return True
+
+
+class Broadcaster:
+    """Fan-out of collected samples to WebSocket subscribers.
+
+    Each message is serialized once per publish and handed to every subscriber's
+    queue without awaiting the socket, so one slow client never delays the others;
+    a client that keeps falling behind is disconnected.
+    """
+
+    def __init__(self, queue_size: int = 16, max_consecutive_drops: int = 50):
+        self.queue_size = queue_size
+        self.max_consecutive_drops = max_consecutive_drops
+        self._subscribers: Set[Subscriber] = set()
+        self._snapshot_providers: Dict[str, Callable[[], Optional[Dict[str, Any]]]] = {}
+        self.published = 0
+        self.dropped = 0
+        self.disconnected_slow = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribed(self, *topics: str) -> bool:
+        """True si algún cliente está suscrito a alguno de esos topics"""
+        return any(not subscriber.topics.isdisjoint(topics) for subscriber in self._subscribers)
+
+    def subscribe(self, websocket, topics: Iterable[str]) -> Subscriber:
+        subscriber = Subscriber(websocket, topics, self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    @staticmethod
+    def _message(topic: str, data: Dict[str, Any], timestamp: Optional[float] = None) -> str:
+        return json.dumps({"topic": topic, "timestamp": timestamp or time.time(), "data": data}, default=str)
+
+    def set_snapshot_provider(self, topic: str, provider: Callable[[], Optional[Dict[str, Any]]]):
+        """provider() da el estado completo de un topic publicado como deltas; se envía al suscribirse o al pedir resync"""
+        self._snapshot_providers[topic] = provider
+
+    def send_snapshot(self, subscriber: Subscriber, topics: Iterable[str]):
+        for topic in topics:
+            provider = self._snapshot_providers.get(topic)
+            data = provider() if provider is not None else None
+            if data is not None:
+                subscriber.offer(self._message(topic, data))
+
+    def publish(self, topic: str, data: Dict[str, Any], timestamp: Optional[float] = None):
+        targets = [s for s in self._subscribers if topic in s.topics]
+        if not targets:
+            return
+        message = self._message(topic, data, timestamp)
+        self.published += 1
+        for subscriber in targets:
+            if not subscriber.offer(message):
+                self.dropped += 1
+            if subscriber.consecutive_drops >= self.max_consecutive_drops:
+                self.disconnected_slow += 1
+                self.unsubscribe(subscriber)
+
+    async def pump(self, subscriber: Subscriber):
+        """Envía la cola del subscriber por su WebSocket; termina si fue desconectado por lento"""
+        while True:
+            message = await subscriber.queue.get()
+            if subscriber not in self._subscribers:
+                break
+            await subscriber.websocket.send_text(message)
+            subscriber.sent += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+            "disconnected_slow_clients": self.disconnected_slow,
+        }
+
+
+
+class RealtimeFeed:
+    """Turns cumulative realtime counters into per-second rates and publishes each topic."""
+
+    def __init__(self, broadcaster: Broadcaster):
+        self._broadcaster = broadcaster
+        self._previous: Optional[Dict[str, Any]] = None
+
+    def _rates(self, data: Dict[str, Any]) -> Optional[Dict[str, Dict[str, float]]]:
+        previous, self._previous = self._previous, data
+        if previous is None:
+            return None
+        elapsed = data["timestamp"] - previous["timestamp"]
+        if elapsed <= 0:
+            return None
+        rates = {}
+        for group in ("io", "counters"):
+            rates[group] = {
+                # Un contador que baja indica reinicio del servidor: se reporta 0 en este intervalo
+                f"{key}_per_sec": round(max(0, data[group][key] - previous[group][key]) / elapsed, 1)
+                for key in data[group]
+            }
+        return rates
+
+    def on_snapshot(self, snapshot):
+        if snapshot.name != "realtime" or snapshot.data.get("error"):
+            return
+        data = snapshot.data
+        rates = self._rates(data)
+        if rates is not None:
+            self._broadcaster.publish("io", rates["io"], snapshot.collected_at)
+            self._broadcaster.publish("counters", rates["counters"], snapshot.collected_at)
+        for topic in ("waits", "sessions", "locks"):
+            self._broadcaster.publish(topic, data[topic], snapshot.collected_at)
+
+
+class SessionDeltaFeed:
+    """Live session list published as deltas keyed by session_id.
+
+    Each collection is diffed against the previous one and only inserted rows, the
+    changed fields of updated rows and removed session ids are sent, tagged with a
+    sequence number that grows by one per delta. A client that sees a gap (for example
+    because its queue dropped a message) asks for a resync and gets the full list at
+    the current sequence number.
+    """
+
+    topic = "session_list"
+
+    def __init__(self, broadcaster: Broadcaster):
+        self._broadcaster = broadcaster
+        self._rows: Dict[int, Dict[str, Any]] = {}
+        self.seq = 0
+        self.collected_at: Optional[float] = None
+        broadcaster.set_snapshot_provider(self.topic, self.snapshot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"type": "snapshot", "seq": self.seq, "collected_at": self.collected_at, "sessions": list(self._rows.values())}
+
+    def diff(self, rows: Dict[int, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Delta contra la lista anterior (que pasa a ser rows), o None si nada cambió"""
+        previous, self._rows = self._rows, rows
+        inserted, updated = [], []
+        for session_id, row in rows.items():
+            old = previous.get(session_id)
+            if old is None:
+                inserted.append(row)
+            elif old != row:
+                updated.append({"session_id": session_id, **{k: v for k, v in row.items() if old.get(k) != v}})
+        removed = [session_id for session_id in previous if session_id not in rows]
+        if not (inserted or updated or removed):
+            return None
+        self.seq += 1
+        return {"type": "delta", "seq": self.seq, "inserted": inserted, "updated": updated, "removed": removed}
+
+    def on_snapshot(self, snapshot):
+        if snapshot.name != self.topic or snapshot.data.get("error"):
+            return
+        delta = self.diff({row["session_id"]: row for row in snapshot.data["sessions"]})
+        self.collected_at = snapshot.collected_at
+        if delta is not None:
+            self._broadcaster.publish(self.topic, delta, snapshot.collected_at)
+
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from .sql_pool import ConnectionPool, CostMeter, metering, use_pool
+
+
+class SqlTimeoutError(Exception):
+    """A DMV call did not finish within its per-call timeout."""
+
+
+class SqlExecutor:
+    """Runs blocking pymssql work on a dedicated, size-limited thread pool.
+
+    Handlers await run() so the event loop keeps serving /health and other requests
+    while queries execute. A call that times out is abandoned by the caller; if it is
+    still queued it is skipped, if it is already running the worker thread is freed
+    when pymssql's own query timeout fires.
+
+    Each monitored server has its own executor bound to its connection pool: DMV
+    functions run with that pool active, and a slow instance can only exhaust its
+    own workers.
+    """
+
+    def __init__(self, max_workers: int = 8, default_timeout: float = 30, pool: Optional[ConnectionPool] = None,
+                 name: str = "sql"):
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._skipped = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._run_time_total = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None,
+                  meter: Optional[CostMeter] = None, pool: Optional[ConnectionPool] = None) -> Any:
+        """meter: si se indica, acumula el CPU de SQL Server que consumen las conexiones usadas por fn.
+        pool: otro pool del mismo servidor para fn (el de consultas lentas), en lugar del del executor"""
+        timeout = self.default_timeout if timeout is None else timeout
+        submitted = time.monotonic()
+        abandoned = threading.Event()
+
+        def job():
+            started = time.monotonic()
+            waited = started - submitted
+            with self._lock:
+                self._queued -= 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+                if abandoned.is_set():
+                    self._skipped += 1
+                    return None
+                self._running += 1
+            ok = False
+            try:
+                with use_pool(pool or self.pool), metering(meter):
+                    result = fn(*args)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._run_time_total += time.monotonic() - started
+                    if ok:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+
+        with self._lock:
+            self._queued += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, job)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            abandoned.set()
+            with self._lock:
+                self._timeouts += 1
+            raise SqlTimeoutError(f"{getattr(fn, '__name__', 'query')} timed out after {timeout:g}s")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            started = self._completed + self._failed + self._running + self._skipped
+            finished = self._completed + self._failed
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "timeouts": self._timeouts,
+                "skipped_after_timeout": self._skipped,
+                "avg_wait_ms": round(self._wait_time_total * 1000 / started, 2) if started else 0,
+                "max_wait_ms": round(self._wait_time_max * 1000, 2),
+                "avg_run_ms": round(self._run_time_total * 1000 / finished, 2) if finished else 0,
+            }
+
@@ -0,0 +1,485 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+import pymssql
+
+from ..core.config import settings
+from .capture import CaptureWriter, CapturingCursor, writer_for
+from .circuit import CircuitBreaker
+from .query_stats import InstrumentedCursor, QueryStats
+
+
+class PoolTimeoutError(Exception):
+    """No connection became available within the checkout timeout."""
+
+
+class _PoolEntry:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class CostMeter:
+    """Server-side cost of a unit of work: CPU time charged to the monitor's own sessions.
+
+    While a meter is active (see metering()) every statement sent on a pooled
+    connection is metered by MeteredCursor, inside the batch it already sends.
+    """
+
+    __slots__ = ("cpu_ms", "samples")
+
+    def __init__(self):
+        self.cpu_ms = 0
+        self.samples = 0
+
+    @property
+    def measured(self) -> bool:
+        return self.samples > 0
+
+
+SESSION_CPU_MARKER = "monitor.session_cpu"
+# cpu_time de la sesión sólo se actualiza al terminar cada batch: se suma el del request en curso
+SESSION_CPU_QUERY = (f"SELECT '{SESSION_CPU_MARKER}', s.cpu_time + ISNULL(r.cpu_time, 0) FROM sys.dm_exec_sessions s "
+                     "LEFT JOIN sys.dm_exec_requests r ON r.session_id = s.session_id WHERE s.session_id = @@SPID")
+
+
+class MeteredCursor:
+    """Cursor proxy that charges the CPU of every statement to a CostMeter, with no extra round trip.
+
+    Each statement is sent between two reads of the session's cpu_time in the same
+    batch. The leading result set is consumed by execute(); the trailing one is
+    recognised by its marker column, hidden from the caller and turned into a
+    sample when the caller reaches it or when the cursor moves on or is closed.
+    Other DB-API attributes (description, rowcount...) are those of the wrapped cursor.
+    """
+
+    def __init__(self, cursor, meter: CostMeter):
+        self._cursor = cursor
+        self._meter = meter
+        self._rows: List[tuple] = []
+        self._pos = 0
+        self._before: Optional[int] = None
+        self._pending = False
+
+    def execute(self, operation: str, params: Optional[Any] = None):
+        self._drain()
+        batch = f"{SESSION_CPU_QUERY};\n{operation};\n{SESSION_CPU_QUERY}"
+        if params is None:
+            self._cursor.execute(batch)
+        else:
+            self._cursor.execute(batch, params)
+        rows = self._cursor.fetchall()
+        self._before = rows[0][1] if rows else None
+        self._pending = True
+        self._rows, self._pos = [], 0
+        if self._cursor.nextset():
+            self._load()
+        else:
+            self._pending = False
+
+    def _load(self) -> bool:
+        """Lee el result set actual; False si era la lectura final de cpu_time"""
+        rows = list(self._cursor.fetchall())
+        if rows and rows[0][0] == SESSION_CPU_MARKER:
+            self._pending = False
+            self._rows, self._pos = [], 0
+            if self._before is not None and rows[0][1] is not None:
+                self._meter.cpu_ms += max(0, rows[0][1] - self._before)
+                self._meter.samples += 1
+            return False
+        self._rows, self._pos = rows, 0
+        return True
+
+    def _drain(self):
+        # El llamante no siempre pide nextset tras su último result set: la lectura final sigue en el stream
+        try:
+            while self._pending and self._cursor.nextset():
+                self._load()
+        except Exception:
+            pass
+        self._pending = False
+
+    def executemany(self, operation: str, seq_of_params):
+        # pymssql también ejecuta executemany statement a statement: mismos round trips, cada uno medido
+        for params in seq_of_params:
+            self.execute(operation, params)
+
+    def fetchall(self) -> List[tuple]:
+        rows = self._rows[self._pos:] if self._pos else self._rows
+        self._rows, self._pos = [], 0
+        return rows
+
+    def fetchone(self) -> Optional[tuple]:
+        if self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    def fetchmany(self, size: Optional[int] = None) -> List[tuple]:
+        size = getattr(self._cursor, "arraysize", 1) if size is None else size
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    def nextset(self) -> Optional[bool]:
+        if not self._pending:
+            return None
+        if not self._cursor.nextset():
+            self._pending = False
+            return None
+        return True if self._load() else None
+
+    def close(self):
+        self._drain()
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PooledConnection:
+    """Proxy returned by the pool; close() hands the connection back instead of closing it."""
+
+    def __init__(self, pool: "ConnectionPool", entry: _PoolEntry, meter: Optional[CostMeter] = None):
+        self._pool = pool
+        self._entry = entry
+        self._meter = meter
+
+    def cursor(self) -> InstrumentedCursor:
+        return self._pool._cursor(self._entry, self._meter)
+
+    def close(self):
+        if self._entry is not None:
+            self._pool._release(self._entry)
+            self._entry = None
+
+    def invalidate(self):
+        """Drop the connection from the pool (use after errors, the session state is unknown)."""
+        if self._entry is not None:
+            self._pool._discard(self._entry)
+            self._entry = None
+
+    def __getattr__(self, name):
+        return getattr(self._entry.conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.invalidate()
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of pymssql connections.
+
+    Idle connections older than max_idle_time are closed, connections idle for longer
+    than health_check_interval are pinged with SELECT 1 before being handed out, and
+    callers wait at most checkout_timeout seconds for a free slot. With a circuit
+    breaker, failed connects are counted and, once it opens, acquire() fails at once
+    with CircuitOpenError until a background probe() reconnects.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        max_size: int = 10,
+        max_idle_time: float = 300,
+        checkout_timeout: float = 5,
+        health_check_interval: float = 30,
+        query_stats: Optional[QueryStats] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        capture: Optional[CaptureWriter] = None,
+        metered: bool = True,
+    ):
+        self._connect = connect
+        self.breaker = breaker
+        self.capture = capture
+        self.metered = metered
+        self.query_stats = query_stats or QueryStats("sql")
+        self.max_size = max_size
+        self.max_idle_time = max_idle_time
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+
+        self._checkouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._timeouts = 0
+        self._failed_health_checks = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        timeout = self.checkout_timeout if timeout is None else timeout
+        if self.breaker is not None:
+            self.breaker.check()
+        self.prune_idle()
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            entry = None
+            create = False
+            with self._cond:
+                self._waiting += 1
+                try:
+                    while not self._idle and self._size >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise PoolTimeoutError(
+                                f"No SQL Server connection available after {timeout:.1f}s "
+                                f"(pool size {self.max_size})"
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+                self._in_use += 1
+
+            if create:
+                try:
+                    entry = self._open()
+                except Exception as e:
+                    if self.breaker is not None:
+                        self.breaker.record_failure(e)
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                if self.breaker is not None:
+                    self.breaker.record_success()
+            elif not self._is_usable(entry):
+                self._discard(entry)
+                continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._checkouts += 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+            return PooledConnection(self, entry, _active_meter.get() if self.metered else None)
+
+    def _cursor(self, entry: _PoolEntry, meter: Optional[CostMeter] = None) -> InstrumentedCursor:
+        """Capture por encima del medidor: se graban los statements y result sets del llamante, sin las lecturas de CPU"""
+        cursor = entry.conn.cursor()
+        if meter is not None:
+            cursor = MeteredCursor(cursor, meter)
+        if self.capture is not None:
+            cursor = CapturingCursor(cursor, self.capture)
+        return InstrumentedCursor(cursor, self.query_stats)
+
+    def _open(self) -> _PoolEntry:
+        connect_started = time.perf_counter()
+        try:
+            entry = _PoolEntry(self._connect())
+        except Exception as e:
+            self.query_stats.record("connect", "connect", (time.perf_counter() - connect_started) * 1000, error=e)
+            raise
+        self.query_stats.record("connect", "connect", (time.perf_counter() - connect_started) * 1000)
+        with self._cond:
+            self._created += 1
+        return entry
+
+    def probe(self):
+        """Prueba de reconexión del circuit breaker: abre una conexión sin pasar por el circuito, la valida con
+        SELECT 1 y la deja en el pool. Lanza la excepción si el servidor sigue sin responder"""
+        entry = self._open()
+        try:
+            cursor = self._cursor(entry)
+            cursor.execute("SELECT 1", name="health_check")
+            cursor.fetchone()
+            cursor.close()
+        except Exception:
+            try:
+                entry.conn.close()
+            except Exception:
+                pass
+            raise
+        with self._cond:
+            if self._size < self.max_size:
+                self._size += 1
+                self._idle.append(entry)
+                self._cond.notify()
+                return
+        entry.conn.close()
+
+    def _is_usable(self, entry: _PoolEntry) -> bool:
+        idle_for = time.monotonic() - entry.last_used
+        if idle_for > self.max_idle_time:
+            return False
+        if idle_for > self.health_check_interval:
+            try:
+                cursor = self._cursor(entry)
+                cursor.execute("SELECT 1", name="health_check")
+                cursor.fetchone()
+                cursor.close()
+            except Exception:
+                with self._cond:
+                    self._failed_health_checks += 1
+                return False
+        return True
+
+    def _release(self, entry: _PoolEntry):
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def _discard(self, entry: _PoolEntry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._in_use -= 1
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    def prune_idle(self):
+        """Close idle connections that exceeded max_idle_time."""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            if not self._idle or now - self._idle[0].last_used <= self.max_idle_time:
+                return
+            keep = deque()
+            for entry in self._idle:
+                if now - entry.last_used > self.max_idle_time:
+                    expired.append(entry)
+                else:
+                    keep.append(entry)
+            self._idle = keep
+            self._size -= len(expired)
+            self._discarded += len(expired)
+        for entry in expired:
+            try:
+                entry.conn.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+        for entry in idle:
+            try:
+                entry.conn.close()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": checkouts,
+                "connections_created": self._created,
+                "connections_discarded": self._discarded,
+                "checkout_timeouts": self._timeouts,
+                "failed_health_checks": self._failed_health_checks,
+                "avg_wait_ms": round(self._wait_time_total * 1000 / checkouts, 2) if checkouts else 0,
+                "max_wait_ms": round(self._wait_time_max * 1000, 2),
+            }
+
+
+def sql_server_connector(host: str, port: int, user: str, password: str,
+                         query_timeout: Optional[float] = None) -> Callable[[], Any]:
+    """query_timeout: límite por statement que aplica pymssql en las conexiones creadas (por defecto SQL_QUERY_TIMEOUT)"""
+    if settings.sql_backend == "replay":
+        # Sin servidor: cada consulta devuelve lo capturado en el instante del reloj de replay
+        from .capture import connect as replay_connect
+        return lambda: replay_connect(host)
+    if settings.sql_backend == "fake":
+        # Servidor simulado en proceso para benchmarks y pruebas de carga
+        from .fake_sql import connect as fake_connect
+        return lambda: fake_connect(host)
+
+    def connect():
+        # autocommit: pooled sessions must never be handed back with an open implicit transaction
+        return pymssql.connect(
+            server=host,
+            user=user,
+            password=password,
+            port=port,
+            login_timeout=settings.sql_login_timeout,
+            timeout=int(query_timeout or settings.sql_query_timeout),
+            autocommit=True,
+        )
+    return connect
+
+
+def create_pool(host: str, port: int, user: str, password: str,
+                query_stats: Optional[QueryStats] = None, breaker: Optional[CircuitBreaker] = None,
+                query_timeout: Optional[float] = None, max_size: Optional[int] = None) -> ConnectionPool:
+    return ConnectionPool(
+        sql_server_connector(host, port, user, password, query_timeout),
+        max_size=max_size or settings.sql_pool_max_size,
+        max_idle_time=settings.sql_pool_max_idle_seconds,
+        checkout_timeout=settings.sql_pool_checkout_timeout,
+        health_check_interval=settings.sql_pool_health_check_seconds,
+        query_stats=query_stats,
+        breaker=breaker,
+        capture=writer_for(host) if settings.dmv_capture_enabled and settings.sql_backend != "replay" else None,
+        # En replay el CPU de las lecturas sería el capturado, no el de este proceso
+        metered=settings.sql_backend != "replay",
+    )
+
+
+# Pool de la instancia sobre la que trabaja el hilo actual; lo fija el SqlExecutor de cada servidor
+_active_pool: ContextVar[Optional[ConnectionPool]] = ContextVar("active_pool", default=None)
+
+
+def active_pool() -> Optional[ConnectionPool]:
+    return _active_pool.get()
+
+
+@contextmanager
+def use_pool(pool: Optional[ConnectionPool]):
+    token = _active_pool.set(pool)
+    try:
+        yield pool
+    finally:
+        _active_pool.reset(token)
+
+
+# Medidor de coste de la unidad de trabajo en curso (un job del collector, un escaneo); lo fija SqlExecutor.run
+_active_meter: ContextVar[Optional[CostMeter]] = ContextVar("active_meter", default=None)
+
+
+@contextmanager
+def metering(meter: Optional[CostMeter]):
+    token = _active_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _active_meter.reset(token)
@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+class WorkCost:
+    """Measured cost of one kind of background work and the last throttling decision taken for it."""
+
+    __slots__ = ("name", "budget_ms", "essential", "expensive", "cpu_ms", "elapsed_ms", "runs", "skipped",
+                 "stretch", "decision", "reason")
+
+    def __init__(self, name: str, budget_ms: float, essential: bool, expensive: bool):
+        self.name = name
+        self.budget_ms = budget_ms
+        self.essential = essential
+        self.expensive = expensive
+        self.cpu_ms: Optional[float] = None
+        self.elapsed_ms: Optional[float] = None
+        self.runs = 0
+        self.skipped = 0
+        self.stretch = 1.0
+        self.decision = "run"
+        self.reason: Optional[str] = None
+
+    @property
+    def cost_ms(self) -> Optional[float]:
+        """Coste que se compara con el presupuesto: el mayor entre CPU y tiempo transcurrido (media móvil)"""
+        values = [v for v in (self.cpu_ms, self.elapsed_ms) if v is not None]
+        return max(values) if values else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "budget_ms": self.budget_ms,
+            "essential": self.essential,
+            "expensive": self.expensive,
+            "avg_cpu_ms": round(self.cpu_ms, 1) if self.cpu_ms is not None else None,
+            "avg_elapsed_ms": round(self.elapsed_ms, 1) if self.elapsed_ms is not None else None,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "stretch": round(self.stretch, 2),
+            "decision": self.decision,
+            "reason": self.reason,
+        }
+
+
+class CollectionThrottle:
+    """Cost budgets and server-pressure backoff for the monitor's own SQL Server work.
+
+    Every metered run records its elapsed time and the CPU its sessions used (see
+    sql_pool.CostMeter), smoothed with an exponential moving average. Before each
+    run plan() decides how long to wait:
+
+    - a job whose average cost exceeds its budget has its interval stretched by
+      cost / budget, so its load on the server stays near budget per base interval;
+    - under "high" pressure (runnable tasks per scheduler) non-essential work is
+      stretched by pressure_stretch on top of that;
+    - under "critical" pressure expensive work, or any non-essential work over its
+      budget, is skipped until pressure drops.
+
+    Essential work (the dashboard snapshot, which is also where pressure is read)
+    is only ever stretched for its own cost. Every change of decision is kept in a
+    bounded history for the API.
+    """
+
+    def __init__(self, budgets: Dict[str, float], essential: Iterable[str] = (), expensive: Iterable[str] = (),
+                 pressure_high: float = 1.0, pressure_critical: float = 4.0, pressure_stretch: float = 4.0,
+                 max_stretch: float = 10.0, smoothing: float = 0.3, default_budget_ms: float = 1000.0,
+                 history_size: int = 100):
+        self._budgets = dict(budgets)
+        self._essential = set(essential)
+        self._expensive = set(expensive)
+        self.pressure_high = pressure_high
+        self.pressure_critical = pressure_critical
+        self.pressure_stretch = pressure_stretch
+        self.max_stretch = max_stretch
+        self.smoothing = smoothing
+        self.default_budget_ms = default_budget_ms
+        self._lock = threading.Lock()
+        self._work: Dict[str, WorkCost] = {}
+        self.pressure: Optional[float] = None
+        self.pressure_at: Optional[float] = None
+        self.decisions: deque = deque(maxlen=history_size)
+
+    def _get(self, name: str) -> WorkCost:
+        work = self._work.get(name)
+        if work is None:
+            work = self._work[name] = WorkCost(name, self._budgets.get(name, self.default_budget_ms),
+                                               name in self._essential, name in self._expensive)
+        return work
+
+    @property
+    def level(self) -> str:
+        """normal / high / critical según las tareas runnable por scheduler (la cola de CPU del servidor)"""
+        if self.pressure is None or self.pressure < self.pressure_high:
+            return "normal"
+        return "high" if self.pressure < self.pressure_critical else "critical"
+
+    def on_snapshot(self, snapshot):
+        if snapshot.name != "dashboard_snapshot" or snapshot.data.get("error"):
+            return
+        system = snapshot.data["system_stats"]
+        if system.get("schedulers"):
+            self.pressure = system["runnable_tasks"] / system["schedulers"]
+            self.pressure_at = snapshot.collected_at
+
+    def record(self, name: str, elapsed_ms: float, cpu_ms: Optional[float] = None):
+        """Coste de una ejecución; cpu_ms None si no se pudo medir"""
+        with self._lock:
+            work = self._get(name)
+            work.runs += 1
+            a = self.smoothing
+            work.elapsed_ms = elapsed_ms if work.elapsed_ms is None else a * elapsed_ms + (1 - a) * work.elapsed_ms
+            if cpu_ms is not None:
+                work.cpu_ms = cpu_ms if work.cpu_ms is None else a * cpu_ms + (1 - a) * work.cpu_ms
+
+    def plan(self, name: str, interval: float) -> Tuple[bool, float]:
+        """(ejecutar ahora, segundos hasta la siguiente decisión) para un trabajo con ese intervalo base"""
+        with self._lock:
+            work = self._get(name)
+            level = self.level
+            cost = work.cost_ms
+            over_budget = cost is not None and cost > work.budget_ms
+            stretch = min(self.max_stretch, cost / work.budget_ms) if over_budget else 1.0
+            reason = f"avg cost {cost:.0f}ms over {work.budget_ms:g}ms budget" if over_budget else None
+
+            run = True
+            if not work.essential and level == "critical" and (work.expensive or over_budget):
+                run = False
+                reason = f"server under critical pressure ({self.pressure:.2f} runnable tasks per scheduler)"
+            elif not work.essential and level == "high":
+                stretch = min(self.max_stretch, stretch * self.pressure_stretch)
+                reason = (f"server under pressure ({self.pressure:.2f} runnable tasks per scheduler)"
+                          + (f", {reason}" if reason else ""))
+
+            decision = "skip" if not run else "stretch" if stretch > 1.0 else "run"
+            if not run:
+                work.skipped += 1
+            if decision != work.decision:
+                self.decisions.appendleft({
+                    "timestamp": time.time(),
+                    "work": name,
+                    "decision": decision,
+                    "previous": work.decision,
+                    "reason": reason,
+                    "pressure": round(self.pressure, 2) if self.pressure is not None else None,
+                })
+            work.decision, work.reason, work.stretch = decision, reason, stretch
+            # Un trabajo saltado se reevalúa tras su intervalo base: vuelve en cuanto baja la presión
+            return run, interval if not run else interval * stretch
+
+    def allow(self, name: str) -> Tuple[bool, Optional[str]]:
+        """Para trabajo bajo demanda (sin intervalo): si puede ejecutarse ahora y, si no, por qué"""
+        run, _ = self.plan(name, 0.0)
+        return run, None if run else self._work[name].reason
+
+    def stretch(self, name: str) -> float:
+        """Factor aplicado en la última decisión sobre ese trabajo"""
+        with self._lock:
+            return self._get(name).stretch
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pressure": round(self.pressure, 2) if self.pressure is not None else None,
+                "pressure_level": self.level,
+                "pressure_at": self.pressure_at,
+                "thresholds": {"high": self.pressure_high, "critical": self.pressure_critical},
+                "work": {name: work.to_dict() for name, work in self._work.items()},
+                "decisions": list(self.decisions),
+            }
@@ -0,0 +1,234 @@
+import bisect
+import json
+import math
+import struct
+import sys
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+class RingBuffer:
+    """Fixed-capacity, time-ordered columns stored in array('d').
+
+    Column 0 is always the timestamp. Appends overwrite the oldest row once full;
+    because rows arrive in time order, range lookups are a binary search over the
+    logical index followed by a slice, i.e. O(log n + k).
+    """
+
+    def __init__(self, capacity: int, columns: int):
+        self.capacity = capacity
+        self._cols = [array("d", bytes(8 * capacity)) for _ in range(columns)]
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row: Sequence[float]):
+        if self._count < self.capacity:
+            pos = (self._start + self._count) % self.capacity
+            self._count += 1
+        else:
+            pos = self._start
+            self._start = (self._start + 1) % self.capacity
+        for col, value in zip(self._cols, row):
+            col[pos] = value
+
+    def _ts(self, i: int) -> float:
+        return self._cols[0][(self._start + i) % self.capacity]
+
+    def _bisect(self, ts: float) -> int:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ts(mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def last(self) -> Optional[Tuple[float, ...]]:
+        if not self._count:
+            return None
+        pos = (self._start + self._count - 1) % self.capacity
+        return tuple(col[pos] for col in self._cols)
+
+    def range(self, start: float, end: float) -> List[array]:
+        """Columns for rows with start <= ts < end, as new arrays"""
+        lo, hi = self._bisect(start), self._bisect(end)
+        out = []
+        for col in self._cols:
+            a = (self._start + lo) % self.capacity
+            b = (self._start + hi) % self.capacity
+            if lo == hi:
+                out.append(array("d"))
+            elif a < b:
+                out.append(col[a:b])
+            else:
+                out.append(col[a:] + col[:b])
+        return out
+
+
+class _Rollup:
+    """Downsampled level: one (bucket_start, min, max, sum, count) row per bucket."""
+
+    def __init__(self, bucket_seconds: int, capacity: int):
+        self.bucket_seconds = bucket_seconds
+        self.buffer = RingBuffer(capacity, 5)
+        self._open: Optional[List[float]] = None
+
+    def add(self, ts: float, value: float):
+        bucket = ts - ts % self.bucket_seconds
+        current = self._open
+        if current is not None and current[0] == bucket:
+            current[1] = min(current[1], value)
+            current[2] = max(current[2], value)
+            current[3] += value
+            current[4] += 1
+            return
+        if current is not None:
+            self.buffer.append(current)
+        self._open = [bucket, value, value, value, 1.0]
+
+    def range(self, start: float, end: float) -> List[array]:
+        cols = self.buffer.range(start, end)
+        current = self._open
+        if current is not None and start <= current[0] < end:
+            for col, value in zip(cols, current):
+                col.append(value)
+        return cols
+
+
+RESOLUTIONS = ("raw", "1m", "1h")
+RESOLUTION_SECONDS = {"raw": 0, "1m": 60, "1h": 3600}
+
+
+class MetricSeries:
+    def __init__(self, raw_capacity: int, minute_capacity: int, hour_capacity: int):
+        self.raw = RingBuffer(raw_capacity, 2)
+        self.rollups = {"1m": _Rollup(RESOLUTION_SECONDS["1m"], minute_capacity),
+                        "1h": _Rollup(RESOLUTION_SECONDS["1h"], hour_capacity)}
+
+    def add(self, ts: float, value: float):
+        self.raw.append((ts, value))
+        for rollup in self.rollups.values():
+            rollup.add(ts, value)
+
+    def query(self, start: float, end: float, resolution: str, stat: str = "avg") -> Tuple[array, array]:
+        if resolution == "raw":
+            ts, values = self.raw.range(start, end)
+            return ts, values
+        ts, mins, maxs, sums, counts = self.rollups[resolution].range(start, end)
+        if stat == "min":
+            return ts, mins
+        if stat == "max":
+            return ts, maxs
+        return ts, array("d", (s / c for s, c in zip(sums, counts)))
+
+
+class MetricStore:
+    """In-memory metric history at raw, 1-minute and 1-hour resolution.
+
+    Every sample is written to the raw ring and folded into the open bucket of each
+    rollup (min/max/sum/count), so downsampling costs O(1) per sample and nothing is
+    recomputed at query time.
+    """
+
+    def __init__(self, raw_capacity: int = 8640, minute_capacity: int = 10080, hour_capacity: int = 2160):
+        self._capacities = (raw_capacity, minute_capacity, hour_capacity)
+        self._series: Dict[str, MetricSeries] = {}
+        self._lock = threading.Lock()
+
+    def record(self, ts: float, values: Dict[str, float]):
+        with self._lock:
+            for name, value in values.items():
+                if value is None:
+                    continue
+                series = self._series.get(name)
+                if series is None:
+                    series = self._series[name] = MetricSeries(*self._capacities)
+                series.add(ts, float(value))
+
+    def names(self) -> List[str]:
+        return sorted(self._series)
+
+    def latest(self, name: str) -> Optional[Tuple[float, float]]:
+        series = self._series.get(name)
+        return series.raw.last() if series else None
+
+    def query(self, names: Iterable[str], start: float, end: float, resolution: str = "1m",
+              stat: str = "avg") -> Dict[str, Tuple[array, array]]:
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution!r}, expected one of {RESOLUTIONS}")
+        with self._lock:
+            return {
+                name: self._series[name].query(start, end, resolution, stat)
+                for name in names if name in self._series
+            }
+
+
+def pick_resolution(seconds: float) -> str:
+    """Resolución más fina que mantiene el gráfico por debajo de ~1500 puntos"""
+    if seconds <= 3600:
+        return "raw"
+    if seconds <= 86400:
+        return "1m"
+    return "1h"
+
+
+def prepend_older(series: Dict[str, Tuple[array, array]], older: Dict[str, Tuple[array, array]]):
+    """Añade delante de cada serie los puntos de older anteriores a su primer punto (p. ej. el archivo en disco).
+    Cada serie se corta por su propio primer timestamp: una puede tener huecos que las demás no tienen"""
+    for name, (ts, values) in older.items():
+        current = series.get(name)
+        if current is not None and len(current[0]):
+            cut = bisect.bisect_left(ts, current[0][0])
+            ts, values = ts[:cut], values[:cut]
+            ts.extend(current[0])
+            values.extend(current[1])
+        series[name] = (ts, values)
+
+
+def align_columns(series: Dict[str, Tuple[array, array]], names: Sequence[str]) -> Tuple[array, Dict[str, array]]:
+    """Une las series por timestamp: la unión ordenada de sus timestamps y, por serie, su valor en cada uno
+    (NaN donde esa serie no tiene punto)"""
+    present = [name for name in names if name in series]
+    timestamps = array("d", sorted(set().union(*(series[name][0] for name in present))))
+    index = {ts: i for i, ts in enumerate(timestamps)}
+    columns = {}
+    for name in present:
+        values = array("d", [math.nan]) * len(timestamps)
+        for ts, value in zip(*series[name]):
+            values[index[ts]] = value
+        columns[name] = values
+    return timestamps, columns
+
+
+def columns_payload(timestamps: array, columns: Dict[str, array], digits: int = 1) -> Dict[str, Any]:
+    """Formato columnar: un array de timestamps (epoch) y un array numérico por serie, sin repetir claves por punto"""
+    return {
+        "timestamps": [round(ts, 3) for ts in timestamps],
+        "series": {name: [None if math.isnan(v) else round(v, digits) for v in values] for name, values in columns.items()},
+    }
+
+
+BINARY_MAGIC = b"TRD1"
+
+
+def pack_columns(timestamps: array, columns: Dict[str, array], meta: Dict[str, Any]) -> bytes:
+    """Formato binario para typed arrays del navegador (little-endian):
+
+    magic "TRD1" | uint32 longitud de la cabecera | cabecera JSON (meta, count, series) con relleno
+    hasta múltiplo de 8 | float64[count] timestamps | float32[count] por serie, en el orden de la cabecera.
+    Los huecos son NaN.
+    """
+    header = json.dumps({**meta, "count": len(timestamps), "series": list(columns)}).encode("utf-8")
+    header += b" " * (-(8 + len(header)) % 8)
+    parts = [BINARY_MAGIC, struct.pack("<I", len(header)), header]
+    blocks = [array("d", timestamps)] + [array("f", values) for values in columns.values()]
+    for block in blocks:
+        if sys.byteorder != "little":
+            block.byteswap()
+        parts.append(block.tobytes())
+    return b"".join(parts)
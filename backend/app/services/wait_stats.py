@@ -0,0 +1,167 @@
+import bisect
+import re
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+Counters = Dict[str, Tuple[int, int, int]]  # wait_type -> (waiting_tasks_count, wait_time_ms, signal_wait_time_ms)
+
+# sqlserver_start_time se pasa a UTC con DATEDIFF(second, GETDATE(), GETUTCDATE()): puede variar 1s entre muestras
+START_TIME_TOLERANCE_SECONDS = 5
+
+# Se evalúan en orden; el primer grupo que coincide gana
+WAIT_CATEGORIES = (
+    ("cpu", ("SOS_SCHEDULER_YIELD", "THREADPOOL", "SOS_WORK_DISPATCHER", "CPU")),
+    ("io", ("PAGEIOLATCH", "WRITELOG", "IO_COMPLETION", "BACKUPTHREAD", "DISKIO_SUSPEND")),
+    ("lock", ("LCK_", "LOCK_", "DEADLOCK", "LATCH_")),
+    ("memory", ("RESOURCE_SEMAPHORE", "MEMORY_", "CMEMTHREAD")),
+)
+
+
+def wait_category(wait_type: str) -> Optional[str]:
+    for category, patterns in WAIT_CATEGORIES:
+        if any(p in wait_type for p in patterns):
+            return category
+    return None
+
+
+def parse_window(window: str) -> int:
+    """'90s', '5m', '1h' o segundos -> segundos"""
+    match = re.fullmatch(r"\s*(\d+)\s*([smh]?)\s*", window or "")
+    if not match:
+        raise ValueError(f"Invalid window {window!r}, use e.g. 60s, 15m or 1h")
+    return int(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+
+
+class WaitStatsTracker:
+    """Keeps recent cumulative sys.dm_os_wait_stats snapshots and answers per-window deltas.
+
+    Counters only grow until the instance restarts or someone runs
+    DBCC SQLPERF('sys.dm_os_wait_stats', CLEAR). Either case is detected when a
+    snapshot arrives (new start time, or any counter going backwards), and the history
+    is replaced by a zero baseline at the reset point so deltas never go negative.
+    That baseline is only used as the base of a window that it falls inside of;
+    otherwise the window starts at the oldest real sample and is reported incomplete.
+    With a single real sample there is no interval yet: the window then reports the
+    counters since the baseline (cumulative=true), which is longer than requested and
+    also reported incomplete.
+    """
+
+    def __init__(self, max_age_seconds: float = 3900):
+        self.max_age_seconds = max_age_seconds
+        self._times = deque()
+        self._counters = deque()
+        self._start_time: Optional[float] = None
+        self._baseline = False  # el primer elemento es una base cero sintética, no una muestra
+        self.resets = 0
+        self.last_reset: Optional[float] = None
+
+    def __len__(self):
+        return len(self._times)
+
+    def add(self, ts: float, counters: Counters, start_time: Optional[float] = None):
+        if self._times:
+            restarted = (start_time is not None and self._start_time is not None
+                         and abs(start_time - self._start_time) > START_TIME_TOLERANCE_SECONDS)
+            if restarted or self._went_backwards(counters):
+                # Tras un reinicio conocemos el instante exacto; tras un CLEAR sólo sabemos que fue después de la muestra anterior
+                reset_at = start_time if restarted else self._times[-1]
+                self._times.clear()
+                self._counters.clear()
+                self._times.append(reset_at)
+                self._counters.append({})
+                self._baseline = True
+                self.resets += 1
+                self.last_reset = reset_at
+                if restarted:
+                    self._start_time = start_time
+        elif start_time is not None:
+            # Primera muestra: la base cero es el arranque de la instancia
+            self._times.append(start_time)
+            self._counters.append({})
+            self._baseline = True
+        if self._start_time is None:
+            self._start_time = start_time
+
+        self._times.append(ts)
+        self._counters.append(counters)
+        while len(self._times) > 2 and ts - self._times[1] > self.max_age_seconds:
+            self._times.popleft()
+            self._counters.popleft()
+            self._baseline = False
+
+    def _went_backwards(self, counters: Counters) -> bool:
+        previous = self._counters[-1]
+        for wait_type, (tasks, wait_ms, _) in counters.items():
+            old = previous.get(wait_type)
+            if old is not None and (tasks < old[0] or wait_ms < old[1]):
+                return True
+        return False
+
+    def window(self, seconds: float, top: int = 10) -> Optional[Dict[str, Any]]:
+        if not self._times:
+            return None
+        now_ts = self._times[-1]
+        current = self._counters[-1]
+
+        # Base: la muestra más reciente que cubre toda la ventana (o la más antigua disponible)
+        times = list(self._times)
+        idx = max(0, bisect.bisect_right(times, now_ts - seconds) - 1)
+        if len(times) > 1:
+            idx = min(idx, len(times) - 2)
+        # La base cero sólo sirve si cae dentro de la ventana; si es anterior, los contadores acumulados desde
+        # el arranque no son de la ventana pedida y se parte de la muestra real más antigua (complete=False).
+        # Con una sola muestra real no hay otra base: se devuelve el acumulado desde la base (cumulative=True)
+        cumulative = idx == 0 and self._baseline and times[0] < now_ts - seconds
+        if cumulative and len(times) > 2:
+            idx = 1
+            cumulative = False
+        base_ts = times[idx]
+        base = self._counters[idx]
+        elapsed = now_ts - base_ts
+
+        per_type = []
+        totals = {"tasks": 0, "wait_ms": 0, "signal_ms": 0}
+        by_category = {name: 0 for name, _ in WAIT_CATEGORIES}
+        for wait_type, (tasks, wait_ms, signal_ms) in current.items():
+            old_tasks, old_wait, old_signal = base.get(wait_type, (0, 0, 0))
+            d_tasks, d_wait, d_signal = tasks - old_tasks, wait_ms - old_wait, signal_ms - old_signal
+            if d_wait <= 0 and d_tasks <= 0:
+                continue
+            totals["tasks"] += d_tasks
+            totals["wait_ms"] += d_wait
+            totals["signal_ms"] += d_signal
+            category = wait_category(wait_type)
+            if category:
+                by_category[category] += d_wait
+            per_type.append((wait_type, d_tasks, d_wait, d_signal))
+
+        per_sec = (lambda v: round(v / elapsed, 2)) if elapsed > 0 else (lambda v: 0)
+        pct = (lambda v: round(v * 100.0 / totals["wait_ms"], 1)) if totals["wait_ms"] else (lambda v: 0)
+        per_type.sort(key=lambda row: row[2], reverse=True)
+
+        return {
+            "window_seconds": round(elapsed, 1),
+            "requested_window_seconds": seconds,
+            "complete": elapsed >= seconds and not cumulative,
+            "cumulative": cumulative,
+            "since_reset": self.last_reset is not None and base_ts <= self.last_reset,
+            "cpu_wait_percent": pct(by_category["cpu"]),
+            "io_wait_percent": pct(by_category["io"]),
+            "lock_wait_percent": pct(by_category["lock"]),
+            "memory_wait_percent": pct(by_category["memory"]),
+            "total_waits": len(per_type),
+            "total_wait_time_ms": totals["wait_ms"],
+            "waits_per_sec": per_sec(totals["tasks"]),
+            "wait_ms_per_sec": per_sec(totals["wait_ms"]),
+            "signal_ms_per_sec": per_sec(totals["signal_ms"]),
+            "category_ms_per_sec": {name: per_sec(value) for name, value in by_category.items()},
+            "top_wait_types": [{
+                "wait_type": wait_type,
+                "waits": d_tasks,
+                "wait_time_ms": d_wait,
+                "waits_per_sec": per_sec(d_tasks),
+                "ms_per_sec": per_sec(d_wait),
+                "avg_wait_ms": round(d_wait / d_tasks, 2) if d_tasks else 0,
+                "signal_percent": round(d_signal * 100.0 / d_wait, 1) if d_wait else 0,
+            } for wait_type, d_tasks, d_wait, d_signal in per_type[:top]],
+        }
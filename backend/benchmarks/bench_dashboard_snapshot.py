@@ -0,0 +1,86 @@
+"""Round trips and latency of one dashboard refresh: nine sequential queries vs one batch.
+
+The batched refresh goes through the connection pool, once plain and once with a cost
+meter active as the collector does when throttling is on.
+
+Uso (desde backend/):  python -m benchmarks.bench_dashboard_snapshot --rtt-ms 3 --refreshes 200
+"""
+import argparse
+import datetime
+import os
+import statistics
+import time
+
+os.environ.setdefault("SQL_SERVER_HOST", "benchmark")
+os.environ.setdefault("SQL_SERVER_PASSWORD", "benchmark")
+
+from app.services import dmv, fake_sql
+from app.services.query_stats import QueryStats
+from app.services.sql_pool import ConnectionPool, CostMeter, metering, use_pool
+
+STATEMENTS = dmv.SYSTEM_STATS_QUERIES + dmv.DASHBOARD_OVERVIEW_QUERIES
+
+
+def refresh_sequential(conn):
+    cursor = conn.cursor()
+    results = []
+    for statement in STATEMENTS:
+        cursor.execute(statement)
+        results.append(cursor.fetchall())
+    split = len(dmv.SYSTEM_STATS_QUERIES)
+    return dmv.build_system_stats(results[:split]), dmv.build_dashboard_overview(results[split:])
+
+
+_pools = {}
+
+
+def _pool(conn) -> ConnectionPool:
+    # Una conexión fake por modo; el pool la reutiliza en cada refresco como en producción
+    if conn not in _pools:
+        _pools[conn] = ConnectionPool(lambda: conn, max_size=1, query_stats=QueryStats("benchmark"))
+    return _pools[conn]
+
+
+def refresh_batched(conn):
+    with use_pool(_pool(conn)):
+        return dmv.fetch_dashboard_snapshot()
+
+
+def refresh_metered(conn):
+    meter = CostMeter()
+    with use_pool(_pool(conn)), metering(meter):
+        snapshot = dmv.fetch_dashboard_snapshot()
+    assert meter.measured, "metered refresh took no CPU sample"
+    return snapshot
+
+
+def measure(name, refresh, rtt, refreshes):
+    conn = fake_sql.FakeConnection("benchmark", latency_ms=rtt * 1000, jitter_ms=0)
+    fake_sql.stats.reset()
+    latencies = []
+    for _ in range(refreshes):
+        started = time.perf_counter()
+        refresh(conn)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    round_trips = fake_sql.stats.snapshot()["round_trips"]
+    print(f"{name:<12} round trips/refresh={round_trips / refreshes:>4.1f}  "
+          f"p50={statistics.median(latencies):6.2f}ms  p95={latencies[int(len(latencies) * 0.95) - 1]:6.2f}ms")
+    return round_trips / refreshes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rtt-ms", type=float, default=2.0, help="latencia simulada por round trip")
+    parser.add_argument("--refreshes", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}  rtt={args.rtt_ms}ms  refreshes={args.refreshes}")
+    sequential = measure("sequential", refresh_sequential, args.rtt_ms / 1000, args.refreshes)
+    batched = measure("batched", refresh_batched, args.rtt_ms / 1000, args.refreshes)
+    metered = measure("metered", refresh_metered, args.rtt_ms / 1000, args.refreshes)
+    print(f"round trips saved per refresh: {sequential - batched:.0f}, added by metering: {metered - batched:.0f}")
+
+
+if __name__ == "__main__":
+    main()
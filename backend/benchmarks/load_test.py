@@ -0,0 +1,206 @@
+"""Load test of the monitoring API: N simulated dashboards against the fake SQL Server backend.
+
+Each client replays the polling of frontend/static/js/app.js: /dashboard-snapshot
+every 5 s on the Dashboard tab, the six sequential loads of the Performance tab
+from time to time, and an occasional sweep over every other monitoring endpoint.
+The app runs in-process (collector included) with SQL_BACKEND=fake, so no SQL
+Server, Redis or network is involved.
+
+Uso (desde backend/):
+    python -m benchmarks.load_test --clients 50 --duration 30 --speedup 10
+    python -m benchmarks.load_test --clients 200 --latency-ms 5 --json results.json --fail-p95-ms 250
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, List
+
+API = "/api/monitoring"
+
+# Mismo orden que loadRealPerformanceData() en app.js
+PERFORMANCE_TAB = [
+    f"{API}/top-slow-queries",
+    f"{API}/top-frequent-queries",
+    f"{API}/wait-types-stats?window=5m",
+    f"{API}/performance-trends",
+    f"{API}/missing-indexes",
+    f"{API}/index-fragmentation",
+]
+
+# El resto de endpoints de monitoring.py, para que todos queden medidos
+OTHER_ENDPOINTS = [
+    f"{API}/system-stats",
+    f"{API}/dashboard-overview",
+    f"{API}/top-queries?sort=total_cpu",
+    f"{API}/index-fragmentation/status",
+    f"{API}/pool-stats",
+    f"{API}/cache-stats",
+    f"{API}/collector-status",
+    f"{API}/internal/query-stats",
+    f"{API}/alerts",
+    f"{API}/blocking-chains",
+    f"{API}/servers",
+    f"{API}/fleet-summary",
+]
+
+DASHBOARD_POLL_SECONDS = 5.0
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.refreshes = 0
+
+    def add(self, path: str, elapsed_ms: float, ok: bool):
+        endpoint = path.split("?")[0][len(API):] or "/"
+        self.latencies.setdefault(endpoint, []).append(elapsed_ms)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+async def request(client, results: Results, path: str):
+    started = time.perf_counter()
+    try:
+        response = await client.get(path)
+        ok = response.status_code == 200 and "error" not in response.json()
+    except Exception:
+        ok = False
+    results.add(path, (time.perf_counter() - started) * 1000, ok)
+
+
+async def simulated_dashboard(client, results: Results, args, deadline: float, rng: random.Random):
+    """Un navegador con la app abierta: polling del dashboard y visitas ocasionales a otros tabs"""
+    poll = DASHBOARD_POLL_SECONDS / args.speedup
+    await asyncio.sleep(rng.uniform(0, poll))  # los clientes no arrancan todos a la vez
+    refresh = 0
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        refresh += 1
+        if refresh % args.performance_every == 0:
+            for path in PERFORMANCE_TAB:
+                await request(client, results, path)
+        elif refresh % args.sweep_every == 0:
+            for path in OTHER_ENDPOINTS:
+                await request(client, results, path)
+        else:
+            await request(client, results, f"{API}/dashboard-snapshot")
+        results.refreshes += 1
+        await asyncio.sleep(max(0.0, poll - (time.monotonic() - started)))
+
+
+async def run(args) -> dict:
+    import httpx
+    from app.main import app
+    from app.services import fake_sql
+
+    results = Results()
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            # Calentamiento: primer snapshot de cada job antes de medir
+            await asyncio.sleep(args.warmup)
+            fake_sql.stats.reset()
+            started = time.monotonic()
+            deadline = started + args.duration
+            await asyncio.gather(*(simulated_dashboard(client, results, args, deadline, random.Random(i))
+                                   for i in range(args.clients)))
+            elapsed = time.monotonic() - started
+        sql = fake_sql.stats.snapshot()
+
+    endpoints = {}
+    for endpoint, values in sorted(results.latencies.items()):
+        values.sort()
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": results.errors.get(endpoint, 0),
+            "p50_ms": round(percentile(values, 50), 2),
+            "p95_ms": round(percentile(values, 95), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+        }
+    all_values = sorted(v for values in results.latencies.values() for v in values)
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "elapsed_seconds": round(elapsed, 2),
+        "requests": len(all_values),
+        "requests_per_sec": round(len(all_values) / elapsed, 1) if elapsed else 0,
+        "refreshes": results.refreshes,
+        "p50_ms": round(percentile(all_values, 50), 2),
+        "p95_ms": round(percentile(all_values, 95), 2),
+        "p99_ms": round(percentile(all_values, 99), 2),
+        "sql_round_trips": sql["round_trips"],
+        "sql_statements": sql["statements"],
+        "queries_per_refresh": round(sql["round_trips"] / results.refreshes, 3) if results.refreshes else 0,
+        "sql_by_query": sql["by_query"],
+        "unmatched_sql_statements": sql["unmatched_statements"],
+        "endpoints": endpoints,
+    }
+
+
+def print_report(report: dict):
+    config = report["config"]
+    print(f"{report['timestamp']}  clients={config['clients']}  duration={config['duration']}s  "
+          f"speedup={config['speedup']}  latency={config['latency_ms']}ms  collector={not config['no_collector']}")
+    print(f"{'endpoint':<32}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, row in report["endpoints"].items():
+        print(f"{endpoint:<32}{row['requests']:>10}{row['errors']:>8}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+    print(f"{'total':<32}{report['requests']:>10}{'':>8}{report['p50_ms']:>10.2f}{report['p95_ms']:>10.2f}{report['p99_ms']:>10.2f}")
+    print(f"requests/sec={report['requests_per_sec']}  refreshes={report['refreshes']}  "
+          f"sql round trips={report['sql_round_trips']}  queries/refresh={report['queries_per_refresh']}")
+    if report["unmatched_sql_statements"]:
+        print(f"warning: {report['unmatched_sql_statements']} statements had no fake result set")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20, help="dashboards simulados concurrentes")
+    parser.add_argument("--duration", type=float, default=20.0, help="segundos medidos")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--speedup", type=float, default=10.0, help="divide los intervalos de polling de app.js")
+    parser.add_argument("--performance-every", type=int, default=12, help="cada cuántos refrescos se abre el tab Performance")
+    parser.add_argument("--sweep-every", type=int, default=30, help="cada cuántos refrescos se recorren los demás endpoints")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="latencia simulada por round trip a SQL Server")
+    parser.add_argument("--rows", type=int, default=200, help="filas del plan cache simulado")
+    parser.add_argument("--databases", type=int, default=20)
+    parser.add_argument("--no-collector", action="store_true", help="sin collector: todo se consulta bajo demanda")
+    parser.add_argument("--json", help="guarda el informe en este fichero")
+    parser.add_argument("--fail-p95-ms", type=float, help="sale con código 1 si el p95 global lo supera")
+    args = parser.parse_args()
+
+    # La configuración se lee al importar app.*: el entorno debe quedar listo antes
+    os.environ.update({
+        "SQL_BACKEND": "fake",
+        "SQL_SERVER_HOST": os.environ.get("SQL_SERVER_HOST", "fakesql01"),
+        "REDIS_URL": "",
+        "METRIC_ARCHIVE_ENABLED": "false",
+        "COLLECTOR_ENABLED": "false" if args.no_collector else "true",
+        "FAKE_SQL_LATENCY_MS": str(args.latency_ms),
+        "FAKE_SQL_ROWS": str(args.rows),
+        "FAKE_SQL_DATABASES": str(args.databases),
+    })
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.fail_p95_ms is not None and report["p95_ms"] > args.fail_p95_ms:
+        print(f"p95 {report['p95_ms']}ms exceeds {args.fail_p95_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,69 @@
+// Respuestas ya recibidas por URL: se reenvía su ETag y, si el servidor contesta 304, se reutilizan los datos
+const conditionalCache = new Map();
+
+async function fetchMonitoring(url, parse = response => response.json()) {
+    const cached = conditionalCache.get(url);
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
+    const response = await fetch(url, { headers });
+    if (response.status === 304 && cached) {
+        return cached.data;
+    }
+    const data = await parse(response);
+    const etag = response.headers.get('ETag');
+    if (etag && response.ok) {
+        conditionalCache.set(url, { etag, data });
+    } else {
+        conditionalCache.delete(url);
+    }
+    return data;
+}
+
+// Decodifica /performance-trends?format=binary (ver pack_columns en timeseries.py):
+// las series quedan como typed arrays sobre el mismo buffer, sin un objeto por punto
+function decodeTrends(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'TRD1') {
+        throw new Error('Unexpected trends payload');
+    }
+    const headerLength = view.getUint32(4, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+    let offset = 8 + headerLength;
+    const timestamps = new Float64Array(buffer, offset, header.count);
+    offset += header.count * 8;
+    const series = {};
+    header.series.forEach(name => {
+        series[name] = new Float32Array(buffer, offset, header.count);
+        offset += header.count * 4;
+    });
+    return { ...header, timestamps, series };
+}
+
+function formatTrendLabel(epochSeconds, hours) {
+    const date = new Date(epochSeconds * 1000);
+    const time = date.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+    return hours <= 24 ? time : `${date.getDate()}/${date.getMonth() + 1} ${time}`;
+}
+
 // Función para cargar los datos de performance trends
-async function loadPerformanceTrends() {
+async function loadPerformanceTrends(hours = 24) {
     try {
-        const response = await fetch('/api/monitoring/performance-trends');
-        const data = await response.json();
+        const data = await fetchMonitoring(`/api/monitoring/performance-trends?hours=${hours}&format=binary`,
+            async response => response.ok ? decodeTrends(await response.arrayBuffer()) : response.json());
         
-        if (data.error) {
-            console.error('Performance trends error:', data.error);
-            // Aún así podemos usar los datos simulados
+        if (data.error || data.detail) {
+            console.error('Performance trends error:', data.error || data.detail);
+            return;
         }
         
-        // Actualizar el gráfico de performance con datos reales
-        if (performanceChart && data.trends) {
-            const labels = data.trends.map(trend => trend.timestamp);
-            const cpuData = data.trends.map(trend => trend.cpu_percent);
-            const memoryData = data.trends.map(trend => trend.memory_percent);
-            
-            performanceChart.data.labels = labels;
-            performanceChart.data.datasets[0].data = cpuData;
-            performanceChart.data.datasets[1].data = memoryData;
+        // Chart.js acepta typed arrays como data: los NaN se dibujan como huecos
+        if (performanceChart && data.series) {
+            performanceChart.data.labels = Array.from(data.timestamps, ts => formatTrendLabel(ts, hours));
+            performanceChart.data.datasets[0].data = data.series.cpu_percent || [];
+            performanceChart.data.datasets[1].data = data.series.memory_percent || [];
             performanceChart.update();
             
-            console.log('Performance trends cargados:', data.trends.length, 'puntos de datos');
+            console.log('Performance trends cargados:', data.count, 'puntos de datos');
         }
         
     } catch (error) {
@@ -28,13 +71,11 @@ async function loadPerformanceTrends() {
     }
 }
 
-// Función mejorada para cargar wait types
 async function loadWaitTypes() {
     try {
-        const response = await fetch('/api/monitoring/wait-types-stats');
-        const data = await response.json();
+        const data = await fetchMonitoring('/api/monitoring/wait-types-stats?window=5m');
         
-        if (data.error && !data.waits) {
+        if (data.error || !data.waits) {
             console.error('Wait types error:', data.error);
             return;
         }
@@ -145,7 +186,11 @@ let growthChart;
 let ioChart;
 let realTimeChart;
 let updateInterval;
-let realtimeInterval;
+let realtimeSocket;
+let sessionsSocket;
+let sessionsSeq = null;
+let sessionsRenderPending = false;
+const liveSessions = new Map();
 let currentTab = 'dashboard';
 let isAuthenticated = false;
 
@@ -172,10 +217,8 @@ function showTab(tabName) {
     
     currentTab = tabName;
     
-    if (realtimeInterval) {
-        clearInterval(realtimeInterval);
-        realtimeInterval = null;
-    }
+    closeRealtimeStream();
+    closeSessionsStream();
     
     setTimeout(() => {
         switch(tabName) {
@@ -375,19 +418,12 @@ function initializeRealtimeTab() {
         }
     }
     
-    realtimeInterval = setInterval(() => {
-        if (currentTab === 'realtime' && isAuthenticated) {
-            updateRealtimeData();
-        }
-    }, 2000);
-    
     loadRealtimeData();
 }
 
 async function loadSlowQueries() {
     try {
-        const response = await fetch('/api/monitoring/top-slow-queries');
-        const data = await response.json();
+        const data = await fetchMonitoring('/api/monitoring/top-slow-queries');
         
         const placeholder = document.querySelectorAll('#tab-performance .loading-placeholder')[0];
         if (!placeholder) return;
@@ -414,7 +450,8 @@ async function loadSlowQueries() {
                 const durationColor = query.avg_duration_ms > 5000 ? '#e53e3e' : 
                                     query.avg_duration_ms > 1000 ? '#ed8936' : '#38a169';
                 content += '<tr>';
-                content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0; max-width: 300px; overflow: hidden; text-overflow: ellipsis;">' + query.query + '</td>';
+                content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0; max-width: 300px; overflow: hidden; text-overflow: ellipsis;" title="' + query.fingerprint + '">' + query.query +
+                    (query.query_hashes > 1 ? ' <small style="color: #718096;">(' + query.query_hashes + ' variants)</small>' : '') + '</td>';
                 content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0; color: ' + durationColor + '; font-weight: bold;">' + query.avg_duration_ms.toLocaleString() + '</td>';
                 content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + query.execution_count.toLocaleString() + '</td>';
                 content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + query.database + '</td>';
@@ -439,8 +476,7 @@ async function loadSlowQueries() {
 
 async function loadFrequentQueries() {
     try {
-        const response = await fetch('/api/monitoring/top-frequent-queries');
-        const data = await response.json();
+        const data = await fetchMonitoring('/api/monitoring/top-frequent-queries');
         
         const placeholder = document.querySelectorAll('#tab-performance .loading-placeholder')[1];
         if (!placeholder) return;
@@ -465,7 +501,8 @@ async function loadFrequentQueries() {
         if (data.queries && data.queries.length > 0) {
             data.queries.forEach(query => {
                 content += '<tr>';
-                content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0; max-width: 300px; overflow: hidden; text-overflow: ellipsis;">' + query.query + '</td>';
+                content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0; max-width: 300px; overflow: hidden; text-overflow: ellipsis;" title="' + query.fingerprint + '">' + query.query +
+                    (query.query_hashes > 1 ? ' <small style="color: #718096;">(' + query.query_hashes + ' variants)</small>' : '') + '</td>';
                 content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0; color: #3182ce; font-weight: bold;">' + query.execution_count.toLocaleString() + '</td>';
                 content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + query.avg_duration_ms.toLocaleString() + '</td>';
                 content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + query.total_cpu_ms.toLocaleString() + '</td>';
@@ -490,8 +527,7 @@ async function loadFrequentQueries() {
 
 async function loadMissingIndexes() {
     try {
-        const response = await fetch('/api/monitoring/missing-indexes');
-        const data = await response.json();
+        const data = await fetchMonitoring('/api/monitoring/missing-indexes');
         
         const placeholder = document.querySelectorAll('#tab-performance .loading-placeholder')[2];
         if (!placeholder) return;
@@ -543,8 +579,7 @@ async function loadMissingIndexes() {
 
 async function loadIndexFragmentation() {
     try {
-        const response = await fetch('/api/monitoring/index-fragmentation');
-        const data = await response.json();
+        const data = await fetchMonitoring('/api/monitoring/index-fragmentation');
         
         const placeholder = document.querySelectorAll('#tab-performance .loading-placeholder')[3];
         if (!placeholder) return;
@@ -585,6 +620,14 @@ async function loadIndexFragmentation() {
         }
         
         content += '</tbody></table>';
+        
+        // Resultados parciales mientras el escaneo en segundo plano sigue corriendo
+        if (data.partial && data.scan) {
+            const done = data.scan.databases_done || 0;
+            const total = data.scan.databases_to_scan || 0;
+            content += '<p style="color: #718096; margin-top: 8px;">Scanning databases... ' + done + ' / ' + total + '</p>';
+            setTimeout(loadIndexFragmentation, 5000);
+        }
         placeholder.innerHTML = content;
         
     } catch (error) {
@@ -597,7 +640,177 @@ async function loadIndexFragmentation() {
 }
 
 function loadSessionsData() {
-    updateSessionsPlaceholders();
+    connectSessionsStream();
+    loadBlockingChains();
+}
+
+// Feed de sesiones en vivo: un snapshot completo al suscribirse y después sólo deltas numerados.
+// Si falta un número de secuencia (mensaje descartado) se pide resync y se ignoran los deltas hasta recibirlo
+function connectSessionsStream() {
+    if (sessionsSocket || !isAuthenticated) return;
+    
+    const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const socket = new WebSocket(protocol + window.location.host + '/ws/monitoring?topics=session_list');
+    sessionsSocket = socket;
+    sessionsSeq = null;
+    
+    socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.topic !== 'session_list') return;
+        applySessionMessage(socket, message.data);
+    };
+    
+    socket.onclose = () => {
+        if (sessionsSocket === socket) {
+            sessionsSocket = null;
+            setTimeout(() => {
+                if (currentTab === 'sessions' && isAuthenticated) connectSessionsStream();
+            }, 3000);
+        }
+    };
+}
+
+function closeSessionsStream() {
+    if (sessionsSocket) {
+        const socket = sessionsSocket;
+        sessionsSocket = null;
+        socket.close();
+    }
+}
+
+function applySessionMessage(socket, data) {
+    if (data.type === 'snapshot') {
+        liveSessions.clear();
+        data.sessions.forEach(session => liveSessions.set(session.session_id, session));
+        sessionsSeq = data.seq;
+    } else if (sessionsSeq === null || data.seq <= sessionsSeq) {
+        return;
+    } else if (data.seq !== sessionsSeq + 1) {
+        sessionsSeq = null;
+        socket.send(JSON.stringify({ action: 'resync', topics: ['session_list'] }));
+        return;
+    } else {
+        data.removed.forEach(id => liveSessions.delete(id));
+        data.inserted.forEach(session => liveSessions.set(session.session_id, session));
+        data.updated.forEach(change => {
+            const session = liveSessions.get(change.session_id);
+            if (session) Object.assign(session, change);
+        });
+        sessionsSeq = data.seq;
+    }
+    if (!sessionsRenderPending) {
+        sessionsRenderPending = true;
+        requestAnimationFrame(renderLiveSessions);
+    }
+}
+
+function renderLiveSessions() {
+    sessionsRenderPending = false;
+    if (currentTab !== 'sessions') return;
+    
+    const sessions = Array.from(liveSessions.values());
+    const containers = document.querySelectorAll('#tab-sessions .table-container');
+    const values = document.querySelector('#tab-sessions .metrics-grid')?.querySelectorAll('.metric-value');
+    if (values && values.length >= 4) {
+        const logins = new Set(sessions.map(s => s.login));
+        values[0].textContent = logins.size;
+        values[1].textContent = logins.size ? (sessions.length / logins.size).toFixed(1) : '0';
+        values[2].textContent = new Set(sessions.map(s => s.program)).size;
+        values[3].textContent = new Set(sessions.map(s => s.host)).size;
+    }
+    
+    const active = sessions.filter(s => s.status !== 'sleeping').sort((a, b) => b.elapsed_ms - a.elapsed_ms);
+    if (containers[0]) {
+        containers[0].innerHTML = '<p style="margin-bottom: 10px; color: #4a5568;">' + sessions.length.toLocaleString() + ' sesiones, ' + active.length + ' activas</p>' +
+            renderSessionTable(active.slice(0, 50), 'No hay sesiones activas');
+    }
+    
+    // Problemáticas: bloqueadas, en ejecución más de un minuto, o dormidas con una transacción abierta
+    const problematic = sessions.filter(s => s.blocking_session_id > 0 || s.elapsed_ms > 60000 || (s.status === 'sleeping' && s.open_transactions > 0))
+        .sort((a, b) => b.wait_ms - a.wait_ms || b.elapsed_ms - a.elapsed_ms);
+    if (containers[2]) {
+        containers[2].innerHTML = renderSessionTable(problematic.slice(0, 50), 'No se detectaron sesiones problemáticas');
+    }
+}
+
+function renderSessionTable(sessions, emptyText) {
+    if (sessions.length === 0) {
+        return '<div style="color: #718096; text-align: center; padding: 20px;"><p>' + emptyText + '</p></div>';
+    }
+    
+    let content = '<table style="width: 100%; border-collapse: collapse;"><thead style="background: #f7fafc;"><tr>';
+    ['Session', 'Login', 'Host', 'Database', 'Status', 'Wait Type', 'Elapsed (ms)', 'CPU (ms)', 'Blocked By'].forEach(header => {
+        content += '<th style="padding: 10px; text-align: left; border-bottom: 2px solid #e2e8f0;">' + header + '</th>';
+    });
+    content += '</tr></thead><tbody>';
+    sessions.forEach(session => {
+        const blockedColor = session.blocking_session_id > 0 ? '#e53e3e' : '#718096';
+        content += '<tr>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + session.session_id + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + escapeHtml(session.login) + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + escapeHtml(session.host) + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + escapeHtml(session.database) + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + escapeHtml(session.status) + (session.open_transactions ? ' (' + session.open_transactions + ' tran)' : '') + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + escapeHtml(session.wait_type || '-') + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + session.elapsed_ms.toLocaleString() + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + session.cpu_ms.toLocaleString() + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0; color: ' + blockedColor + ';">' + (session.blocking_session_id || '-') + '</td>';
+        content += '</tr>';
+    });
+    content += '</tbody></table>';
+    return content;
+}
+
+async function loadBlockingChains() {
+    const placeholder = document.querySelectorAll('#tab-sessions .table-container')[1];
+    if (!placeholder) return;
+    try {
+        const data = await fetchMonitoring('/api/monitoring/blocking-chains');
+        if (data.error) {
+            placeholder.innerHTML = '<p style="color: #e53e3e;">Error: ' + data.error + '</p>';
+            return;
+        }
+        placeholder.innerHTML = renderBlockingChains(data);
+    } catch (error) {
+        console.error('Error loading blocking chains:', error);
+        placeholder.innerHTML = '<p style="color: #e53e3e;">Error loading blocking chains</p>';
+    }
+}
+
+function escapeHtml(text) {
+    return String(text ?? '').replace(/[&<>"']/g, c => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[c]));
+}
+
+// Una tabla por head blocker; las sesiones vienen en preorden con su profundidad, se sangran por nivel
+function renderBlockingChains(data) {
+    if (!data.chains || data.chains.length === 0) {
+        return '<div style="color: #718096; text-align: center; padding: 20px;"><div style="font-size: 2rem; color: #38a169; margin-bottom: 10px;">✅</div><p>No se detectaron bloqueos activos</p><small style="color: #a0aec0;">Última verificación: ' + new Date().toLocaleTimeString() + '</small></div>';
+    }
+    
+    let content = '<p style="margin-bottom: 10px; color: #4a5568;">' + data.head_blockers + ' head blockers, ' + data.blocked_sessions + ' sesiones bloqueadas, profundidad máxima ' + data.max_chain_depth +
+        (data.deadlock_cycles ? ', <strong style="color: #e53e3e;">' + data.deadlock_cycles + ' ciclos (deadlock)</strong>' : '') + '</p>';
+    data.chains.forEach(chain => {
+        content += '<div style="margin-bottom: 15px;">';
+        content += '<h4 style="color: #e53e3e;">Session ' + chain.session_id + (chain.cycle ? ' (deadlock)' : '') + ' — ' + escapeHtml(chain.login) + '@' + escapeHtml(chain.host) +
+            ' · ' + chain.blocked_sessions + ' bloqueadas · profundidad ' + chain.chain_depth + ' · espera total ' + chain.total_wait_ms.toLocaleString() + ' ms</h4>';
+        content += '<table style="width: 100%; border-collapse: collapse;"><thead style="background: #f7fafc;"><tr>';
+        ['Session', 'Database', 'Status', 'Wait Type', 'Wait (ms)', 'Statement'].forEach(header => {
+            content += '<th style="padding: 10px; text-align: left; border-bottom: 2px solid #e2e8f0;">' + header + '</th>';
+        });
+        content += '</tr></thead><tbody>';
+        chain.sessions.forEach(session => {
+            content += '<tr>';
+            content += '<td style="padding: 8px; padding-left: ' + (8 + session.depth * 20) + 'px; border-bottom: 1px solid #e2e8f0;">' + (session.depth ? '↳ ' : '') + session.session_id + (session.in_cycle ? ' 🔁' : '') + '</td>';
+            content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + escapeHtml(session.database) + '</td>';
+            content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + escapeHtml(session.status) + (session.open_transactions ? ' (' + session.open_transactions + ' tran)' : '') + '</td>';
+            content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + escapeHtml(session.wait_type || '-') + '</td>';
+            content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + (session.depth || session.in_cycle ? session.wait_ms.toLocaleString() : '-') + '</td>';
+            content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0; max-width: 400px; overflow: hidden; text-overflow: ellipsis;" title="' + escapeHtml(session.statement) + '">' + escapeHtml(session.statement || '-') + '</td>';
+            content += '</tr>';
+        });
+        content += '</tbody></table></div>';
+    });
+    return content;
 }
 
 function loadSecurityData() {
@@ -609,28 +822,7 @@ function loadMaintenanceData() {
 }
 
 function loadRealtimeData() {
-    updateRealtimePlaceholders();
-}
-
-function updateSessionsPlaceholders() {
-    const placeholders = document.querySelectorAll('#tab-sessions .loading-placeholder');
-    placeholders.forEach((placeholder, index) => {
-        setTimeout(() => {
-            let content = '';
-            switch(index) {
-                case 0:
-                    content = '<div style="color: #718096; text-align: center; padding: 20px;"><p>Sesiones activas se cargarán aquí...</p></div>';
-                    break;
-                case 1:
-                    content = '<div style="color: #718096; text-align: center; padding: 20px;"><div style="font-size: 2rem; color: #38a169; margin-bottom: 10px;">✅</div><p>No se detectaron bloqueos activos</p><small style="color: #a0aec0;">Última verificación: ' + new Date().toLocaleTimeString() + '</small></div>';
-                    break;
-                case 2:
-                    content = '<div style="color: #718096; text-align: center; padding: 20px;"><p>Sesiones problemáticas se cargarán aquí...</p></div>';
-                    break;
-            }
-            placeholder.innerHTML = content;
-        }, 500 + (index * 400));
-    });
+    connectRealtimeStream();
 }
 
 function updateSecurityPlaceholders() {
@@ -678,54 +870,151 @@ function updateMaintenancePlaceholders() {
     });
 }
 
-function updateRealtimePlaceholders() {
-    const placeholders = document.querySelectorAll('#tab-realtime .loading-placeholder');
-    placeholders.forEach((placeholder, index) => {
-        setTimeout(() => {
-            let content = '';
-            switch(index) {
-                case 0:
-                    content = '<div style="color: #718096; text-align: center; padding: 20px;"><p>Actividad de consultas en vivo se cargará aquí...</p><div class="realtime-indicator"><span class="pulse-dot"></span><span>Actualizando cada 2 segundos</span></div></div>';
-                    break;
-                case 1:
-                    content = '<div style="color: #718096; text-align: center; padding: 20px;"><div style="font-size: 2rem; color: #38a169; margin-bottom: 10px;">🔓</div><p>No se detectaron bloqueos activos</p><small style="color: #a0aec0;">Monitoreando en tiempo real...</small></div>';
-                    break;
-            }
-            placeholder.innerHTML = content;
-        }, 500 + (index * 300));
-    });
+// Stream WebSocket del tab Real-Time: el backend publica cada muestra una sola vez para todos los clientes
+function connectRealtimeStream() {
+    if (realtimeSocket || !isAuthenticated) return;
+    
+    const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const socket = new WebSocket(protocol + window.location.host + '/ws/monitoring?topics=io,counters,waits,sessions,locks');
+    realtimeSocket = socket;
+    
+    socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'subscribed') {
+            console.log('Real-time stream suscrito a:', message.topics);
+            return;
+        }
+        if (message.type === 'error') {
+            console.warn('Real-time stream rechazó un comando:', message.error);
+            return;
+        }
+        handleRealtimeMessage(message);
+    };
+    
+    socket.onclose = () => {
+        if (realtimeSocket === socket) {
+            realtimeSocket = null;
+            // Reconectar si el usuario sigue en el tab
+            setTimeout(() => {
+                if (currentTab === 'realtime' && isAuthenticated) connectRealtimeStream();
+            }, 3000);
+        }
+    };
 }
 
-function updateRealtimeData() {
-    if (ioChart && currentTab === 'realtime') {
-        const now = new Date().toLocaleTimeString();
-        ioChart.data.labels.push(now);
-        ioChart.data.datasets[0].data.push(Math.random() * 100 + 50);
-        ioChart.data.datasets[1].data.push(Math.random() * 80 + 30);
-        
-        if (ioChart.data.labels.length > 20) {
-            ioChart.data.labels.shift();
-            ioChart.data.datasets[0].data.shift();
-            ioChart.data.datasets[1].data.shift();
-        }
-        ioChart.update('none');
+function closeRealtimeStream() {
+    if (realtimeSocket) {
+        const socket = realtimeSocket;
+        realtimeSocket = null;
+        socket.close();
     }
+}
+
+function pushChartPoint(chart, label, values) {
+    chart.data.labels.push(label);
+    values.forEach((value, i) => chart.data.datasets[i].data.push(value));
     
-    if (realTimeChart && currentTab === 'realtime') {
-        const now = new Date().toLocaleTimeString();
-        realTimeChart.data.labels.push(now);
-        realTimeChart.data.datasets[0].data.push(Math.random() * 500 + 100);
-        realTimeChart.data.datasets[1].data.push(Math.random() * 1000 + 200);
-        
-        if (realTimeChart.data.labels.length > 20) {
-            realTimeChart.data.labels.shift();
-            realTimeChart.data.datasets[0].data.shift();
-            realTimeChart.data.datasets[1].data.shift();
+    if (chart.data.labels.length > 20) {
+        chart.data.labels.shift();
+        chart.data.datasets.forEach(dataset => dataset.data.shift());
+    }
+    chart.update('none');
+}
+
+function handleRealtimeMessage(message) {
+    if (currentTab !== 'realtime') return;
+    
+    const data = message.data;
+    const label = new Date(message.timestamp * 1000).toLocaleTimeString();
+    const cards = document.querySelectorAll('#tab-realtime .metrics-grid');
+    const placeholders = document.querySelectorAll('#tab-realtime .table-container');
+    
+    switch (message.topic) {
+        case 'io':
+            if (ioChart) pushChartPoint(ioChart, label, [data.reads_per_sec, data.writes_per_sec]);
+            break;
+        case 'counters':
+            if (realTimeChart) pushChartPoint(realTimeChart, label, [data.batch_requests_per_sec, data.page_lookups_per_sec]);
+            break;
+        case 'waits': {
+            const values = cards[0]?.querySelectorAll('.metric-value');
+            if (values && values.length >= 4) {
+                values[0].textContent = data.waiting_tasks;
+                values[1].textContent = data.io_waits;
+                values[2].textContent = data.lock_waits;
+                values[3].textContent = data.cpu_waits;
+            }
+            break;
+        }
+        case 'sessions': {
+            const values = cards[1]?.querySelectorAll('.metric-value');
+            if (values && values.length >= 4) {
+                values[0].textContent = data.active_sessions;
+                values[1].textContent = data.user_sessions - data.active_sessions;
+                values[2].textContent = data.sleeping_sessions;
+                values[3].textContent = data.background_tasks;
+            }
+            if (placeholders[0]) placeholders[0].innerHTML = renderRunningRequests(data.running_requests);
+            break;
         }
-        realTimeChart.update('none');
+        case 'locks':
+            if (placeholders[1]) placeholders[1].innerHTML = renderWaitingLocks(data);
+            break;
     }
 }
 
+function renderRunningRequests(requests) {
+    if (!requests || requests.length === 0) {
+        return '<div style="color: #718096; text-align: center; padding: 20px;"><p>No hay consultas en ejecución</p><div class="realtime-indicator"><span class="pulse-dot"></span><span>En vivo</span></div></div>';
+    }
+    
+    let content = '<table style="width: 100%; border-collapse: collapse;">';
+    content += '<thead style="background: #f7fafc;"><tr>';
+    ['Session', 'Status', 'Command', 'Database', 'Wait Type', 'Elapsed (ms)', 'Blocked By'].forEach(header => {
+        content += '<th style="padding: 10px; text-align: left; border-bottom: 2px solid #e2e8f0;">' + header + '</th>';
+    });
+    content += '</tr></thead><tbody>';
+    requests.forEach(request => {
+        const blockedColor = request.blocking_session_id > 0 ? '#e53e3e' : '#718096';
+        content += '<tr>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + request.session_id + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + request.status + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + request.command + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + request.database + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + (request.wait_type || '-') + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + request.elapsed_ms.toLocaleString() + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0; color: ' + blockedColor + ';">' + (request.blocking_session_id || '-') + '</td>';
+        content += '</tr>';
+    });
+    content += '</tbody></table>';
+    return content;
+}
+
+function renderWaitingLocks(locks) {
+    if (!locks.waiting_locks || locks.waiting_locks.length === 0) {
+        return '<div style="color: #718096; text-align: center; padding: 20px;"><div style="font-size: 2rem; color: #38a169; margin-bottom: 10px;">🔓</div><p>No se detectaron bloqueos activos</p><small style="color: #a0aec0;">' + locks.granted.toLocaleString() + ' locks concedidos</small></div>';
+    }
+    
+    let content = '<table style="width: 100%; border-collapse: collapse;">';
+    content += '<thead style="background: #f7fafc;"><tr>';
+    ['Session', 'Database', 'Resource', 'Mode', 'Blocked By', 'Wait (ms)'].forEach(header => {
+        content += '<th style="padding: 10px; text-align: left; border-bottom: 2px solid #e2e8f0;">' + header + '</th>';
+    });
+    content += '</tr></thead><tbody>';
+    locks.waiting_locks.forEach(lock => {
+        content += '<tr>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + lock.session_id + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + lock.database + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + lock.resource_type + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + lock.mode + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0; color: #e53e3e; font-weight: bold;">' + (lock.blocking_session_id || '-') + '</td>';
+        content += '<td style="padding: 8px; border-bottom: 1px solid #e2e8f0;">' + lock.wait_ms.toLocaleString() + '</td>';
+        content += '</tr>';
+    });
+    content += '</tbody></table>';
+    return content;
+}
+
 async function login() {
     const username = document.getElementById('username').value.trim();
     const password = document.getElementById('password').value.trim();
@@ -765,10 +1054,8 @@ function logout() {
         clearInterval(updateInterval);
         updateInterval = null;
     }
-    if (realtimeInterval) {
-        clearInterval(realtimeInterval);
-        realtimeInterval = null;
-    }
+    closeRealtimeStream();
+    closeSessionsStream();
     
     [systemChart, performanceChart, connectionsChart, diskSpaceChart, growthChart, ioChart, realTimeChart].forEach(chart => {
         if (chart) {
@@ -817,7 +1104,8 @@ function showDashboard() {
     currentTab = 'dashboard';
     
     if (updateInterval) clearInterval(updateInterval);
-    if (realtimeInterval) clearInterval(realtimeInterval);
+    closeRealtimeStream();
+    closeSessionsStream();
     
     setTimeout(() => {
         initializeCharts();
@@ -874,75 +1162,79 @@ function initializeCharts() {
     });
 }
 
-async function updateDashboardOverview() {
+// Un solo request (y un solo batch en SQL Server) para overview + system stats
+async function updateDashboardSnapshot() {
     if (!isAuthenticated) return;
     
     try {
-        const response = await fetch('/api/monitoring/dashboard-overview');
-        const data = await response.json();
+        const data = await fetchMonitoring('/api/monitoring/dashboard-snapshot');
         
-        if (data.error) {
-            console.error('Dashboard overview error:', data.error);
-            document.getElementById('connection-status').textContent = '❌ Error';
+        if (data.error && data.stale) {
+            // Servidor inalcanzable: se muestran las últimas métricas conocidas marcadas como desactualizadas
+            updateDashboardOverview(data.overview);
+            updateSystemStats(data.system_stats);
+            document.getElementById('connection-status').textContent = '⚠️ Sin conexión (datos de hace ' + Math.round(data.snapshot_age) + 's)';
             document.getElementById('connection-status').className = 'status-error';
             return;
         }
         
-        document.getElementById('connection-status').textContent = '✅ Connected';
-        document.getElementById('connection-status').className = 'status-connected';
-        document.getElementById('server-name').textContent = data.server_info.name;
-        document.getElementById('server-uptime').textContent = data.server_info.uptime_days + 'd ' + data.server_info.uptime_hours + 'h';
-        document.getElementById('server-version').textContent = data.server_info.version;
-        
-        document.getElementById('total-sessions').textContent = data.session_stats.total_sessions;
-        document.getElementById('active-sessions').textContent = data.session_stats.active_sessions;
-        document.getElementById('user-databases').textContent = data.database_stats.user_databases;
-        document.getElementById('long-queries').textContent = data.performance_stats.long_running_queries;
-        document.getElementById('io-activity').textContent = data.performance_stats.total_io_mb + ' MB';
+        if (data.error) {
+            console.error('Dashboard snapshot error:', data.error);
+            showDashboardError();
+            document.getElementById('cpu-percent').textContent = 'Error';
+            document.getElementById('memory-percent').textContent = 'Error';
+            document.getElementById('disk-percent').textContent = 'Error';
+            return;
+        }
         
-        updateAlerts(data.alerts);
+        updateDashboardOverview(data.overview);
+        updateSystemStats(data.system_stats);
         
     } catch (error) {
-        console.error('Error updating dashboard overview:', error);
-        document.getElementById('connection-status').textContent = '❌ Error';
-        document.getElementById('connection-status').className = 'status-error';
+        console.error('Error updating dashboard snapshot:', error);
+        showDashboardError();
     }
 }
 
-async function updateSystemStats() {
-    if (!isAuthenticated) return;
+function showDashboardError() {
+    document.getElementById('connection-status').textContent = '❌ Error';
+    document.getElementById('connection-status').className = 'status-error';
+}
+
+function updateDashboardOverview(data) {
+    document.getElementById('connection-status').textContent = '✅ Connected';
+    document.getElementById('connection-status').className = 'status-connected';
+    document.getElementById('server-name').textContent = data.server_info.name;
+    document.getElementById('server-uptime').textContent = data.server_info.uptime_days + 'd ' + data.server_info.uptime_hours + 'h';
+    document.getElementById('server-version').textContent = data.server_info.version;
     
-    try {
-        const response = await fetch('/api/monitoring/system-stats');
-        const data = await response.json();
+    document.getElementById('total-sessions').textContent = data.session_stats.total_sessions;
+    document.getElementById('active-sessions').textContent = data.session_stats.active_sessions;
+    document.getElementById('user-databases').textContent = data.database_stats.user_databases;
+    document.getElementById('long-queries').textContent = data.performance_stats.long_running_queries;
+    document.getElementById('io-activity').textContent = data.performance_stats.total_io_mb + ' MB';
+    
+    updateAlerts(data.alerts);
+}
+
+function updateSystemStats(data) {
+    document.getElementById('cpu-percent').textContent = data.cpu_percent.toFixed(1) + '%';
+    document.getElementById('memory-percent').textContent = data.memory_percent.toFixed(1) + '%';
+    document.getElementById('disk-percent').textContent = data.disk_usage.toFixed(1) + '%';
+    
+    if (systemChart && currentTab === 'dashboard') {
+        const now = new Date().toLocaleTimeString();
+        systemChart.data.labels.push(now);
+        systemChart.data.datasets[0].data.push(data.cpu_percent);
+        systemChart.data.datasets[1].data.push(data.memory_percent);
         
-        if (data.error) {
-            document.getElementById('cpu-percent').textContent = 'Error';
-            document.getElementById('memory-percent').textContent = 'Error';
-            document.getElementById('disk-percent').textContent = 'Error';
-            return;
+        if (systemChart.data.labels.length > 20) {
+            systemChart.data.labels.shift();
+            systemChart.data.datasets[0].data.shift();
+            systemChart.data.datasets[1].data.shift();
         }
         
-        document.getElementById('cpu-percent').textContent = data.cpu_percent.toFixed(1) + '%';
-        document.getElementById('memory-percent').textContent = data.memory_percent.toFixed(1) + '%';
-        document.getElementById('disk-percent').textContent = data.disk_usage.toFixed(1) + '%';
-        
-        if (systemChart && currentTab === 'dashboard') {
-            const now = new Date().toLocaleTimeString();
-            systemChart.data.labels.push(now);
-            systemChart.data.datasets[0].data.push(data.cpu_percent);
-            systemChart.data.datasets[1].data.push(data.memory_percent);
-            
-            if (systemChart.data.labels.length > 20) {
-                systemChart.data.labels.shift();
-                systemChart.data.datasets[0].data.shift();
-                systemChart.data.datasets[1].data.shift();
-            }
-            
-            systemChart.update('none');
-        }
-    } catch (error) {
-        console.error('Error updating system stats:', error);
+        systemChart.update('none');
     }
 }
 
@@ -968,13 +1260,11 @@ function updateAlerts(alerts) {
 function startRealTimeUpdates() {
     if (!isAuthenticated) return;
     
-    updateDashboardOverview();
-    updateSystemStats();
+    updateDashboardSnapshot();
     
     updateInterval = setInterval(() => {
         if (isAuthenticated && currentTab === 'dashboard') {
-            updateDashboardOverview();
-            updateSystemStats();
+            updateDashboardSnapshot();
         }
     }, 5000);
 }